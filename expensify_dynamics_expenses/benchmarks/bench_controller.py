@@ -0,0 +1,245 @@
+"""Throughput benchmark for the dynamics_controller pipeline.
+
+Runs the controller against synthetic Expensify exports with S3 and SQS
+replaced by in-process stubs, and writes rows/sec, peak RSS and exclusive
+time per stage (fetch, parse, format, publish) to a JSON file:
+
+    python -m benchmarks.bench_controller --sizes 1000,100000,1000000
+
+Each size runs in its own interpreter so peak RSS is not inherited from a
+previous run.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+import mock
+
+from benchmarks.synthetic_csv import write_csv
+
+DEFAULT_SIZES = [1000, 100000, 1000000]
+STAGES = ['fetch', 'parse', 'format', 'publish']
+CHUNK_SIZE = 1024 * 1024
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StageTimer(object):
+    # Exclusive timings: a stage's clock is paused while a nested stage runs,
+    # e.g. parse pulling lines from fetch.
+    def __init__(self):
+        self.totals = dict.fromkeys(STAGES, 0.0)
+        self._stack = []
+
+    def wrap(self, stage, function):
+        def timed(*args, **kwargs):
+            self._enter(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._exit()
+
+        return timed
+
+    def wrap_iterator(self, stage, iterable):
+        iterator = iter(iterable)
+        while True:
+            self._enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit()
+            yield item
+
+    def _enter(self, stage):
+        now = time.perf_counter()
+        if self._stack:
+            parent = self._stack[-1]
+            self.totals[parent[0]] += now - parent[1]
+        self._stack.append([stage, now])
+
+    def _exit(self):
+        now = time.perf_counter()
+        stage, started_at = self._stack.pop()
+        self.totals[stage] += now - started_at
+        if self._stack:
+            self._stack[-1][1] = now
+
+
+class StubSqs(object):
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def get_queue_url(self, queue_name):
+        return 'https://sqs.stub/{}'.format(queue_name)
+
+    def send_fifo_message(self, queue_url, message, group_id):
+        self.messages += 1
+        self.bytes += len(json.dumps(message).encode('utf-8'))
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.messages += len(Entries)
+        self.bytes += sum(len(entry['MessageBody'].encode('utf-8')) for entry in Entries)
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+
+def run_once(csv_path, publish_mode):
+    from src import dynamics_controller
+    from src.s3_stream import iter_lines
+    from src.transform import CompiledTransform
+
+    timer = StageTimer()
+    sqs = StubSqs()
+
+    def stub_iter_s3_lines(bucket, key, start=0, chunk_size=CHUNK_SIZE, end=None, fetch_timer=None):
+        chunks = _file_chunks(csv_path, start, chunk_size, end)
+        if fetch_timer is not None:
+            chunks = fetch_timer.wrap(chunks)
+
+        return timer.wrap_iterator('fetch', iter_lines(chunks))
+
+    def timed_reader(lines):
+        return timer.wrap_iterator('parse', csv.reader(lines))
+
+    timed_csv = mock.Mock(reader=timed_reader)
+    environ = {
+        'CSV_INGESTION': 'stream',
+        'SQS_PUBLISH_MODE': publish_mode,
+        'CONTROLLER_RESULT_MODE': 'summary',
+        'DYNAMICS_EXPENSES_ENDPOINT': '/data/IDEO_Expenses',
+        'QUEUE_NAME': 'ExpensesBenchmark.fifo',
+    }
+    event = {'Records': [{'s3': {'bucket': {'name': 'benchmark'}, 'object': {'key': csv_path}}}]}
+
+    with mock.patch.dict('os.environ', environ), \
+            mock.patch('src.dynamics_controller.iter_s3_lines', stub_iter_s3_lines), \
+            mock.patch('src.dynamics_controller.csv', timed_csv), \
+            mock.patch('src.dynamics_controller.sqs_client', sqs), \
+            mock.patch('src.sqs_batch_publisher._get_sqs', return_value=sqs), \
+            mock.patch('src.dynamics_controller.idempotency.get_store', return_value=None), \
+            mock.patch.object(CompiledTransform, 'apply', timer.wrap('format', CompiledTransform.apply)), \
+            mock.patch(
+                'src.dynamics_controller._publish',
+                timer.wrap('publish', dynamics_controller._publish)
+            ):
+        started_at = time.perf_counter()
+        summary = dynamics_controller.start(event, object())[0]
+        elapsed = time.perf_counter() - started_at
+
+    if summary['status'] != 'published':
+        raise RuntimeError('Benchmark run failed: {}'.format(summary.get('error')))
+
+    return {
+        'rows': summary['published'],
+        'bytes_read': summary['bytes_read'],
+        'queue_bytes': sqs.bytes,
+        'seconds': round(elapsed, 4),
+        'rows_per_sec': round(summary['published'] / elapsed, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        'stages': {stage: round(seconds, 4) for stage, seconds in timer.totals.items()},
+    }
+
+
+def run_benchmarks(sizes, publish_mode, work_dir):
+    results = []
+    for row_count in sizes:
+        csv_path = write_csv(os.path.join(work_dir, 'expenses_{}.csv'.format(row_count)), row_count)
+        output = subprocess.check_output(
+            [
+                sys.executable, '-m', 'benchmarks.bench_controller',
+                '--child', csv_path,
+                '--publish-mode', publish_mode,
+            ],
+            cwd=PACKAGE_DIR
+        )
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        result['size'] = row_count
+        results.append(result)
+        print(
+            '{size:>9} rows  {rows_per_sec:>10} rows/s  {peak_rss_mb:>8} MB peak  {stages}'.format(**result),
+            file=sys.stderr
+        )
+
+    return results
+
+
+def _file_chunks(path, start, chunk_size, end=None):
+    # end is exclusive, like the Range the real reader sends to S3.
+    with open(path, 'rb') as csv_file:
+        csv_file.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            chunk = csv_file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=PACKAGE_DIR,
+            stderr=subprocess.DEVNULL
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES))
+    arg_parser.add_argument('--publish-mode', choices=['single', 'batch'], default='batch')
+    arg_parser.add_argument('--output', help='defaults to benchmark_results/controller-<timestamp>.json')
+    arg_parser.add_argument('--child', metavar='CSV_PATH', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_once(args.child, args.publish_mode)))
+        return
+
+    started_at = datetime.utcnow()
+    work_dir = tempfile.mkdtemp(prefix='controller-benchmark-')
+    try:
+        results = run_benchmarks([int(size) for size in args.sizes.split(',')], args.publish_mode, work_dir)
+    finally:
+        for name in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, name))
+        os.rmdir(work_dir)
+
+    output_path = args.output or os.path.join(
+        PACKAGE_DIR,
+        'benchmark_results',
+        'controller-{}.json'.format(started_at.strftime('%Y%m%dT%H%M%SZ'))
+    )
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as output_file:
+        json.dump(
+            {
+                'benchmark': 'dynamics_controller',
+                'started_at': started_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'revision': _git_revision(),
+                'python': platform.python_version(),
+                'publish_mode': args.publish_mode,
+                'results': results,
+            },
+            output_file,
+            indent=2
+        )
+    print(output_path)
+
+
+if __name__ == '__main__':
+    main()
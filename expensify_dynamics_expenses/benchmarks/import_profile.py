@@ -0,0 +1,107 @@
+"""Cold-start import cost of each Lambda handler module.
+
+Imports every handler from serverless.yml in a fresh interpreter with
+``-X importtime`` and reports the total plus a per-package and per-module
+breakdown, as a table on stderr and JSON on stdout or --output:
+
+    python -m benchmarks.import_profile --top 15
+
+The Lambda runtime is Python 3.6, which has no -X importtime, so run this
+with a local Python 3.7+ interpreter against the same dependencies.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+HANDLER_MODULES = [
+    'src.dynamics_controller',
+    'src.trigger_report',
+    'src.filtering_dynamics_client',
+    'src.adaptive_starter',
+    'lib.sqs_next_lambda_starter',
+]
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+def profile_module(module_name):
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module_name)],
+        cwd=PACKAGE_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    if process.returncode:
+        return {'module': module_name, 'error': process.stderr.decode('utf-8').strip().splitlines()[-1]}
+
+    modules = parse_import_times(process.stderr.decode('utf-8'))
+    packages = {}
+    for imported in modules:
+        package = imported['name'].split('.')[0]
+        packages[package] = packages.get(package, 0) + imported['self_us']
+
+    handler = next((imported for imported in modules if imported['name'] == module_name), None)
+    return {
+        'module': module_name,
+        'total_ms': round((handler['cumulative_us'] if handler else 0) / 1000.0, 2),
+        'packages_ms': {
+            package: round(self_us / 1000.0, 2)
+            for package, self_us in sorted(packages.items(), key=lambda item: -item[1])
+        },
+        'modules': [
+            {
+                'name': imported['name'],
+                'self_ms': round(imported['self_us'] / 1000.0, 2),
+                'cumulative_ms': round(imported['cumulative_us'] / 1000.0, 2),
+            }
+            for imported in sorted(modules, key=lambda imported: -imported['self_us'])
+        ],
+    }
+
+
+def parse_import_times(output):
+    modules = []
+    for line in output.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match:
+            modules.append({
+                'name': match.group(4),
+                'self_us': int(match.group(1)),
+                'cumulative_us': int(match.group(2)),
+            })
+
+    return modules
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('modules', nargs='*', default=HANDLER_MODULES)
+    arg_parser.add_argument('--top', type=int, default=10, help='modules listed per handler')
+    arg_parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = arg_parser.parse_args(argv)
+
+    report = []
+    for module_name in args.modules:
+        profile = profile_module(module_name)
+        if 'error' in profile:
+            print('{module}: failed to import ({error})'.format(**profile), file=sys.stderr)
+        else:
+            profile['modules'] = profile['modules'][:args.top]
+            print('{module}: {total_ms} ms'.format(**profile), file=sys.stderr)
+            for package, self_ms in list(profile['packages_ms'].items())[:args.top]:
+                print('    {:<30} {:>9} ms'.format(package, self_ms), file=sys.stderr)
+        report.append(profile)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,549 @@
+"""End-to-end replay of the export pipeline against local stand-ins.
+
+Runs trigger_report.execute -> dynamics_controller.start -> FIFO queue ->
+filtering_dynamics_client.api_post in one process. S3 and SQS are
+in-memory fakes (the queue keeps FIFO message-group semantics) and D365 is
+a local HTTP server with configurable latency and 429 injection. Reports
+per-expense latency percentiles and throughput, and writes them to
+benchmark_results/replay-<timestamp>.json:
+
+    python -m benchmarks.replay --rows 20000 --files 4 --consumers 16 \\
+        --latency-ms 40 --throttle-rate 0.02 --group-strategy sharded
+
+--split-parts replays the controller's range split, keeping the split state
+in an in-memory DynamoDB.
+"""
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import mock
+
+from benchmarks.bench_controller import _git_revision
+from benchmarks.synthetic_csv import HEADERS, iter_rows
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXPORT_BUCKET = 'replay-exports'
+TEMPLATE_BUCKET = 'replay-templates'
+QUEUE_NAME = 'ExpensesReplay.fifo'
+LAMBDA_TIMEOUT_MS = 300000
+MAX_RECEIVES = 5
+PERCENTILES = [50, 90, 95, 99]
+
+
+class FakeBody(object):
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def iter_chunks(self, chunk_size=1024):
+        chunk = self._stream.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = self._stream.read(chunk_size)
+
+    def close(self):
+        pass
+
+
+class FakeS3(object):
+    def __init__(self):
+        self.objects = {}
+        self.created_at = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        body = Body.encode('utf-8') if isinstance(Body, str) else Body
+        with self._lock:
+            self.objects[(Bucket, Key)] = body
+            self.created_at[(Bucket, Key)] = time.time()
+        return {'ETag': _etag(body)}
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None, **kwargs):
+        with self._lock:
+            body = self.objects.get((Bucket, Key))
+        if body is None:
+            raise _ClientError('NoSuchKey', 404)
+        if IfNoneMatch and IfNoneMatch == _etag(body):
+            raise _ClientError('NotModified', 304)
+        if Range:
+            body = body[_byte_slice(Range)]
+
+        return {'Body': FakeBody(body), 'ETag': _etag(body), 'ContentLength': len(body)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            body = self.objects.get((Bucket, Key))
+        if body is None:
+            raise _ClientError('NoSuchKey', 404)
+
+        return {'ETag': _etag(body), 'ContentLength': len(body)}
+
+    def fetch_from_s3(self, bucket, key):
+        return self.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+
+class _ClientError(Exception):
+    def __init__(self, code, status_code):
+        Exception.__init__(self, code)
+        self.response = {'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status_code}}
+
+
+def _byte_slice(byte_range):
+    # 'bytes=a-b' is inclusive of b; 'bytes=a-' runs to the end.
+    start, end = byte_range[len('bytes='):].split('-')
+    return slice(int(start), int(end) + 1 if end else None)
+
+
+class FakeDynamoDB(object):
+    # Just enough of update_item for range_split.record_part: SET one
+    # attribute, ADD to a string set, and return ALL_NEW.
+    def __init__(self):
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def update_item(self, TableName, Key, ExpressionAttributeNames, ExpressionAttributeValues, **kwargs):
+        with self._lock:
+            item = self.items.setdefault((TableName, Key['pk']['S']), {'pk': Key['pk']})
+            for name in ExpressionAttributeNames.values():
+                item[name] = ExpressionAttributeValues[':summary']
+            item['expires_at'] = ExpressionAttributeValues[':expires_at']
+            parts = set(item.get('parts_done', {}).get('SS', [])) | set(ExpressionAttributeValues[':part']['SS'])
+            item['parts_done'] = {'SS': sorted(parts)}
+            return {'Attributes': dict(item)}
+
+
+def _etag(body):
+    return '"{}"'.format(hashlib.md5(body).hexdigest())
+
+
+class FakeFifoQueue(object):
+    # FIFO semantics: messages of a group are delivered in order, and no
+    # message of a group is handed out while an earlier one is in flight.
+    # Identical bodies are deduplicated as with ContentBasedDeduplication.
+    def __init__(self):
+        self.groups = OrderedDict()
+        self.in_flight = {}
+        self.source_key = None
+        self.sent = 0
+        self.deduplicated = 0
+        self._deduplication_ids = set()
+        self._sequence = 0
+        self._condition = threading.Condition()
+
+    def get_queue_url(self, queue_name):
+        return 'https://sqs.replay/{}'.format(queue_name)
+
+    def send_fifo_message(self, queue_url, message, group_id):
+        self._enqueue(json.dumps(message), str(group_id))
+
+    def send_message_batch(self, QueueUrl, Entries):
+        for entry in Entries:
+            self._enqueue(entry['MessageBody'], entry['MessageGroupId'])
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+    def _enqueue(self, body, group_id):
+        deduplication_id = hashlib.sha256(body.encode('utf-8')).hexdigest()
+        with self._condition:
+            if deduplication_id in self._deduplication_ids:
+                self.deduplicated += 1
+                return
+
+            self._deduplication_ids.add(deduplication_id)
+            self._sequence += 1
+            message = {
+                'id': self._sequence,
+                'body': body,
+                'group_id': group_id,
+                'sent_at': time.time(),
+                'source_key': self.source_key,
+                'visible_at': 0,
+                'receives': 0,
+            }
+            self.groups.setdefault(group_id, deque()).append(message)
+            self.sent += 1
+            self._condition.notify()
+
+    def receive(self, timeout):
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                now = time.time()
+                for group_id, messages in self.groups.items():
+                    if group_id not in self.in_flight and messages and messages[0]['visible_at'] <= now:
+                        message = messages[0]
+                        message['receives'] += 1
+                        self.in_flight[group_id] = message
+                        return message
+
+                if now >= deadline:
+                    return None
+                self._condition.wait(min(0.05, deadline - now))
+
+    def delete(self, message):
+        with self._condition:
+            self.groups[message['group_id']].popleft()
+            del self.in_flight[message['group_id']]
+            self._condition.notify_all()
+
+    def release(self, message, delay_seconds):
+        with self._condition:
+            message['visible_at'] = time.time() + delay_seconds
+            del self.in_flight[message['group_id']]
+            self._condition.notify_all()
+
+    def depth(self):
+        with self._condition:
+            return sum(len(messages) for messages in self.groups.values())
+
+
+class FakeContext(object):
+    def __init__(self, function_name, timeout_ms=LAMBDA_TIMEOUT_MS):
+        self.function_name = function_name
+        self._deadline = time.time() + timeout_ms / 1000.0
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.time()) * 1000)
+
+
+class FakeDynamics(object):
+    # D365 stand-in: each expense POST sleeps for the configured latency and
+    # is answered 429 at random (throttle_rate) or once the per-second
+    # capacity is used up.
+    def __init__(self, latency_ms, jitter_ms, throttle_rate, capacity, retry_after, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.accepted = 0
+        self.throttled = 0
+        self._rng = random.Random(seed)
+        self._window = deque()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        dynamics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path in ('/token', '/oauth2/token'):
+                    self._respond(200, {'access_token': 'replay-token', 'expires_in': 3600})
+                    return
+
+                status_code, delay = dynamics._decide()
+                time.sleep(delay)
+                if status_code == 429:
+                    self._respond(429, {'error': 'throttled'}, {'Retry-After': str(dynamics.retry_after)})
+                else:
+                    self._respond(201, json.loads(body.decode('utf-8') or '{}'))
+
+            def _respond(self, status_code, payload, headers=None):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _decide(self):
+        with self._lock:
+            now = time.time()
+            while self._window and self._window[0] <= now - 1:
+                self._window.popleft()
+
+            if self._rng.random() < self.throttle_rate or (self.capacity and len(self._window) >= self.capacity):
+                self.throttled += 1
+                return 429, 0.001
+
+            self._window.append(now)
+            self.accepted += 1
+            jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+            return 201, max(0, self.latency_ms + jitter) / 1000.0
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeExpensify(object):
+    # Stands in for Expensify plus the SFTP drop: every export request lands
+    # its CSV in the export bucket, one file per shard.
+    def __init__(self, s3, row_count, file_count):
+        self.s3 = s3
+        self.rows_per_file = max(1, row_count // file_count)
+        self.keys = []
+        self._lock = threading.Lock()
+
+    def api_post(self, event, context):
+        with self._lock:
+            shard = len(self.keys)
+            key = '{}.csv'.format(event['request_config']['outputSettings']['fileBasename'])
+            self.keys.append(key)
+
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\r\n')
+        writer.writerow(HEADERS)
+        writer.writerows(iter_rows(self.rows_per_file, seed=shard, first_index=shard * self.rows_per_file))
+        self.s3.put_object(Bucket=EXPORT_BUCKET, Key=key, Body=output.getvalue().encode('utf-8'))
+
+        return mock.Mock(status_code=200, text=key)
+
+
+def run_replay(args):
+    from src import trigger_report, dynamics_controller, filtering_dynamics_client
+
+    s3 = FakeS3()
+    queue = FakeFifoQueue()
+    expensify = FakeExpensify(s3, args.rows, args.files)
+    dynamics = FakeDynamics(
+        args.latency_ms, args.latency_jitter_ms, args.throttle_rate, args.d365_capacity, args.retry_after
+    )
+    base_url = dynamics.start()
+    _seed_config(s3, args.files)
+
+    environ = {
+        'TEMPLATE_BUCKET_NAME': TEMPLATE_BUCKET,
+        'TEMPLATE_BUCKET_KEY': 'template.rtf',
+        'REQUIREMENTS_BUCKET_KEY': 'requirements.json',
+        'HOST': 'sftp.replay',
+        'LOGIN': 'replay',
+        'PASSWORD': 'replay',
+        'EXPORT_POLICY_SHARDS': str(args.files),
+        'DYNAMICS_EXPENSES_ENDPOINT': '/data/IDEO_Expenses',
+        'DYNAMICS_BASE_URL': base_url,
+        'DYNAMICS_CLIENT_ID': 'replay',
+        'DYNAMICS_USER_NAME': 'replay',
+        'DYNAMICS_USER_PASSWORD': 'replay',
+        'QUEUE_NAME': QUEUE_NAME,
+        'CSV_INGESTION': 'stream',
+        'SQS_PUBLISH_MODE': 'batch',
+        'CONTROLLER_RESULT_MODE': 'summary',
+        'MESSAGE_GROUP_STRATEGY': args.group_strategy,
+        'MESSAGE_ENCODING': args.encoding,
+        'PUBLISH_ENGINE': args.publish_engine,
+        'CLAIM_CHECK_BUCKET': 'replay-claim-check',
+        'DYNAMICS_AUTHORITY': base_url,
+    }
+    if args.split_parts:
+        # Splitting also needs sharded message groups and a minimum size.
+        environ.update(
+            CONTROLLER_MODE='split',
+            MESSAGE_GROUP_STRATEGY='sharded',
+            SPLIT_PARTS=str(args.split_parts),
+            SPLIT_MIN_BYTES=str(args.split_min_bytes),
+            STATE_TABLE_NAME='replay-state'
+        )
+    if args.rate_limit:
+        environ.update(RATE_LIMIT_STORE='memory', DYNAMICS_RATE_LIMIT=str(args.rate_limit))
+
+    latencies = {'queue': [], 'export': []}
+    failures = []
+    record_lock = threading.Lock()
+
+    def consume(stop):
+        while not stop.is_set():
+            message = queue.receive(timeout=0.1)
+            if message is None:
+                continue
+
+            try:
+                filtering_dynamics_client.api_post(json.loads(message['body']), FakeContext('dynamics-client'))
+            except filtering_dynamics_client.DynamicsThrottledError:
+                queue.release(message, args.retry_after)
+                continue
+            except Exception as error:
+                if message['receives'] < MAX_RECEIVES:
+                    queue.release(message, 0.1)
+                else:
+                    queue.delete(message)
+                    with record_lock:
+                        failures.append(str(error))
+                continue
+
+            accepted_at = time.time()
+            queue.delete(message)
+            with record_lock:
+                latencies['queue'].append((accepted_at - message['sent_at']) * 1000)
+                latencies['export'].append(
+                    (accepted_at - s3.created_at[(EXPORT_BUCKET, message['source_key'])]) * 1000
+                )
+
+    patches = [
+        mock.patch.dict('os.environ', environ),
+        mock.patch('src.trigger_report.api_post', expensify.api_post),
+        mock.patch('src.trigger_report.fetch_from_s3', s3.fetch_from_s3),
+        mock.patch('src.dynamics_controller.fetch_from_s3', s3.fetch_from_s3),
+        mock.patch('src.dynamics_controller.sqs_client', queue),
+        mock.patch('src.dynamics_controller.invoke_async', lambda name, payload: continuations.append(payload)),
+        mock.patch('src.sqs_batch_publisher._get_sqs', return_value=queue),
+        mock.patch('src.s3_stream._get_s3', return_value=s3),
+        mock.patch('src.message_envelope._get_s3', return_value=s3),
+        mock.patch('src.message_envelope.fetch_from_s3', s3.fetch_from_s3),
+        mock.patch('src.range_split._get_dynamodb', return_value=FakeDynamoDB()),
+    ]
+    continuations = []
+    stop = threading.Event()
+    consumers = [threading.Thread(target=consume, args=(stop,)) for _ in range(args.consumers)]
+
+    for patch in patches:
+        patch.start()
+    try:
+        started_at = time.time()
+        for consumer in consumers:
+            consumer.start()
+
+        trigger_started_at = time.time()
+        trigger_report.execute({}, FakeContext('trigger-report'))
+        trigger_seconds = time.time() - trigger_started_at
+
+        controller_started_at = time.time()
+        summaries = []
+        for key in expensify.keys:
+            queue.source_key = key
+            event = {'Records': [{'s3': {'bucket': {'name': EXPORT_BUCKET}, 'object': {'key': key}}}]}
+            summaries.extend(dynamics_controller.start(event, FakeContext('controller')))
+            while continuations:
+                summaries.extend(dynamics_controller.start(continuations.pop(0), FakeContext('controller')))
+        controller_seconds = time.time() - controller_started_at
+
+        while queue.depth() and (time.time() - started_at) < args.max_seconds:
+            time.sleep(0.05)
+        elapsed = time.time() - started_at
+    finally:
+        stop.set()
+        for consumer in consumers:
+            consumer.join()
+        for patch in reversed(patches):
+            patch.stop()
+        dynamics.stop()
+
+    delivered = len(latencies['queue'])
+    return {
+        'rows': expensify.rows_per_file * len(expensify.keys),
+        'files': len(expensify.keys),
+        'published': sum(summary.get('published', 0) for summary in summaries),
+        'delivered': delivered,
+        'failed': len(failures),
+        'undelivered': queue.depth(),
+        'continuations': len(summaries) - len(expensify.keys),
+        'deduplicated': queue.deduplicated,
+        'd365_accepted': dynamics.accepted,
+        'd365_throttled': dynamics.throttled,
+        'seconds': round(elapsed, 3),
+        'trigger_seconds': round(trigger_seconds, 3),
+        'controller_seconds': round(controller_seconds, 3),
+        'throughput_per_sec': round(delivered / elapsed, 1) if elapsed else None,
+        'queue_to_d365_ms': _percentiles(latencies['queue']),
+        'export_to_d365_ms': _percentiles(latencies['export']),
+    }
+
+
+def _seed_config(s3, file_count):
+    s3.put_object(Bucket=TEMPLATE_BUCKET, Key='template.rtf', Body=b'<#-- replay template -->')
+    s3.put_object(Bucket=TEMPLATE_BUCKET, Key='requirements.json', Body=json.dumps({
+        'startDate': '2018-05-01',
+        'reportLabel': 'replay',
+        'policyIDList': ','.join('P{}'.format(index) for index in range(max(1, file_count))),
+        'limit': '100000',
+        'reportState': 'APPROVED,REIMBURSED',
+        'reportType': 'combinedReportData',
+        'fileBasename': 'ideoExpenses',
+        'fileExtension': 'csv',
+    }).encode('utf-8'))
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+
+    values = sorted(values)
+    result = {
+        'p{}'.format(percentile): round(values[min(len(values) - 1, int(len(values) * percentile / 100.0))], 1)
+        for percentile in PERCENTILES
+    }
+    result['max'] = round(values[-1], 1)
+    return result
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--rows', type=int, default=2000, help='expenses across all exported files')
+    arg_parser.add_argument('--files', type=int, default=1, help='export shards (one CSV each)')
+    arg_parser.add_argument('--consumers', type=int, default=8, help='concurrent dynamics-client invocations')
+    arg_parser.add_argument('--latency-ms', type=float, default=50, help='mean D365 response time')
+    arg_parser.add_argument('--latency-jitter-ms', type=float, default=20)
+    arg_parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of D365 calls answered 429')
+    arg_parser.add_argument('--d365-capacity', type=int, default=0, help='requests/sec before 429s, 0 for no limit')
+    arg_parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429s')
+    arg_parser.add_argument('--rate-limit', type=float, default=0, help='client token-bucket rate, 0 to disable')
+    arg_parser.add_argument('--group-strategy', choices=['batch', 'sharded'], default='batch')
+    arg_parser.add_argument('--encoding', choices=['json', 'compact'], default='json')
+    arg_parser.add_argument('--publish-engine', choices=['serial', 'pipelined'], default='serial')
+    arg_parser.add_argument('--split-parts', type=int, default=0, help='range-split each export, 0 to disable')
+    arg_parser.add_argument('--split-min-bytes', type=int, default=1, help='smallest export that is split')
+    arg_parser.add_argument('--max-seconds', type=float, default=600, help='give up draining the queue after this')
+    arg_parser.add_argument('--output', help='defaults to benchmark_results/replay-<timestamp>.json')
+    args = arg_parser.parse_args(argv)
+
+    started_at = datetime.utcnow()
+    result = run_replay(args)
+    print(
+        '{delivered}/{rows} delivered in {seconds}s  {throughput_per_sec}/s  '
+        '429s {d365_throttled}  queue->D365 {queue_to_d365_ms}'.format(**result),
+        file=sys.stderr
+    )
+
+    output_path = args.output or os.path.join(
+        PACKAGE_DIR,
+        'benchmark_results',
+        'replay-{}.json'.format(started_at.strftime('%Y%m%dT%H%M%SZ'))
+    )
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as output_file:
+        json.dump(
+            {
+                'benchmark': 'replay',
+                'started_at': started_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'revision': _git_revision(),
+                'python': platform.python_version(),
+                'settings': vars(args),
+                'result': result,
+            },
+            output_file,
+            indent=2
+        )
+    print(output_path)
+
+
+if __name__ == '__main__':
+    main()
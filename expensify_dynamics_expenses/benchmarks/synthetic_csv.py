@@ -0,0 +1,58 @@
+import csv
+import random
+from datetime import date, timedelta
+
+from lib.expensify_constants import EXPENSE_UNIQUE_ID
+
+HEADERS = [
+    'BatchID',
+    'MerchantID',
+    'ProjectID',
+    'ProjectIDEntity',
+    'MessageDateTime',
+    'Amount',
+    'TransDate',
+    EXPENSE_UNIQUE_ID,
+    'ReportID',
+    'EmployeeEmail',
+    'Category',
+    'CurrencyCode',
+    'Description',
+]
+
+ENTITIES = ['USA', 'DEU', 'GBR', 'JPN', 'CHN']
+CATEGORIES = ['Meals', 'Airfare', 'Lodging', 'Taxi', 'Supplies', 'Software']
+CURRENCIES = ['USD', 'EUR', 'GBP', 'JPY', 'CNY']
+ROWS_PER_BATCH = 5000
+FIRST_DAY = date(2018, 5, 1)
+
+
+def iter_rows(row_count, seed=0, first_index=0):
+    rng = random.Random(seed)
+    for index in range(first_index, first_index + row_count):
+        day = FIRST_DAY + timedelta(days=rng.randrange(365))
+        date_string = '{d.month:02}/{d.day:02}/{d.year}'.format(d=day)
+        yield [
+            str(1000 + index // ROWS_PER_BATCH),
+            str(rng.randrange(1, 5000)),
+            str(rng.randrange(10000, 99999)),
+            rng.choice(ENTITIES),
+            date_string,
+            '{:.2f}'.format(rng.uniform(1, 2500)),
+            date_string,
+            'expense-{}'.format(index),
+            str(50000 + index // 20),
+            'employee{}@ideo.com'.format(rng.randrange(800)),
+            rng.choice(CATEGORIES),
+            rng.choice(CURRENCIES),
+            ' '.join(rng.choice(CATEGORIES).lower() for _ in range(rng.randrange(1, 12))),
+        ]
+
+
+def write_csv(path, row_count, seed=0):
+    with open(path, 'w', encoding='utf-8', newline='') as csv_file:
+        writer = csv.writer(csv_file, lineterminator='\r\n')
+        writer.writerow(HEADERS)
+        writer.writerows(iter_rows(row_count, seed))
+
+    return path
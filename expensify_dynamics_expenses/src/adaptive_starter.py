@@ -0,0 +1,349 @@
+import os
+import re
+import json
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from lib import sqs_client
+from src import aws_clients, metrics
+from src.lazy_import import lazy_callable
+
+fixed_dispatch = lazy_callable('lib.sqs_next_lambda_starter', 'execute')
+
+# Lambda's root logger only passes warnings; scheduler decisions are INFO.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SCHEDULER_KEY = 'scheduler#{}'
+RECEIVE_BATCH_SIZE = 10
+TICK_BUDGET_MS = 50000
+# Longest a single dispatch may take: the client's in-invocation retry budget
+# plus a D365 call. No invoke starts later than this before the tick budget
+# runs out, so a tick finishes before the next scheduled one begins.
+INVOKE_BUDGET_MS = 15000
+DISPATCH_MARGIN_MS = 10000
+DECREASE_FACTOR = 0.5
+LATENCY_SMOOTHING = 0.5
+DEFAULT_RETRY_AFTER_SECONDS = 30
+DISPATCH_BATCH_SIZE = 1
+
+DEFAULT_LIMITS = {
+    'message_limit': 200,
+    'message_limit_floor': 20,
+    'message_limit_ceiling': 1000,
+    'message_limit_step': 20,
+    'concurrency_floor': 1,
+    'concurrency_ceiling': 10,
+    'latency_target_ms': 2000,
+}
+
+_RETRY_AFTER = re.compile(r'Retry-After (\d+)')
+
+_get_sqs = aws_clients.getter('sqs')
+_get_lambda = aws_clients.getter('lambda')
+_get_dynamodb = aws_clients.getter('dynamodb')
+
+
+@metrics.instrumented
+def execute(event, context):
+    if os.environ.get('DISPATCH_MODE') != 'adaptive':
+        return fixed_dispatch(event, context)
+
+    limits = _limits()
+    state = _load_state(limits)
+    started_at = time.time()
+    queue_url = sqs_client.get_queue_url(os.environ['SOURCE_QUEUE_NAME'])
+    depth = _queue_depth(queue_url)
+
+    if state['throttled_until'] > started_at:
+        outcome = _new_outcome()
+        decision = dict(state, reason='waiting')
+    else:
+        messages = _receive(queue_url, min(depth, state['message_limit']))
+        outcome = _dispatch(queue_url, messages, state['concurrency'], _deadline(context, started_at))
+        decision = next_state(state, outcome, depth, limits, time.time())
+        _save_state(decision)
+
+    _log_decision(decision, outcome, depth)
+    return decision
+
+
+def next_state(state, outcome, depth, limits, now):
+    # Additive increase while a full tick still leaves a backlog, multiplicative
+    # decrease on D365 throttling or when latency runs over the target.
+    latency_ms = state['latency_ms']
+    if outcome['latencies']:
+        tick_latency_ms = sum(outcome['latencies']) / len(outcome['latencies'])
+        latency_ms = tick_latency_ms if not latency_ms else (
+            LATENCY_SMOOTHING * tick_latency_ms + (1 - LATENCY_SMOOTHING) * latency_ms
+        )
+
+    message_limit = state['message_limit']
+    concurrency = state['concurrency']
+    throttled_until = 0
+    if outcome['throttled']:
+        reason = 'throttled'
+        throttled_until = now + outcome['retry_after']
+        message_limit *= DECREASE_FACTOR
+        concurrency *= DECREASE_FACTOR
+    elif latency_ms > limits['latency_target_ms']:
+        reason = 'slow'
+        message_limit *= DECREASE_FACTOR
+        concurrency *= DECREASE_FACTOR
+    elif not outcome['failed'] and outcome['dispatched'] >= message_limit and depth > outcome['dispatched']:
+        reason = 'backlog'
+        message_limit += limits['message_limit_step']
+        concurrency += 1
+    else:
+        reason = 'steady'
+
+    return {
+        'message_limit': _clamp(int(message_limit), limits['message_limit_floor'], limits['message_limit_ceiling']),
+        'concurrency': _clamp(int(concurrency), limits['concurrency_floor'], limits['concurrency_ceiling']),
+        'latency_ms': int(latency_ms),
+        'throttled_until': int(throttled_until),
+        'reason': reason,
+    }
+
+
+def _limits():
+    return {
+        name: int(os.environ.get(name.upper(), default))
+        for name, default in DEFAULT_LIMITS.items()
+    }
+
+
+def _clamp(value, floor, ceiling):
+    return max(floor, min(ceiling, value))
+
+
+def _deadline(context, started_at):
+    deadline = started_at + (TICK_BUDGET_MS - INVOKE_BUDGET_MS) / 1000.0
+    get_remaining_time = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining_time is not None:
+        deadline = min(deadline, started_at + (get_remaining_time() - DISPATCH_MARGIN_MS) / 1000.0)
+
+    return deadline
+
+
+def _queue_depth(queue_url):
+    attributes = _get_sqs().get_queue_attributes(
+        QueueUrl=queue_url,
+        AttributeNames=['ApproximateNumberOfMessages']
+    )['Attributes']
+
+    return int(attributes['ApproximateNumberOfMessages'])
+
+
+def _receive(queue_url, count):
+    messages = []
+    while len(messages) < count:
+        received = _get_sqs().receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=min(RECEIVE_BATCH_SIZE, count - len(messages)),
+            AttributeNames=['MessageGroupId'],
+            WaitTimeSeconds=0
+        ).get('Messages', [])
+        if not received:
+            break
+        messages.extend(received)
+
+    return messages
+
+
+def _new_outcome():
+    return {
+        'dispatched': 0,
+        'succeeded': 0,
+        'failed': 0,
+        'throttled': 0,
+        'released': 0,
+        'retry_after': 0,
+        'latencies': [],
+    }
+
+
+def _dispatch(queue_url, messages, concurrency, deadline):
+    # Groups run concurrently but each group is sent in order, so FIFO
+    # ordering per MessageGroupId is kept.
+    groups = OrderedDict()
+    for message in messages:
+        groups.setdefault(message.get('Attributes', {}).get('MessageGroupId'), []).append(message)
+
+    outcome = _new_outcome()
+    if not groups:
+        return outcome
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(groups), concurrency))) as executor:
+        results = list(executor.map(
+            lambda group: _dispatch_group(queue_url, group, deadline),
+            groups.values()
+        ))
+
+    for result in results:
+        for name in ['dispatched', 'succeeded', 'failed', 'throttled', 'released']:
+            outcome[name] += result[name]
+        outcome['retry_after'] = max(outcome['retry_after'], result['retry_after'])
+        outcome['latencies'].extend(result['latencies'])
+
+    return outcome
+
+
+def _dispatch_group(queue_url, messages, deadline):
+    # With DISPATCH_BATCH_SIZE > 1 consecutive messages of the group go to
+    # NEXT_LAMBDA together as one $batch; otherwise each is its own invoke.
+    result = _new_outcome()
+    batch_size = int(os.environ.get('DISPATCH_BATCH_SIZE', DISPATCH_BATCH_SIZE))
+    for index in range(0, len(messages), batch_size):
+        if time.time() >= deadline:
+            _release(queue_url, messages[index:], 0)
+            result['released'] += len(messages) - index
+            break
+
+        batch = messages[index:index + batch_size]
+        started_at = time.time()
+        response = _get_lambda().invoke(
+            FunctionName=os.environ['NEXT_LAMBDA'],
+            InvocationType='RequestResponse',
+            Payload=_payload(batch, batch_size)
+        )
+        result['latencies'].append((time.time() - started_at) * 1000)
+        result['dispatched'] += len(batch)
+
+        if 'FunctionError' not in response:
+            payload = _response_payload(response)
+            if payload.get('throttled'):
+                # D365 throttled before the client's retries got through;
+                # still a signal to back off, without waiting anything out.
+                result['throttled'] += 1
+
+            failed_at = None
+            for position, item in enumerate(payload.get('results') or [{'success': True}] * len(batch)):
+                if not item.get('success'):
+                    failed_at = index + position
+                    break
+                _get_sqs().delete_message(QueueUrl=queue_url, ReceiptHandle=batch[position]['ReceiptHandle'])
+                result['succeeded'] += 1
+            if failed_at is None:
+                continue
+
+            # The first failed item is left for the queue's visibility timeout,
+            # like a failed single message. The items after it are released
+            # undeleted even if they succeeded, so none overtakes it.
+            result['failed'] += 1
+            released = messages[failed_at + 1:]
+        else:
+            error = json.loads(response['Payload'].read() or b'{}')
+            if error.get('errorType') == 'DynamicsThrottledError':
+                # The throttled messages and the rest of their group come
+                # back once D365's Retry-After has passed.
+                result['throttled'] += 1
+                result['retry_after'] = _retry_after(error)
+                released = messages[index:]
+            else:
+                # A failed invoke's first message becomes visible again after
+                # the queue's visibility timeout, ahead of the rest of its group.
+                result['failed'] += 1
+                released = messages[index + 1:]
+        _release(queue_url, released, result['retry_after'])
+        result['released'] += len(released)
+        break
+
+    return result
+
+
+def _payload(batch, batch_size):
+    if batch_size == 1:
+        return batch[0]['Body'].encode('utf-8')
+
+    return json.dumps({'messages': [json.loads(message['Body']) for message in batch]}).encode('utf-8')
+
+
+def _response_payload(response):
+    if 'Payload' not in response:
+        return {}
+
+    payload = json.loads(response['Payload'].read() or b'null')
+    return payload if isinstance(payload, dict) else {}
+
+
+def _retry_after(error):
+    match = _RETRY_AFTER.search(error.get('errorMessage', ''))
+    return int(match.group(1)) if match else DEFAULT_RETRY_AFTER_SECONDS
+
+
+def _release(queue_url, messages, visibility_timeout):
+    for start in range(0, len(messages), RECEIVE_BATCH_SIZE):
+        _get_sqs().change_message_visibility_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {
+                    'Id': str(index),
+                    'ReceiptHandle': message['ReceiptHandle'],
+                    'VisibilityTimeout': visibility_timeout,
+                }
+                for index, message in enumerate(messages[start:start + RECEIVE_BATCH_SIZE])
+            ]
+        )
+
+
+def _log_decision(decision, outcome, depth):
+    # Always written to the log; also carried on the EMF line when metrics are on.
+    latencies = outcome['latencies']
+    entry = {
+        'scheduler': decision['reason'],
+        'queue_depth': depth,
+        'message_limit': decision['message_limit'],
+        'concurrency': decision['concurrency'],
+        'latency_ms': decision['latency_ms'],
+        'throttled_until': decision['throttled_until'],
+        'dispatched': outcome['dispatched'],
+        'succeeded': outcome['succeeded'],
+        'failed': outcome['failed'],
+        'throttled': outcome['throttled'],
+        'released': outcome['released'],
+        'tick_latency_ms': int(sum(latencies) / len(latencies)) if latencies else None,
+    }
+    logger.info(json.dumps(entry))
+    metrics.put_property('scheduler', entry)
+    metrics.record('QueueDepth', depth, 'Count')
+    metrics.record('MessageLimit', decision['message_limit'], 'Count')
+    metrics.record('DispatchConcurrency', decision['concurrency'], 'Count')
+    metrics.count('MessagesDispatched', outcome['dispatched'])
+    metrics.count('MessagesThrottled', outcome['throttled'])
+    for latency_ms in latencies:
+        metrics.record('DispatchLatency', latency_ms)
+
+
+def _load_state(limits):
+    item = _get_dynamodb().get_item(
+        TableName=os.environ['STATE_TABLE_NAME'],
+        Key={'pk': {'S': _state_key()}},
+        ConsistentRead=True
+    ).get('Item')
+    if not item:
+        return {
+            'message_limit': limits['message_limit'],
+            'concurrency': limits['concurrency_floor'],
+            'latency_ms': 0,
+            'throttled_until': 0,
+        }
+
+    return {
+        name: int(item[name]['N'])
+        for name in ['message_limit', 'concurrency', 'latency_ms', 'throttled_until']
+    }
+
+
+def _save_state(state):
+    item = {'pk': {'S': _state_key()}}
+    for name in ['message_limit', 'concurrency', 'latency_ms', 'throttled_until']:
+        item[name] = {'N': str(state[name])}
+
+    _get_dynamodb().put_item(TableName=os.environ['STATE_TABLE_NAME'], Item=item)
+
+
+def _state_key():
+    return SCHEDULER_KEY.format(os.environ['NEXT_LAMBDA'])
@@ -0,0 +1,40 @@
+import threading
+
+from src.lazy_import import lazy_module
+
+boto3 = lazy_module('boto3')
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def client(service_name):
+    # One boto3 client per service for the life of the container. Creating
+    # clients on the default session is not thread-safe, so the first call
+    # for a service holds the lock.
+    if service_name not in _clients:
+        with _lock:
+            if service_name not in _clients:
+                _clients[service_name] = boto3.client(service_name)
+
+    return _clients[service_name]
+
+
+def getter(service_name):
+    # A module-level `_get_s3 = getter('s3')` keeps a per-module patch point
+    # for tests while every module shares the same client.
+    def get():
+        return client(service_name)
+
+    get.__name__ = '_get_{}'.format(service_name)
+    return get
+
+
+def error_code(error):
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code')
+
+
+def status_code(error):
+    response = getattr(error, 'response', None) or {}
+    return response.get('ResponseMetadata', {}).get('HTTPStatusCode')
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from datetime import datetime
+
+from lib.dynamics_constants import TIMESTAMP_FORMAT
+from src.lazy_import import lazy_module
+
+parser = lazy_module('dateutil.parser')
+
+SAMPLE_SIZE = 20
+CACHE_SIZE = 1024
+
+# Only formats that dateutil reads the same way (month first, four digit
+# years) are candidates, so a strict match can never change the output.
+CANDIDATE_FORMATS = [
+    '%m/%d/%Y',
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%Y/%m/%d',
+]
+
+
+class DateNormalizer(object):
+    def __init__(self, sample_size=SAMPLE_SIZE, cache_size=CACHE_SIZE, output_format=TIMESTAMP_FORMAT):
+        self.sample_size = sample_size
+        self.cache_size = cache_size
+        self.output_format = output_format
+        self.date_format = None
+        self._sample = []
+        self._cache = OrderedDict()
+
+    def __call__(self, raw_date):
+        formatted = self._cache.get(raw_date)
+        if formatted is not None:
+            self._cache.move_to_end(raw_date)
+            return formatted
+
+        formatted = self._parse(raw_date).strftime(self.output_format)
+        self._cache[raw_date] = formatted
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return formatted
+
+    def _parse(self, raw_date):
+        if self.date_format:
+            try:
+                return datetime.strptime(raw_date, self.date_format)
+            except ValueError:
+                return parser.parse(raw_date)
+
+        parsed = parser.parse(raw_date)
+        if self._sample is not None:
+            self._sample.append((raw_date, parsed))
+            if len(self._sample) >= self.sample_size:
+                self.date_format = _detect_format(self._sample)
+                self._sample = None
+
+        return parsed
+
+
+def _detect_format(sample):
+    for date_format in CANDIDATE_FORMATS:
+        if all(_strict_parse(raw_date, date_format) == parsed for raw_date, parsed in sample):
+            return date_format
+
+
+def _strict_parse(raw_date, date_format):
+    try:
+        return datetime.strptime(raw_date, date_format)
+    except ValueError:
+        return None
@@ -0,0 +1,60 @@
+import io
+import os
+import csv
+
+from src import aws_clients
+
+DEAD_LETTER_KEY = 'dead-letter/{}.rejected.csv'
+# Without s3:ListBucket, S3 answers a read of a missing key with AccessDenied.
+MISSING_OBJECT_CODES = ('NoSuchKey', 'AccessDenied')
+MISSING_OBJECT_STATUSES = (403, 404)
+
+_get_s3 = aws_clients.getter('s3')
+
+
+class DeadLetterCsv(object):
+    # Rejected rows from one export, written as a single CSV next to the
+    # original columns with the row number and rejection reasons.
+    def __init__(self, source_key, fieldnames):
+        self.key = DEAD_LETTER_KEY.format(source_key)
+        self.fieldnames = fieldnames
+        self.rows = []
+
+    def add(self, row_number, row, reasons):
+        self.rows.append([row_number] + list(row) + ['; '.join(reasons)])
+
+    def write(self, append=False):
+        # Continuations append to the object earlier invocations wrote, so a
+        # file split across invocations still has one dead-letter CSV.
+        if not self.rows:
+            return None
+
+        bucket = os.environ['DEAD_LETTER_BUCKET']
+        existing = _read_existing(bucket, self.key) if append else b''
+        output = io.StringIO()
+        writer = csv.writer(output)
+        if not existing:
+            writer.writerow(['row_number'] + list(self.fieldnames) + ['reasons'])
+        writer.writerows(self.rows)
+
+        _get_s3().put_object(
+            Bucket=bucket,
+            Key=self.key,
+            Body=existing + output.getvalue().encode('utf-8'),
+            ContentType='text/csv'
+        )
+        return {'bucket': bucket, 'key': self.key}
+
+
+def _read_existing(bucket, key):
+    try:
+        return _get_s3().get_object(Bucket=bucket, Key=key)['Body'].read()
+    except Exception as error:
+        if not _missing(error):
+            raise
+        return b''
+
+
+def _missing(error):
+    return (aws_clients.error_code(error) in MISSING_OBJECT_CODES
+            or aws_clients.status_code(error) in MISSING_OBJECT_STATUSES)
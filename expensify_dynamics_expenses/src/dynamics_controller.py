@@ -1,68 +1,486 @@
 import os
 import csv
-from dateutil import parser
+import json
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 from lib import sqs_client
-from lib.s3_helpers import fetch_from_s3
-from lib.dynamics_constants import TIMESTAMP_FORMAT, MESSAGE_DATE_TIME_FIELD, TRANS_DATE_FIELD
-from lib.logging_helpers import log_error
+from lib.expensify_constants import EXPENSE_UNIQUE_ID
+from src import idempotency
+from src import message_envelope
+from src import metrics
+from src import range_split
+from src import transform
+from src.dead_letter import DeadLetterCsv
+from src.lambda_invoker import invoke_async
+from src.lazy_import import lazy_callable, lazy_module
+from src.s3_stream import iter_s3_lines, compression_for_body, compression_for_key, decompress_chunks, head
+from src.sqs_batch_publisher import send_fifo_messages
 
+pipelined_publisher = lazy_module('src.pipelined_publisher')
+row_schema = lazy_module('src.row_schema')
+voluptuous = lazy_module('voluptuous')
+fetch_from_s3 = lazy_callable('lib.s3_helpers', 'fetch_from_s3')
+log_error = lazy_callable('lib.logging_helpers', 'log_error')
 
+MAX_FILE_WORKERS = 4
+CHECKPOINT_MARGIN_MS = 30000
+PUBLISH_CHUNK_SIZE = 100
+MESSAGE_GROUP_SHARDS = 8
+SPLIT_PARTS = 8
+SPLIT_MIN_BYTES = 64 * 1024 * 1024
+# Parts of a split file publish concurrently, so rows of one message group in
+# two parts reach the queue in either order. Sharded groups already give up
+# BatchID-wide order and are chosen per expense, so only different expenses
+# trade places; files grouped by batch or column are never split.
+SPLIT_GROUP_STRATEGIES = ('sharded',)
+
+
+class ExpenseFilesFailedError(Exception):
+    pass
+
+
+@metrics.instrumented
 def start(event, context):
-    csv_string = _fetch_expenses_csv(event)
-    if csv_string:
-        csv_reader = csv.DictReader(csv_string.splitlines())
-        _format_csv_headers(csv_reader)
-        payloads = _send_to_d365(csv_reader)
+    if 'continuation' in event:
+        summaries = [_process_file(event['continuation'], context)]
+    else:
+        records = event['Records']
+        max_workers = int(os.environ.get('MAX_FILE_WORKERS', MAX_FILE_WORKERS))
+        with ThreadPoolExecutor(max_workers=max(1, min(len(records), max_workers))) as executor:
+            summaries = list(executor.map(lambda record: _process_record(record, context), records))
+
+    # Every file gets its chance before a failure is raised, so Lambda's
+    # async retry replays the event; published rows are skipped on replay by
+    # the idempotency store.
+    failed = [summary['key'] for summary in summaries if summary['status'] == 'failed']
+    if failed:
+        raise ExpenseFilesFailedError('{} of {} expense files failed: {}'.format(
+            len(failed), len(summaries), ', '.join(failed)
+        ))
+
+    return summaries
+
+
+def _process_record(record, context):
+    position = {
+        'bucket': record['s3']['bucket']['name'],
+        'key': record['s3']['object']['key'],
+        'offset': 0,
+        'row_index': 0,
+    }
+    if os.environ.get('CONTROLLER_MODE') == 'split':
+        try:
+            summary = _split_file(position, context, record)
+        except Exception as error:
+            return _failed(_new_summary(position['bucket'], position['key']), error, record)
+        if summary:
+            return summary
+
+    return _process_file(position, context, record)
+
+
+def _split_file(position, context, record):
+    # Large plain exports are cut into line-aligned byte ranges, each
+    # published by its own continuation. Returns None when the file is better
+    # read in one go: compressed objects cannot be entered mid-stream.
+    bucket_name = position['bucket']
+    key = position['key']
+    if compression_for_key(key) or os.environ.get('MESSAGE_GROUP_STRATEGY', 'batch') not in SPLIT_GROUP_STRATEGIES:
+        return None
+
+    size, content_encoding = head(bucket_name, key)
+    if content_encoding or size < int(os.environ.get('SPLIT_MIN_BYTES', SPLIT_MIN_BYTES)):
+        return None
+
+    fieldnames, ranges = range_split.plan_ranges(
+        bucket_name, key, size, int(os.environ.get('SPLIT_PARTS', SPLIT_PARTS))
+    )
+    if len(ranges) < 2:
+        return None
+
+    split = {'id': uuid.uuid4().hex, 'parts': len(ranges), 'started_at': time.time()}
+    for part, (start, end) in enumerate(ranges):
+        invoke_async(context.function_name, {'continuation': dict(
+            position,
+            offset=start,
+            end=end,
+            fieldnames=fieldnames,
+            split=dict(split, part=part, start=start)
+        )})
+
+    metrics.count('FilesSplit')
+    summary = _new_summary(bucket_name, key)
+    summary.update(status='split', split_id=split['id'], parts=len(ranges), batch_ids=[])
+    return summary
+
+
+def _process_file(position, context, record=None):
+    bucket_name = position['bucket']
+    key = position['key']
+    summary = _new_summary(bucket_name, key)
+    started_at = time.time()
+    fetch_timer = _FetchTimer()
+    lines = _LineCounter([], position['offset'], fetch_timer)
+    try:
+        if position['offset']:
+            lines = _LineCounter(
+                iter_s3_lines(
+                    bucket_name, key, start=position['offset'], end=position.get('end'), fetch_timer=fetch_timer
+                ),
+                position['offset'],
+                fetch_timer
+            )
+            csv_reader = csv.reader(lines)
+            fieldnames = position['fieldnames']
+        else:
+            lines = _LineCounter(_read_expenses_csv(bucket_name, key, fetch_timer), fetch_timer=fetch_timer)
+            csv_reader = csv.reader(lines)
+            fieldnames = next(csv_reader, None)
+
+        if not fieldnames:
+            log_error('Expenses CSV not found', extra_data=record or position)
+            summary['status'] = 'empty'
+            return summary
+
+        progress = dict(position, fieldnames=fieldnames, offset=lines.offset, timed_out=False)
+        expense_transform = transform.compile_spec(_field_spec(), fieldnames)
+        row_validator = _row_validator(_dead_letter_source(position), fieldnames, expense_transform)
+        try:
+            _send_to_d365(csv_reader, expense_transform, row_validator, lines, progress, context, summary)
+        finally:
+            # Rows rejected before a publish failure are still written out.
+            if row_validator:
+                _write_dead_letters(row_validator.dead_letters, position, summary)
+        if progress.pop('timed_out'):
+            if 'split' in position:
+                progress['split'] = dict(position['split'], carried=range_split.part_totals(position['split'], summary))
+            invoke_async(context.function_name, {'continuation': progress})
+            summary['status'] = 'checkpointed'
+            summary['checkpoint'] = progress
+        else:
+            summary['status'] = 'published'
+    except Exception as error:
+        _failed(summary, error, record or position)
+
+    if fetch_timer.streamed:
+        metrics.record('S3FetchTime', fetch_timer.seconds * 1000)
+    summary['bytes_read'] = lines.offset - position['offset']
+    metrics.count('BytesRead', summary['bytes_read'], 'Bytes')
+    summary['batch_ids'] = sorted(summary['batch_ids'])
+    summary['elapsed_ms'] = int((time.time() - started_at) * 1000)
+    if 'split' in position and summary['status'] != 'checkpointed':
+        _record_split_part(position['split'], summary, lines.offset)
+
+    return summary
+
+
+def _failed(summary, error, record):
+    log_error('Expenses CSV failed', extra_data={'record': record, 'error': str(error)})
+    summary['status'] = 'failed'
+    summary['error'] = str(error)
+    metrics.count('FilesFailed')
+    return summary
+
+
+def _write_dead_letters(dead_letters, position, summary):
+    # The rows around the rejected ones are already on the queue, so a failed
+    # dead-letter write is logged rather than failing (and replaying) the file.
+    summary['rejected'] = len(dead_letters.rows)
+    try:
+        summary['dead_letter'] = dead_letters.write(append=bool(position['row_index']))
+    except Exception as error:
+        log_error('Dead letter CSV failed', extra_data={'key': dead_letters.key, 'error': str(error)})
+        metrics.count('DeadLetterWriteFailures')
+        summary['dead_letter'] = None
+
+
+def _dead_letter_source(position):
+    # Parts of a split file reject rows concurrently, so each writes its own
+    # dead-letter CSV.
+    if 'split' in position:
+        return '{}.part{}'.format(position['key'], position['split']['part'])
+
+    return position['key']
+
+
+def _record_split_part(split, summary, offset):
+    part_summary = {name: value for name, value in summary.items() if name != 'payloads'}
+    part_summary.update(range_split.part_totals(split, summary), bytes_read=offset - split['start'])
+    try:
+        aggregate = range_split.record_part(split, part_summary)
+    except Exception as error:
+        log_error('Split part not recorded', extra_data={'split': split, 'error': str(error)})
+        return
+
+    # The parts run as async invocations whose return values are discarded,
+    # so the last part publishes the aggregate on its EMF line.
+    if aggregate:
+        summary['aggregate'] = aggregate
+        metrics.put_property('split_aggregate', aggregate)
+        metrics.record('SplitFileTime', aggregate['elapsed_ms'])
+        if aggregate['status'] == 'failed':
+            log_error('Split file failed', extra_data=aggregate)
+
+
+def _new_summary(bucket_name, key):
+    summary = {
+        'bucket': bucket_name,
+        'key': key,
+        'published': 0,
+        'skipped': 0,
+        'batch_ids': set(),
+    }
+    if os.environ.get('CONTROLLER_RESULT_MODE') == 'payloads':
+        summary['payloads'] = []
+
+    return summary
+
+
+def _read_expenses_csv(bucket_name, key, fetch_timer):
+    # Compressed exports are always streamed so they are never held in memory.
+    if os.environ.get('CSV_INGESTION') == 'stream' or compression_for_key(key):
+        return iter_s3_lines(bucket_name, key, fetch_timer=fetch_timer)
+
+    return _fetch_expenses_csv(bucket_name, key).splitlines(True)
+
+
+def _fetch_expenses_csv(bucket_name, key):
+    with metrics.timer('S3FetchTime'):
+        body = fetch_from_s3(bucket_name, key)
+
+    # A plain key can still be stored with Content-Encoding: gzip or zstd.
+    compression = compression_for_body(body)
+    if compression:
+        body = b''.join(decompress_chunks([body], compression))
+
+    return body.decode('utf-8')
 
-        return payloads
 
-    log_error('Expenses CSV not found', extra_data=event)
+class _FetchTimer(object):
+    # A streamed body downloads while csv pulls lines, so the wait on each S3
+    # chunk is summed here and taken back out of the parse time.
+    def __init__(self):
+        self.seconds = 0.0
+        self.streamed = False
 
+    def wrap(self, chunks):
+        self.streamed = True
+        chunks = iter(chunks)
+        while True:
+            started_at = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                self.seconds += time.perf_counter() - started_at
+            yield chunk
 
-def _fetch_expenses_csv(event):
-    return fetch_from_s3(
-        event['Records'][0]['s3']['bucket']['name'],
-        event['Records'][0]['s3']['object']['key']
-    ).decode('utf-8')
 
+class _LineCounter(object):
+    # Tracks the byte offset of the last line handed to csv, which is where a
+    # continuation can pick the file back up with a ranged GET.
+    def __init__(self, lines, offset=0, fetch_timer=None):
+        self._lines = iter(lines)
+        self.offset = offset
+        self.fetch_timer = fetch_timer or _FetchTimer()
 
-def _format_csv_headers(csv_reader):
-    csv_reader.fieldnames = [
-        name if name == 'BatchID' else name.replace('ID', 'Id')
-        for name in csv_reader.fieldnames
-    ]
+    def __iter__(self):
+        return self
 
+    def __next__(self):
+        line = next(self._lines)
+        self.offset += len(line.encode('utf-8'))
+        return line
 
-def _send_to_d365(csv_reader):
+
+def _field_spec():
+    field_spec = os.environ.get('EXPENSE_FIELD_SPEC')
+    if field_spec:
+        return json.loads(field_spec)
+
+    return transform.EXPENSE_FIELD_SPEC
+
+
+def _row_validator(key, fieldnames, expense_transform):
+    if os.environ.get('ROW_VALIDATION') != 'strict':
+        return None
+
+    return _RowValidator(key, fieldnames, expense_transform.column_converters)
+
+
+class _RowValidator(object):
+    # Rows failing the row schema go to the dead-letter CSV with their
+    # reasons instead of being queued for a D365 call that cannot succeed.
+    def __init__(self, key, fieldnames, converters):
+        self.schema, self.columns = row_schema.expense_row_schema(fieldnames, converters)
+        self.dead_letters = DeadLetterCsv(key, fieldnames)
+
+    def split(self, rows, first_row_number):
+        valid = []
+        for row_number, row in enumerate(rows, first_row_number):
+            try:
+                self.schema({name: row[index] if index < len(row) else None for index, name in self.columns})
+            except voluptuous.MultipleInvalid as error:
+                self.dead_letters.add(row_number, row, [invalid.msg for invalid in error.errors])
+            else:
+                valid.append(row)
+
+        metrics.count('RowsRejected', len(rows) - len(valid))
+        return valid
+
+
+def _send_to_d365(csv_reader, expense_transform, row_validator, lines, progress, context, summary):
+    with metrics.timer('SendToD365Time'):
+        _publish_rows(csv_reader, expense_transform, row_validator, lines, progress, context, summary)
+
+
+def _publish_rows(csv_reader, expense_transform, row_validator, lines, progress, context, summary):
     d365_queue_url = sqs_client.get_queue_url(os.environ.get('QUEUE_NAME'))
-    payloads = []
-    for row in csv_reader:
-        expenses = dict(row)
-        _format_expense_payload(expenses)
-        sqs_client.send_fifo_message(
-            d365_queue_url,
-            {
-                'endpoint': os.environ['DYNAMICS_EXPENSES_ENDPOINT'],
-                'data': expenses
-            },
-            expenses.get('BatchID')
+    idempotency_store = idempotency.get_store()
+    messages = _queue_messages(csv_reader, expense_transform, row_validator, lines, progress, context)
+    if idempotency_store:
+        messages = _unpublished(idempotency_store, messages, summary)
+
+    def send(chunk):
+        _send_chunk(d365_queue_url, idempotency_store, chunk)
+
+    if os.environ.get('PUBLISH_ENGINE') == 'pipelined':
+        pipelined_publisher.publish(
+            messages,
+            send,
+            lambda chunk: _count_published(chunk, summary),
+            max_in_flight=int(os.environ.get('PUBLISH_MAX_IN_FLIGHT', pipelined_publisher.MAX_IN_FLIGHT)),
+            queue_size=int(os.environ.get('PUBLISH_QUEUE_SIZE', pipelined_publisher.QUEUE_SIZE))
         )
-        payloads.append(expenses)
+        return
+
+    for chunk in messages:
+        send(chunk)
+        _count_published(chunk, summary)
+
+
+def _unpublished(idempotency_store, messages, summary):
+    for chunk in messages:
+        unpublished = _skip_published(idempotency_store, chunk)
+        summary['skipped'] += len(chunk) - len(unpublished)
+        metrics.count('RowsSkipped', len(chunk) - len(unpublished))
+        yield unpublished
+
+
+def _send_chunk(d365_queue_url, idempotency_store, chunk):
+    with metrics.timer('SqsPublishTime'):
+        _publish(d365_queue_url, chunk)
+    if idempotency_store:
+        keys = [idempotency.expense_key(message['data']) for message, _ in chunk]
+        idempotency_store.mark_published([key for key in keys if key])
+
+
+def _count_published(chunk, summary):
+    metrics.count('RowsPublished', len(chunk))
+    summary['published'] += len(chunk)
+    summary['batch_ids'].update(
+        message['data']['BatchID'] for message, _ in chunk if message['data'].get('BatchID')
+    )
+    if 'payloads' in summary:
+        summary['payloads'].extend(message['data'] for message, _ in chunk)
+
+
+def _skip_published(idempotency_store, chunk):
+    keyed = [(idempotency.expense_key(message['data']), (message, group_id)) for message, group_id in chunk]
+    published = idempotency_store.get_published(key for key, _ in keyed if key)
+
+    return [entry for key, entry in keyed if key not in published]
+
+
+def _publish(d365_queue_url, messages):
+    if os.environ.get('MESSAGE_ENCODING') == 'compact':
+        messages = [(message_envelope.encode(message), group_id) for message, group_id in messages]
+
+    if os.environ.get('SQS_PUBLISH_MODE') == 'batch':
+        send_fifo_messages(d365_queue_url, messages)
+    else:
+        for message, group_id in messages:
+            sqs_client.send_fifo_message(d365_queue_url, message, group_id)
+
+
+def _read_rows(csv_reader, size):
+    # Blank lines are skipped the same way csv.DictReader skips them.
+    rows = []
+    for row in csv_reader:
+        if row:
+            rows.append(row)
+            if len(rows) == size:
+                break
+
+    return rows
+
+
+def _queue_messages(csv_reader, expense_transform, row_validator, lines, progress, context):
+    # Rows are pulled a chunk at a time while there is time left, so every
+    # chunk yielded has been published by the time the checkpoint is recorded.
+    endpoint = os.environ['DYNAMICS_EXPENSES_ENDPOINT']
+    message_group_id = _message_grouping()
+    parse_seconds = format_seconds = 0.0
+    try:
+        while not _out_of_time(context):
+            started_at = time.perf_counter()
+            fetched_seconds = lines.fetch_timer.seconds
+            rows = _read_rows(csv_reader, PUBLISH_CHUNK_SIZE)
+            parsed_at = time.perf_counter()
+            parse_seconds += parsed_at - started_at - (lines.fetch_timer.seconds - fetched_seconds)
+            if not rows:
+                return
+
+            first_row_number = progress['row_index'] + 1
+            progress['offset'] = lines.offset
+            progress['row_index'] += len(rows)
+            if row_validator:
+                rows = row_validator.split(rows, first_row_number)
+            messages = [
+                ({'endpoint': endpoint, 'data': expenses}, message_group_id(expenses))
+                for expenses in expense_transform.apply(rows)
+            ]
+            format_seconds += time.perf_counter() - parsed_at
+            yield messages
+
+        progress['timed_out'] = True
+    finally:
+        metrics.record('CsvParseTime', parse_seconds * 1000)
+        metrics.record('FormatTime', format_seconds * 1000)
+
+
+def _message_grouping():
+    # FIFO order is only kept within a message group. 'batch' serializes a
+    # whole batch; 'sharded' spreads it over MESSAGE_GROUP_SHARDS groups by
+    # expense, and 'column' groups on a CSV column such as a report id.
+    strategy = os.environ.get('MESSAGE_GROUP_STRATEGY', 'batch')
+    if strategy == 'sharded':
+        shards = int(os.environ.get('MESSAGE_GROUP_SHARDS', MESSAGE_GROUP_SHARDS))
+        return lambda expenses: '{}-{}'.format(expenses.get('BatchID'), _shard(expenses, shards))
+    if strategy == 'column':
+        column = os.environ['MESSAGE_GROUP_COLUMN']
+        return lambda expenses: expenses.get(column) or expenses.get('BatchID')
+    if strategy == 'batch':
+        return lambda expenses: expenses.get('BatchID')
+
+    raise ValueError('Unknown MESSAGE_GROUP_STRATEGY {}'.format(strategy))
 
-    return payloads
 
+def _shard(expenses, shards):
+    # crc32 rather than hash() so an expense maps to the same group in every
+    # invocation and on every retry.
+    key = expenses.get(EXPENSE_UNIQUE_ID) or json.dumps(expenses, sort_keys=True)
+    return zlib.crc32(key.encode('utf-8')) % shards
 
-def _format_expense_payload(expenses):
-    amount = expenses.get('Amount')
-    if amount:
-        expenses['Amount'] = round(float(amount), 2)
-    _format_date_for_dynamics(expenses, MESSAGE_DATE_TIME_FIELD)
-    _format_date_for_dynamics(expenses, TRANS_DATE_FIELD)
 
+def _out_of_time(context):
+    get_remaining_time = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining_time is None:
+        return False
 
-def _format_date_for_dynamics(expenses, expense_key):
-    date_to_format = expenses.get(expense_key)
-    if date_to_format:
-        reformatted_date = parser.parse(date_to_format).strftime(TIMESTAMP_FORMAT)
-        expenses[expense_key] = reformatted_date
+    margin = int(os.environ.get('CHECKPOINT_MARGIN_MS', CHECKPOINT_MARGIN_MS))
+    return get_remaining_time() < margin
@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TOKEN_PATH = '/oauth2/token'
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+DEFAULT_TOKEN_LIFETIME_SECONDS = 3600
+POOL_SIZE = 10
+REQUEST_TIMEOUT_SECONDS = 60
+
+# Kept at module level so warm invocations reuse the connection pool and the
+# access token instead of paying a TLS handshake and a token round trip.
+_session = None
+_token = None
+_token_expires_at = 0
+_lock = threading.Lock()
+
+
+class DynamicsConfigurationError(Exception):
+    pass
+
+
+def base_url():
+    return os.environ['DYNAMICS_BASE_URL']
+
+
+def token_url():
+    # The password grant must go to the tenant's own authority
+    # (https://login.microsoftonline.com/<tenant>), never a multi-tenant one.
+    authority = os.environ.get('DYNAMICS_AUTHORITY')
+    if not authority:
+        raise DynamicsConfigurationError('DYNAMICS_AUTHORITY is not set; it must name the Azure AD tenant')
+
+    return authority.rstrip('/') + TOKEN_PATH
+
+
+def request(method, path, headers=None, **kwargs):
+    url = base_url() + path
+    response = _send(method, url, headers, kwargs)
+    if response.status_code == 401:
+        invalidate_access_token()
+        response = _send(method, url, headers, kwargs)
+
+    return response
+
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+            _session = session
+
+        return _session
+
+
+def get_access_token():
+    global _token, _token_expires_at
+    session = get_session()
+    with _lock:
+        if _token is None or time.time() >= _token_expires_at - TOKEN_REFRESH_MARGIN_SECONDS:
+            response = session.post(
+                token_url(),
+                data={
+                    'grant_type': 'password',
+                    'resource': base_url(),
+                    'client_id': os.environ['DYNAMICS_CLIENT_ID'],
+                    'username': os.environ['DYNAMICS_USER_NAME'],
+                    'password': os.environ['DYNAMICS_USER_PASSWORD'],
+                },
+                timeout=REQUEST_TIMEOUT_SECONDS
+            )
+            response.raise_for_status()
+            token = response.json()
+            _token = token['access_token']
+            _token_expires_at = time.time() + int(token.get('expires_in', DEFAULT_TOKEN_LIFETIME_SECONDS))
+
+        return _token
+
+
+def invalidate_access_token():
+    global _token
+    with _lock:
+        _token = None
+
+
+def _send(method, url, headers, kwargs):
+    request_headers = {'Authorization': 'Bearer {}'.format(get_access_token())}
+    request_headers.update(headers or {})
+
+    return get_session().request(
+        method,
+        url,
+        headers=request_headers,
+        timeout=REQUEST_TIMEOUT_SECONDS,
+        **kwargs
+    )
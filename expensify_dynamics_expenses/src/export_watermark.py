@@ -0,0 +1,24 @@
+import os
+
+from src import aws_clients
+
+WATERMARK_KEY = 'watermark#expensify-export'
+
+_get_dynamodb = aws_clients.getter('dynamodb')
+
+
+def load():
+    item = _get_dynamodb().get_item(
+        TableName=os.environ['STATE_TABLE_NAME'],
+        Key={'pk': {'S': WATERMARK_KEY}},
+        ConsistentRead=True
+    ).get('Item')
+
+    return item['export_date']['S'] if item else None
+
+
+def save(export_date):
+    _get_dynamodb().put_item(
+        TableName=os.environ['STATE_TABLE_NAME'],
+        Item={'pk': {'S': WATERMARK_KEY}, 'export_date': {'S': export_date}}
+    )
@@ -1,9 +1,164 @@
-from lib.dynamics_client import api_post as lib_api_post
+import os
+import math
+import time
+import random
+
 from lib.expensify_constants import EXPENSE_UNIQUE_ID
+from src import dynamics_session
+from src import message_envelope
+from src import rate_limiter
+from src.lazy_import import lazy_callable, lazy_module
+
+odata_batch = lazy_module('src.odata_batch')
+log_error = lazy_callable('lib.logging_helpers', 'log_error')
+
+TOO_MANY_REQUESTS = 429
+DEFAULT_RETRY_AFTER_SECONDS = 30
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_CAP_SECONDS = 60
+RETRY_MARGIN_MS = 5000
+# Retries stay well inside the adaptive starter's per-invoke allowance
+# (INVOKE_BUDGET_MS); a longer Retry-After is raised for the starter to wait out.
+RETRY_BUDGET_SECONDS = 10
+
+JSON_HEADERS = {
+    'Accept': 'application/json',
+    'OData-Version': '4.0',
+    'OData-MaxVersion': '4.0',
+}
+
+
+class DynamicsRequestError(Exception):
+    pass
+
+
+class DynamicsThrottledError(DynamicsRequestError):
+    pass
 
 
 def api_post(event, context):
-    if EXPENSE_UNIQUE_ID in event['data']:
-        del event['data'][EXPENSE_UNIQUE_ID]
+    event = message_envelope.decode(event)
+    _strip_unique_id(event['data'])
+
+    response, throttled = _request(
+        context,
+        'post',
+        event['endpoint'],
+        json=event['data'],
+        headers=JSON_HEADERS
+    )
+    if response.status_code == TOO_MANY_REQUESTS:
+        # The dispatcher reads Retry-After back out of this message to back off.
+        raise DynamicsThrottledError(
+            'Dynamics returned 429 for {} (Retry-After {})'.format(event['endpoint'], retry_after_seconds(response))
+        )
+    if not response.ok:
+        log_error(response.text, extra_data=event)
+        raise DynamicsRequestError(
+            'Dynamics returned {} for {}'.format(response.status_code, event['endpoint'])
+        )
+
+    # throttled counts the 429s retried away here, so the starter still
+    # backs off when a message succeeds on a later attempt.
+    return {
+        'status_code': response.status_code,
+        'success': True,
+        'body': response.json() if response.content else None,
+        'throttled': throttled,
+    }
+
+
+def api_post_batch(event, context):
+    # Dispatched by the adaptive starter with DISPATCH_BATCH_SIZE > 1. Item
+    # results come back in message order so the starter can delete the
+    # messages that were posted and leave the rest on the queue.
+    messages = [message_envelope.decode(message) for message in event['messages']]
+    for message in messages:
+        _strip_unique_id(message['data'])
+
+    content_type, body = odata_batch.build_batch_request(
+        dynamics_session.base_url(),
+        [(message['endpoint'], message['data']) for message in messages]
+    )
+    headers = dict(JSON_HEADERS, **{'Content-Type': content_type})
+    response, throttled = _request(context, 'post', odata_batch.BATCH_ENDPOINT, data=body, headers=headers)
+
+    if response.status_code == TOO_MANY_REQUESTS:
+        raise DynamicsThrottledError(
+            'Dynamics returned 429 for {} (Retry-After {})'.format(
+                odata_batch.BATCH_ENDPOINT, retry_after_seconds(response)
+            )
+        )
+    if response.status_code >= 400:
+        log_error(response.text)
+        results = [
+            {'status_code': response.status_code, 'success': False, 'body': response.text}
+            for _ in messages
+        ]
+        return {'results': results, 'throttled': throttled}
+
+    results = odata_batch.parse_batch_response(
+        response.headers.get('Content-Type', ''),
+        response.text,
+        len(messages)
+    )
+    for message, result in zip(messages, results):
+        if result['status_code'] == TOO_MANY_REQUESTS:
+            throttled += 1
+        if not result['success']:
+            log_error('Dynamics batch item failed', extra_data={'message': message, 'result': result})
+
+    return {'results': results, 'throttled': throttled}
+
+
+def _request(context, method, path, **kwargs):
+    # Throttled calls are retried here, within the invocation, rather than
+    # left for the SQS visibility timeout. Retry-After is honoured when D365
+    # sends it, otherwise the delay is jittered exponential backoff. Returns
+    # the last response and how many 429s came before it.
+    limiter = rate_limiter.get_limiter()
+    deadline = _deadline(context)
+    throttled = 0
+    for attempt in range(MAX_ATTEMPTS):
+        if limiter and not limiter.acquire(deadline):
+            raise DynamicsThrottledError(
+                'Rate limit wait for {} exceeds remaining time (Retry-After {})'.format(
+                    path, max(1, int(math.ceil(limiter.last_wait)))
+                )
+            )
+
+        response = dynamics_session.request(method, path, **kwargs)
+        if response.status_code != TOO_MANY_REQUESTS:
+            return response, throttled
+
+        throttled += 1
+        retry_after = retry_after_seconds(response, None)
+        if limiter and retry_after:
+            limiter.block(retry_after)
+
+        delay = retry_after or random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+        if attempt + 1 == MAX_ATTEMPTS or time.time() + delay > deadline:
+            break
+        time.sleep(delay)
+
+    return response, throttled
+
+
+def _deadline(context):
+    deadline = time.time() + float(os.environ.get('DYNAMICS_RETRY_BUDGET_SECONDS', RETRY_BUDGET_SECONDS))
+    get_remaining_time = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining_time is not None:
+        deadline = min(deadline, time.time() + (get_remaining_time() - RETRY_MARGIN_MS) / 1000.0)
+
+    return deadline
+
+
+def retry_after_seconds(response, default=DEFAULT_RETRY_AFTER_SECONDS):
+    retry_after = response.headers.get('Retry-After', '')
+    return int(retry_after) if retry_after.isdigit() else default
+
 
-    return lib_api_post(event, context)
+def _strip_unique_id(data):
+    if EXPENSE_UNIQUE_ID in data:
+        del data[EXPENSE_UNIQUE_ID]
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+
+from lib.expensify_constants import EXPENSE_UNIQUE_ID
+from src import aws_clients
+from src.lazy_import import lazy_module
+
+sqlite3 = lazy_module('sqlite3')
+
+KEY_PREFIX = 'expense#'
+RECORD_TTL_SECONDS = 90 * 24 * 60 * 60
+DYNAMODB_GET_LIMIT = 100
+DYNAMODB_WRITE_LIMIT = 25
+UNPROCESSED_RETRY_DELAY_SECONDS = 0.1
+SQLITE_PARAMETER_LIMIT = 500
+DEFAULT_SQLITE_PATH = '/tmp/expenses_idempotency.db'
+
+
+def get_store():
+    store_type = os.environ.get('IDEMPOTENCY_STORE')
+    if store_type == 'dynamodb':
+        return DynamoDbStore(os.environ['STATE_TABLE_NAME'])
+    if store_type == 'sqlite':
+        return SqliteStore(os.environ.get('IDEMPOTENCY_DB_PATH', DEFAULT_SQLITE_PATH))
+
+    return None
+
+
+def expense_key(expenses):
+    unique_id = expenses.get(EXPENSE_UNIQUE_ID)
+    if not unique_id:
+        return None
+
+    content = json.dumps(expenses, sort_keys=True).encode('utf-8')
+    return '{}#{}'.format(unique_id, hashlib.sha256(content).hexdigest())
+
+
+class SqliteStore(object):
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS published (key TEXT PRIMARY KEY, published_at REAL)')
+
+    def get_published(self, keys):
+        keys = list(keys)
+        published = set()
+        with self._connect() as connection:
+            for start in range(0, len(keys), SQLITE_PARAMETER_LIMIT):
+                chunk = keys[start:start + SQLITE_PARAMETER_LIMIT]
+                rows = connection.execute(
+                    'SELECT key FROM published WHERE key IN ({})'.format(','.join('?' * len(chunk))),
+                    chunk
+                )
+                published.update(row[0] for row in rows)
+
+        return published
+
+    def mark_published(self, keys):
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR IGNORE INTO published (key, published_at) VALUES (?, ?)',
+                [(key, now) for key in keys]
+            )
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+class DynamoDbStore(object):
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self.client = client or aws_clients.client('dynamodb')
+
+    def get_published(self, keys):
+        keys = list(set(keys))
+        published = set()
+        for start in range(0, len(keys), DYNAMODB_GET_LIMIT):
+            request = {
+                self.table_name: {
+                    'Keys': [{'pk': {'S': KEY_PREFIX + key}} for key in keys[start:start + DYNAMODB_GET_LIMIT]],
+                    'ProjectionExpression': 'pk',
+                }
+            }
+            while request:
+                response = self.client.batch_get_item(RequestItems=request)
+                published.update(
+                    item['pk']['S'][len(KEY_PREFIX):]
+                    for item in response['Responses'].get(self.table_name, [])
+                )
+                request = response.get('UnprocessedKeys')
+                if request:
+                    time.sleep(UNPROCESSED_RETRY_DELAY_SECONDS)
+
+        return published
+
+    def mark_published(self, keys):
+        keys = list(set(keys))
+        expires_at = str(int(time.time()) + RECORD_TTL_SECONDS)
+        for start in range(0, len(keys), DYNAMODB_WRITE_LIMIT):
+            request = {
+                self.table_name: [
+                    {'PutRequest': {'Item': {'pk': {'S': KEY_PREFIX + key}, 'expires_at': {'N': expires_at}}}}
+                    for key in keys[start:start + DYNAMODB_WRITE_LIMIT]
+                ]
+            }
+            while request:
+                response = self.client.batch_write_item(RequestItems=request)
+                request = response.get('UnprocessedItems')
+                if request:
+                    time.sleep(UNPROCESSED_RETRY_DELAY_SECONDS)
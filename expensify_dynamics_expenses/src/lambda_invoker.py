@@ -0,0 +1,13 @@
+import json
+
+from src import aws_clients
+
+_get_lambda = aws_clients.getter('lambda')
+
+
+def invoke_async(function_name, payload):
+    return _get_lambda().invoke(
+        FunctionName=function_name,
+        InvocationType='Event',
+        Payload=json.dumps(payload).encode('utf-8')
+    )
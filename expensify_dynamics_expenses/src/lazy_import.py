@@ -0,0 +1,29 @@
+import importlib
+
+
+class LazyModule(object):
+    # Stands in for a module and imports it on first attribute access, so a
+    # handler only pays for a heavy dependency on the code path that uses it.
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+
+        return getattr(self._module, attribute)
+
+
+def lazy_module(name):
+    return LazyModule(name)
+
+
+def lazy_callable(module_name, attribute):
+    module = LazyModule(module_name)
+
+    def call(*args, **kwargs):
+        return getattr(module, attribute)(*args, **kwargs)
+
+    call.__name__ = attribute
+    return call
@@ -0,0 +1,71 @@
+import os
+import json
+import zlib
+import base64
+import hashlib
+
+from src import aws_clients
+from src.lazy_import import lazy_callable
+
+fetch_from_s3 = lazy_callable('lib.s3_helpers', 'fetch_from_s3')
+
+VERSION = 1
+CLAIM_CHECK_THRESHOLD_BYTES = 200 * 1024
+CLAIM_CHECK_PREFIX = 'claim-check/'
+
+# Short codes for the endpoints carried on every message; any other endpoint
+# travels as its full path.
+ENDPOINT_CODES = {
+    '/data/IDEO_Expenses': 'exp',
+}
+_ENDPOINTS = {code: endpoint for endpoint, code in ENDPOINT_CODES.items()}
+
+_get_s3 = aws_clients.getter('s3')
+
+
+def encode(message):
+    # Compact form of {'endpoint', 'data'}: empty fields are dropped, the
+    # endpoint is a short code and the data is optionally zlib compressed.
+    # Anything still over the threshold is stored in S3 and only a pointer
+    # goes on the queue.
+    data = {name: value for name, value in message['data'].items() if value not in ('', None)}
+    body = json.dumps(data, separators=(',', ':'))
+    envelope = {'v': VERSION, 'e': ENDPOINT_CODES.get(message['endpoint'], message['endpoint'])}
+
+    if os.environ.get('MESSAGE_COMPRESSION') == 'zlib':
+        compressed = base64.b64encode(zlib.compress(body.encode('utf-8'))).decode('ascii')
+        if len(compressed) < len(body):
+            envelope['z'] = compressed
+    if 'z' not in envelope:
+        envelope['d'] = data
+
+    threshold = int(os.environ.get('CLAIM_CHECK_THRESHOLD_BYTES', CLAIM_CHECK_THRESHOLD_BYTES))
+    if len(json.dumps(envelope, separators=(',', ':')).encode('utf-8')) > threshold:
+        envelope.pop('z', None)
+        envelope.pop('d', None)
+        envelope['s3'] = _claim_check(body.encode('utf-8'))
+
+    return envelope
+
+
+def decode(message):
+    if message.get('v') != VERSION:
+        return message
+
+    if 's3' in message:
+        data = json.loads(fetch_from_s3(message['s3']['b'], message['s3']['k']).decode('utf-8'))
+    elif 'z' in message:
+        data = json.loads(zlib.decompress(base64.b64decode(message['z'])).decode('utf-8'))
+    else:
+        data = message['d']
+
+    return {'endpoint': _ENDPOINTS.get(message['e'], message['e']), 'data': data}
+
+
+def _claim_check(body):
+    # Keys are content addressed, so a retried publish rewrites the same object.
+    bucket = os.environ['CLAIM_CHECK_BUCKET']
+    key = '{}{}.json'.format(CLAIM_CHECK_PREFIX, hashlib.sha256(body).hexdigest())
+    _get_s3().put_object(Bucket=bucket, Key=key, Body=body, ContentType='application/json')
+
+    return {'b': bucket, 'k': key}
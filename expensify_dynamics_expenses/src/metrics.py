@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import math
+import time
+import threading
+from functools import wraps
+
+DEFAULT_NAMESPACE = 'ExpensifyDynamics'
+BUCKETS_PER_DECADE = 10
+
+_registry = None
+
+
+def instrumented(handler):
+    # Collects metrics for one invocation and writes them as a single
+    # CloudWatch Embedded Metric Format log line when the handler returns.
+    @wraps(handler)
+    def wrapper(event, context):
+        global _registry
+        if os.environ.get('METRICS_ENABLED') != 'true':
+            _registry = None
+            return handler(event, context)
+
+        _registry = _Registry()
+        try:
+            return handler(event, context)
+        finally:
+            registry, _registry = _registry, None
+            registry.flush(_function_name(context))
+
+    return wrapper
+
+
+def enabled():
+    return _registry is not None
+
+
+def count(name, value=1, unit='Count'):
+    if _registry is not None:
+        _registry.add(name, value, unit)
+
+
+def record(name, value, unit='Milliseconds'):
+    if _registry is not None:
+        _registry.observe(name, value, unit)
+
+
+def put_property(name, value):
+    # Context that is not a metric (ids, decisions, summaries) rides on the
+    # same EMF line, where Logs Insights can query it.
+    if _registry is not None:
+        _registry.put_property(name, value)
+
+
+def timer(name):
+    if _registry is None:
+        return _NULL_TIMER
+
+    return _Timer(_registry, name)
+
+
+class _Timer(object):
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, (time.perf_counter() - self.started_at) * 1000, 'Milliseconds')
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Registry(object):
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.units = {}
+        self.properties = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, value, unit):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.units[name] = unit
+
+    def observe(self, name, value, unit):
+        bucket = _bucket(value)
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {})
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+            self.units[name] = unit
+
+    def put_property(self, name, value):
+        with self.lock:
+            self.properties[name] = value
+
+    def flush(self, function_name):
+        if not self.counters and not self.histograms and not self.properties:
+            return
+
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [
+                    {
+                        'Namespace': os.environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE),
+                        'Dimensions': [['FunctionName']],
+                        'Metrics': [
+                            {'Name': name, 'Unit': unit}
+                            for name, unit in sorted(self.units.items())
+                        ],
+                    }
+                ],
+            },
+            'FunctionName': function_name,
+        }
+        document.update(self.properties)
+        document.update(self.counters)
+        for name, histogram in self.histograms.items():
+            buckets = sorted(histogram)
+            document[name] = {
+                'Values': buckets,
+                'Counts': [histogram[bucket] for bucket in buckets],
+            }
+
+        sys.stdout.write(json.dumps(document) + '\n')
+        sys.stdout.flush()
+
+
+def _bucket(value):
+    # Log-scale buckets keep a histogram spanning 1us to 10min well under the
+    # 100 distinct values EMF accepts per metric.
+    if value <= 0:
+        return 0.0
+
+    exponent = round(math.log10(value) * BUCKETS_PER_DECADE) / BUCKETS_PER_DECADE
+    return float('{:.2g}'.format(10 ** exponent))
+
+
+def _function_name(context):
+    return getattr(context, 'function_name', None) or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
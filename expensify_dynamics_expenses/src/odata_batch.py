@@ -0,0 +1,126 @@
+import json
+import re
+import uuid
+
+BATCH_ENDPOINT = '/data/$batch'
+
+_HEAD_SEPARATOR = re.compile(r'\r?\n\r?\n')
+_LINE_SEPARATOR = re.compile(r'\r?\n')
+
+
+def build_batch_request(base_url, items):
+    # Every (endpoint, data) item gets its own changeset so that one rejected
+    # expense does not roll back the rest of the batch.
+    batch_boundary = 'batch_{}'.format(uuid.uuid4())
+    parts = []
+    for content_id, (endpoint, data) in enumerate(items, 1):
+        changeset_boundary = 'changeset_{}'.format(uuid.uuid4())
+        parts.append(
+            '--{batch}\r\n'
+            'Content-Type: multipart/mixed; boundary={changeset}\r\n'
+            '\r\n'
+            '--{changeset}\r\n'
+            'Content-Type: application/http\r\n'
+            'Content-Transfer-Encoding: binary\r\n'
+            'Content-ID: {content_id}\r\n'
+            '\r\n'
+            'POST {url} HTTP/1.1\r\n'
+            'Content-Type: application/json; type=entry\r\n'
+            '\r\n'
+            '{body}\r\n'
+            '--{changeset}--\r\n'.format(
+                batch=batch_boundary,
+                changeset=changeset_boundary,
+                content_id=content_id,
+                url=base_url + endpoint,
+                body=json.dumps(data),
+            )
+        )
+    parts.append('--{}--\r\n'.format(batch_boundary))
+
+    content_type = 'multipart/mixed; boundary={}'.format(batch_boundary)
+    return content_type, ''.join(parts).encode('utf-8')
+
+
+def parse_batch_response(content_type, body, item_count):
+    responses = _parse_multipart(content_type, body)
+    content_ids = [response['content_id'] for response in responses]
+    if all(content_ids) and len(set(content_ids)) == len(responses) == item_count:
+        responses.sort(key=lambda response: int(response['content_id']))
+
+    results = [
+        {
+            'status_code': response['status_code'],
+            'success': 200 <= response['status_code'] < 300,
+            'body': response['body'],
+        }
+        for response in responses[:item_count]
+    ]
+    while len(results) < item_count:
+        results.append({'status_code': None, 'success': False, 'body': 'Missing from batch response'})
+
+    return results
+
+
+def _parse_multipart(content_type, body):
+    responses = []
+    for headers, payload in _split_multipart(body, _boundary(content_type)):
+        part_type = headers.get('content-type', '')
+        if part_type.startswith('multipart/mixed'):
+            responses.extend(_parse_multipart(part_type, payload))
+        else:
+            response = _parse_http_response(payload)
+            response['content_id'] = headers.get('content-id') or response['content_id']
+            responses.append(response)
+
+    return responses
+
+
+def _boundary(content_type):
+    for parameter in content_type.split(';')[1:]:
+        name, _, value = parameter.strip().partition('=')
+        if name.lower() == 'boundary':
+            return value.strip('"')
+
+    raise ValueError('No multipart boundary in {}'.format(content_type))
+
+
+def _split_multipart(body, boundary):
+    for section in body.split('--' + boundary)[1:]:
+        if section.startswith('--'):
+            break
+
+        head, payload = _split_head(section.lstrip('\r\n'))
+        yield _parse_headers(head), payload.rstrip('\r\n')
+
+
+def _parse_http_response(message):
+    head, payload = _split_head(message)
+    status_line, _, header_lines = head.partition('\n')
+    headers = _parse_headers(header_lines)
+    payload = payload.strip()
+    try:
+        payload = json.loads(payload)
+    except ValueError:
+        pass
+
+    return {
+        'status_code': int(status_line.split()[1]),
+        'body': payload,
+        'content_id': headers.get('content-id'),
+    }
+
+
+def _split_head(text):
+    parts = _HEAD_SEPARATOR.split(text, 1)
+    return parts[0], parts[1] if len(parts) > 1 else ''
+
+
+def _parse_headers(text):
+    headers = {}
+    for line in _LINE_SEPARATOR.split(text.strip()):
+        name, separator, value = line.partition(':')
+        if separator:
+            headers[name.strip().lower()] = value.strip()
+
+    return headers
@@ -0,0 +1,81 @@
+import asyncio
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_IN_FLIGHT = 4
+QUEUE_SIZE = 8
+
+
+def publish(chunks, send, on_sent, max_in_flight=MAX_IN_FLIGHT, queue_size=QUEUE_SIZE):
+    # Reads and formats the next chunks while earlier ones are being sent.
+    # Messages are routed to a lane by message group, and each lane sends
+    # one sub-chunk at a time, so a group keeps its FIFO order while up to
+    # max_in_flight groups are sent concurrently. A full lane queue blocks
+    # the producer. Everything read is sent, or the first error raised,
+    # before this returns.
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        pipeline = _Pipeline(loop, executor, send, on_sent, max_in_flight, queue_size)
+        loop.run_until_complete(pipeline.run(chunks))
+    finally:
+        executor.shutdown(wait=True)
+        loop.close()
+
+
+class _Pipeline(object):
+    def __init__(self, loop, executor, send, on_sent, lanes, queue_size):
+        self.loop = loop
+        self.executor = executor
+        self.send = send
+        self.on_sent = on_sent
+        self.lanes = lanes
+        self.queue_size = queue_size
+        self.error = None
+
+    async def run(self, chunks):
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.lanes)]
+        workers = [asyncio.ensure_future(self._send_lane(queue)) for queue in queues]
+        try:
+            for chunk in chunks:
+                if self.error is not None:
+                    break
+
+                for lane, messages in sorted(self._by_lane(chunk).items()):
+                    await queues[lane].put(messages)
+                # put() only yields when a queue is full; hand the loop to the
+                # lanes so their sends start before the next chunk is read.
+                await asyncio.sleep(0)
+        finally:
+            for queue in queues:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+        if self.error is not None:
+            raise self.error
+
+    def _by_lane(self, chunk):
+        lanes = {}
+        for message, group_id in chunk:
+            lane = zlib.crc32(str(group_id).encode('utf-8')) % self.lanes
+            lanes.setdefault(lane, []).append((message, group_id))
+
+        return lanes
+
+    async def _send_lane(self, queue):
+        # Keeps draining after a failure so the producer never blocks on a
+        # lane that has stopped sending.
+        while True:
+            messages = await queue.get()
+            if messages is None:
+                return
+
+            if self.error is not None:
+                continue
+
+            try:
+                await self.loop.run_in_executor(self.executor, self.send, messages)
+            except Exception as error:
+                self.error = error
+            else:
+                self.on_sent(messages)
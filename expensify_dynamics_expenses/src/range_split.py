@@ -0,0 +1,112 @@
+import os
+import csv
+import json
+import time
+
+from src import aws_clients, s3_stream
+
+SPLIT_KEY = 'split#{}'
+PROBE_BYTES = 64 * 1024
+SPLIT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+_get_dynamodb = aws_clients.getter('dynamodb')
+
+
+def plan_ranges(bucket, key, size, parts):
+    # Returns the header and line-aligned [start, end) byte ranges covering
+    # every row once. A boundary is only placed where the following line
+    # parses to as many columns as the header, so it never lands inside a
+    # quoted multi-line field.
+    header_line = next(iter(s3_stream.iter_s3_lines(bucket, key, end=min(size, PROBE_BYTES))), '')
+    fieldnames = next(csv.reader([header_line]), None)
+    if not fieldnames:
+        return None, []
+
+    header_end = len(header_line.encode('utf-8'))
+    boundaries = [header_end]
+    for part in range(1, parts):
+        target = header_end + (size - header_end) * part // parts
+        boundary = _line_boundary(bucket, key, target, size, len(fieldnames))
+        if boundary and boundaries[-1] < boundary < size:
+            boundaries.append(boundary)
+    boundaries.append(size)
+
+    return fieldnames, [
+        (start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end
+    ]
+
+
+def _line_boundary(bucket, key, target, size, width):
+    # Reads from the byte before target so a target that is already a line
+    # start is kept rather than skipped.
+    probe = s3_stream.read_range(bucket, key, target - 1, min(size, target - 1 + PROBE_BYTES))
+    lines = probe.split(b'\n')
+    offset = target - 1 + len(lines[0]) + 1
+    for line in lines[1:-1]:
+        if _is_row(line, width):
+            return offset
+        offset += len(line) + 1
+
+    return None
+
+
+def _is_row(line, width):
+    text = line.decode('utf-8', 'replace').rstrip('\r')
+    if text.count('"') % 2:
+        return False
+
+    return len(next(csv.reader([text]), [])) == width
+
+
+def record_part(split, summary):
+    # Each part adds itself to a set on the split's state item; whichever
+    # part completes the set aggregates. A retried part is only counted once.
+    part = str(split['part'])
+    attributes = _get_dynamodb().update_item(
+        TableName=os.environ['STATE_TABLE_NAME'],
+        Key={'pk': {'S': SPLIT_KEY.format(split['id'])}},
+        UpdateExpression='SET #summary = :summary, expires_at = :expires_at ADD parts_done :part',
+        ExpressionAttributeNames={'#summary': 'part_' + part},
+        ExpressionAttributeValues={
+            ':summary': {'S': json.dumps(summary)},
+            ':expires_at': {'N': str(int(time.time()) + SPLIT_TTL_SECONDS)},
+            ':part': {'SS': [part]},
+        },
+        ReturnValues='ALL_NEW'
+    )['Attributes']
+    if len(attributes['parts_done']['SS']) < split['parts']:
+        return None
+
+    return aggregate(
+        split,
+        [json.loads(attributes['part_{}'.format(index)]['S']) for index in range(split['parts'])]
+    )
+
+
+def part_totals(split, summary):
+    # A part that checkpoints carries its counts into the continuation so the
+    # invocation that finishes the range records the whole part.
+    carried = split.get('carried', {})
+    return {
+        'published': carried.get('published', 0) + summary['published'],
+        'skipped': carried.get('skipped', 0) + summary['skipped'],
+        'rejected': carried.get('rejected', 0) + summary.get('rejected', 0),
+        'batch_ids': sorted(set(carried.get('batch_ids', [])) | set(summary['batch_ids'])),
+    }
+
+
+def aggregate(split, summaries):
+    failed = [summary for summary in summaries if summary['status'] == 'failed']
+    return {
+        'split_id': split['id'],
+        'parts': len(summaries),
+        'status': 'failed' if failed else 'published',
+        'published': sum(summary['published'] for summary in summaries),
+        'skipped': sum(summary['skipped'] for summary in summaries),
+        'rejected': sum(summary.get('rejected', 0) for summary in summaries),
+        'bytes_read': sum(summary['bytes_read'] for summary in summaries),
+        'batch_ids': sorted(set(batch_id for summary in summaries for batch_id in summary['batch_ids'])),
+        'dead_letters': [summary['dead_letter'] for summary in summaries if summary.get('dead_letter')],
+        'errors': [summary['error'] for summary in failed],
+        'elapsed_ms': int((time.time() - split['started_at']) * 1000),
+    }
@@ -0,0 +1,148 @@
+import os
+import time
+import random
+import threading
+
+from src import aws_clients
+
+KEY_PREFIX = 'ratelimit#'
+DYNAMICS_BUCKET = 'dynamics'
+DEFAULT_RATE_PER_SECOND = 15
+DEFAULT_BURST = 30
+MAX_UPDATE_ATTEMPTS = 5
+CONTENTION_DELAY_SECONDS = 0.05
+
+_get_dynamodb = aws_clients.getter('dynamodb')
+
+
+def get_limiter():
+    store_type = os.environ.get('RATE_LIMIT_STORE')
+    if store_type == 'dynamodb':
+        store = DynamoDbStore(os.environ['STATE_TABLE_NAME'])
+    elif store_type == 'memory':
+        store = _memory_store
+    else:
+        return None
+
+    return TokenBucket(
+        store,
+        DYNAMICS_BUCKET,
+        float(os.environ.get('DYNAMICS_RATE_LIMIT', DEFAULT_RATE_PER_SECOND)),
+        float(os.environ.get('DYNAMICS_RATE_BURST', DEFAULT_BURST))
+    )
+
+
+class TokenBucket(object):
+    # Bucket state lives in the store so every concurrent invocation draws
+    # from the same tokens; updates are compare-and-set on a version number.
+    def __init__(self, store, key, rate, capacity):
+        self.store = store
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self.last_wait = 0
+
+    def acquire(self, deadline=None):
+        # On False, last_wait is how long the caller would have had to wait.
+        while True:
+            wait = self._try_take(time.time())
+            if not wait:
+                return True
+            if deadline is not None and time.time() + wait > deadline:
+                self.last_wait = wait
+                return False
+            time.sleep(wait)
+
+    def block(self, seconds):
+        # Retry-After from D365 pauses every caller sharing the bucket.
+        for _ in range(MAX_UPDATE_ATTEMPTS):
+            now = time.time()
+            state, version = self.store.get(self.key)
+            state = self._refill(state, now)
+            state['blocked_until'] = max(state['blocked_until'], now + seconds)
+            if self.store.compare_and_set(self.key, state, version):
+                return
+
+    def _try_take(self, now):
+        for _ in range(MAX_UPDATE_ATTEMPTS):
+            state, version = self.store.get(self.key)
+            state = self._refill(state, now)
+            if state['blocked_until'] > now:
+                return state['blocked_until'] - now
+            if state['tokens'] < 1:
+                return (1 - state['tokens']) / self.rate
+
+            state['tokens'] -= 1
+            if self.store.compare_and_set(self.key, state, version):
+                return 0
+
+        return random.uniform(0, CONTENTION_DELAY_SECONDS)
+
+    def _refill(self, state, now):
+        if state is None:
+            return {'tokens': self.capacity, 'updated_at': now, 'blocked_until': 0}
+
+        elapsed = max(0, now - state['updated_at'])
+        return {
+            'tokens': min(self.capacity, state['tokens'] + elapsed * self.rate),
+            'updated_at': now,
+            'blocked_until': state['blocked_until'],
+        }
+
+
+class MemoryStore(object):
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            state, version = self._buckets.get(key, (None, 0))
+            return (dict(state) if state else None), version
+
+    def compare_and_set(self, key, state, version):
+        with self._lock:
+            if self._buckets.get(key, (None, 0))[1] != version:
+                return False
+            self._buckets[key] = (dict(state), version + 1)
+            return True
+
+
+class DynamoDbStore(object):
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self.client = client or _get_dynamodb()
+
+    def get(self, key):
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={'pk': {'S': KEY_PREFIX + key}},
+            ConsistentRead=True
+        ).get('Item')
+        if not item:
+            return None, 0
+
+        state = {name: float(item[name]['N']) for name in ['tokens', 'updated_at', 'blocked_until']}
+        return state, int(item['version']['N'])
+
+    def compare_and_set(self, key, state, version):
+        item = {'pk': {'S': KEY_PREFIX + key}, 'version': {'N': str(version + 1)}}
+        for name in ['tokens', 'updated_at', 'blocked_until']:
+            item[name] = {'N': repr(float(state[name]))}
+
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item=item,
+                ConditionExpression='attribute_not_exists(pk) OR version = :version',
+                ExpressionAttributeValues={':version': {'N': str(version)}}
+            )
+        except Exception as error:
+            if aws_clients.error_code(error) == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+        return True
+
+
+_memory_store = MemoryStore()
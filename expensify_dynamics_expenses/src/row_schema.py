@@ -0,0 +1,47 @@
+from voluptuous import Schema, Optional, All, Any, Coerce, Length, Invalid
+from lib.dynamics_constants import MESSAGE_DATE_TIME_FIELD, TRANS_DATE_FIELD
+
+from src.date_normalizer import DateNormalizer
+
+DATE_FIELDS = (MESSAGE_DATE_TIME_FIELD, TRANS_DATE_FIELD)
+
+
+def ParsableDate(normalize_date=None):
+    normalize_date = normalize_date or DateNormalizer()
+
+    def validator(v):
+        try:
+            return normalize_date(v)
+        except (ValueError, OverflowError):
+            raise Invalid('not a date')
+
+    return validator
+
+
+def expense_row_schema(fieldnames, converters=None):
+    # Compiled once per header set: returns the schema and the indices of
+    # the columns it checks, so rows are validated without building a dict
+    # of every column. converters maps a column index to the transform's
+    # memoized converter, so a validated date is parsed once for both.
+    converters = converters or {}
+    rules = {}
+    columns = []
+    for index, name in enumerate(fieldnames):
+        rule = _expense_row_rule(name, converters.get(index))
+        if rule is not None:
+            rules[Optional(name)] = rule
+            columns.append((index, name))
+
+    return Schema(rules), columns
+
+
+def _expense_row_rule(name, converter):
+    # Empty values are allowed through; the D365 payload simply omits them.
+    if name == 'BatchID':
+        return All(str, Length(min=1), msg='BatchID is required')
+    if name == 'Amount':
+        return Any('', None, Coerce(float), msg='Amount is not a number')
+    if name in DATE_FIELDS:
+        return Any('', None, ParsableDate(converter), msg='{} is not a date'.format(name))
+
+    return None
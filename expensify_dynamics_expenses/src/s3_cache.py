@@ -0,0 +1,47 @@
+import time
+import threading
+
+from src import aws_clients
+
+NOT_MODIFIED = 304
+
+_get_s3 = aws_clients.getter('s3')
+_objects = {}
+_lock = threading.Lock()
+
+
+def fetch(bucket, key, ttl_seconds=None):
+    # Objects survive across warm invocations and are revalidated with a
+    # conditional GET; within ttl_seconds of the last check S3 is not called.
+    with _lock:
+        cached = _objects.get((bucket, key))
+
+    if cached and ttl_seconds and time.time() - cached['validated_at'] < ttl_seconds:
+        return cached['body'], cached['etag']
+
+    request = {'Bucket': bucket, 'Key': key}
+    if cached:
+        request['IfNoneMatch'] = cached['etag']
+
+    try:
+        response = _get_s3().get_object(**request)
+    except Exception as error:
+        if not cached or aws_clients.status_code(error) != NOT_MODIFIED:
+            raise
+        cached = dict(cached, validated_at=time.time())
+    else:
+        cached = {
+            'body': response['Body'].read(),
+            'etag': response['ETag'],
+            'validated_at': time.time(),
+        }
+
+    with _lock:
+        _objects[(bucket, key)] = cached
+
+    return cached['body'], cached['etag']
+
+
+def clear():
+    with _lock:
+        _objects.clear()
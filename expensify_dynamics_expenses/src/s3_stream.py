@@ -0,0 +1,127 @@
+import zlib
+import codecs
+
+from src import aws_clients
+from src.lazy_import import lazy_module
+
+zstandard = lazy_module('zstandard')
+
+CHUNK_SIZE = 1024 * 1024
+
+COMPRESSED_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+CONTENT_ENCODINGS = {'gzip': 'gzip', 'x-gzip': 'gzip', 'zstd': 'zstd'}
+MAGIC_NUMBERS = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd'}
+
+_get_s3 = aws_clients.getter('s3')
+
+
+def iter_s3_lines(bucket, key, start=0, chunk_size=CHUNK_SIZE, end=None, fetch_timer=None):
+    # For compressed objects start is an offset into the decompressed CSV, so
+    # the object is read from the beginning and the first start bytes dropped.
+    # end (exclusive) bounds a ranged read and only applies to plain objects.
+    # fetch_timer.wrap, when given, times the body download chunk by chunk,
+    # since it happens lazily while the caller parses.
+    compression = compression_for_key(key)
+    request = {'Bucket': bucket, 'Key': key}
+    if (start or end) and not compression:
+        request['Range'] = _byte_range(start, end)
+
+    response = _get_s3().get_object(**request)
+    compression = compression or CONTENT_ENCODINGS.get(response.get('ContentEncoding', '').lower())
+    if compression and 'Range' in request:
+        response['Body'].close()
+        del request['Range']
+        response = _get_s3().get_object(**request)
+
+    chunks = response['Body'].iter_chunks(chunk_size)
+    if fetch_timer is not None:
+        chunks = fetch_timer.wrap(chunks)
+    if compression:
+        chunks = _skip_bytes(decompress_chunks(chunks, compression), start)
+
+    return iter_lines(chunks)
+
+
+def read_range(bucket, key, start, end):
+    return _get_s3().get_object(Bucket=bucket, Key=key, Range=_byte_range(start, end))['Body'].read()
+
+
+def head(bucket, key):
+    response = _get_s3().head_object(Bucket=bucket, Key=key)
+    return response['ContentLength'], response.get('ContentEncoding')
+
+
+def _byte_range(start, end=None):
+    if end is None:
+        return 'bytes={}-'.format(start)
+
+    return 'bytes={}-{}'.format(start, end - 1)
+
+
+def compression_for_key(key):
+    for extension, compression in COMPRESSED_EXTENSIONS.items():
+        if key.lower().endswith(extension):
+            return compression
+
+
+def compression_for_body(body):
+    # For bodies fetched without their headers, where a Content-Encoding
+    # can only be recognised by the stream's magic number.
+    for magic, compression in MAGIC_NUMBERS.items():
+        if body.startswith(magic):
+            return compression
+
+
+def decompress_chunks(chunks, compression):
+    # Concatenated gzip members (and zstd frames) are decoded back to back.
+    decompressor = _new_decompressor(compression)
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+
+            chunk = decompressor.unused_data if getattr(decompressor, 'eof', False) else b''
+            if chunk:
+                decompressor = _new_decompressor(compression)
+
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def iter_lines(chunks):
+    # Lines keep their endings so csv can rebuild quoted multi-line fields,
+    # and a trailing '\r' is held back in case its '\n' is in the next chunk.
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.splitlines(True)
+        if lines and not lines[-1].endswith('\n'):
+            pending = lines.pop()
+        else:
+            pending = ''
+        for line in lines:
+            yield line
+
+    pending += decoder.decode(b'', final=True)
+    for line in pending.splitlines(True):
+        yield line
+
+
+def _new_decompressor(compression):
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _skip_bytes(chunks, count):
+    for chunk in chunks:
+        if count >= len(chunk):
+            count -= len(chunk)
+            continue
+
+        yield chunk[count:]
+        count = 0
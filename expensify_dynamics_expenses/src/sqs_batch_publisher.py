@@ -0,0 +1,93 @@
+import json
+import time
+
+from src import aws_clients
+from src.lazy_import import lazy_callable
+
+log_error = lazy_callable('lib.logging_helpers', 'log_error')
+
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+MAX_SEND_ATTEMPTS = 4
+RETRY_BASE_DELAY_SECONDS = 0.1
+
+_get_sqs = aws_clients.getter('sqs')
+
+
+class BatchSendError(Exception):
+    pass
+
+
+def send_fifo_messages(queue_url, messages):
+    # Each batch is fully delivered (retrying only its failed entries) before
+    # the next one is sent, so messages in a group keep their FIFO order. A
+    # failed entry is only resent when nothing after it in its group got
+    # through; otherwise the resend would land out of order, so the batch is
+    # failed instead and the file retried.
+    sent = 0
+    for entries in _batch_entries(messages):
+        _send_batch(queue_url, entries)
+        sent += len(entries)
+
+    return sent
+
+
+def _batch_entries(messages):
+    entries = []
+    batch_bytes = 0
+    for message, group_id in messages:
+        body = json.dumps(message)
+        body_bytes = len(body.encode('utf-8'))
+        if entries and (
+            len(entries) == MAX_BATCH_ENTRIES or
+            batch_bytes + body_bytes > MAX_BATCH_BYTES
+        ):
+            yield entries
+            entries = []
+            batch_bytes = 0
+
+        entries.append({
+            'Id': str(len(entries)),
+            'MessageBody': body,
+            'MessageGroupId': str(group_id),
+        })
+        batch_bytes += body_bytes
+
+    if entries:
+        yield entries
+
+
+def _send_batch(queue_url, entries):
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        if attempt:
+            time.sleep(RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+
+        response = _get_sqs().send_message_batch(
+            QueueUrl=queue_url,
+            Entries=entries
+        )
+        failed = response.get('Failed', [])
+        if not failed:
+            return
+
+        if any(failure.get('SenderFault') for failure in failed):
+            break
+
+        failed_ids = {failure['Id'] for failure in failed}
+        if _overtaken(entries, failed_ids):
+            break
+        entries = [entry for entry in entries if entry['Id'] in failed_ids]
+
+    log_error('SQS batch entries failed', extra_data={'failed': failed})
+    raise BatchSendError('{} SQS batch entries failed'.format(len(failed)))
+
+
+def _overtaken(entries, failed_ids):
+    failed_groups = set()
+    for entry in entries:
+        if entry['Id'] in failed_ids:
+            failed_groups.add(entry['MessageGroupId'])
+        elif entry['MessageGroupId'] in failed_groups:
+            return True
+
+    return False
@@ -0,0 +1,139 @@
+from lib.dynamics_constants import TIMESTAMP_FORMAT, MESSAGE_DATE_TIME_FIELD, TRANS_DATE_FIELD
+from src.date_normalizer import DateNormalizer
+
+VALUE_CACHE_SIZE = 4096
+
+# Field mapping from Expensify CSV columns to D365 expense payloads. Field
+# rules are keyed on the name after header replacements and support
+# 'rename', 'type' (str, int, float, decimal, date), 'places' for decimals,
+# 'format' for dates, 'drop' and 'default' (used for empty or missing values).
+EXPENSE_FIELD_SPEC = {
+    'header_replacements': [['ID', 'Id']],
+    'preserve_headers': ['BatchID'],
+    'fields': {
+        'Amount': {'type': 'decimal', 'places': 2},
+        MESSAGE_DATE_TIME_FIELD: {'type': 'date'},
+        TRANS_DATE_FIELD: {'type': 'date'},
+    },
+}
+
+
+class CompiledTransform(object):
+    def __init__(self, spec, fieldnames):
+        field_rules = spec.get('fields', {})
+        self.width = len(fieldnames)
+        self.output_names = []
+        self.kept_columns = []
+        self.converters = []
+        for index, header in enumerate(fieldnames):
+            name = _rename_header(spec, header)
+            rule = field_rules.get(name, {})
+            if rule.get('drop'):
+                continue
+
+            self.kept_columns.append(index)
+            self.output_names.append(rule.get('rename', name))
+            converter = _compile_converter(rule)
+            if converter:
+                self.converters.append((index, converter))
+
+        # Keyed by CSV column index, for callers (row validation) that want
+        # to share the memoized conversions.
+        self.column_converters = dict(self.converters)
+
+        self.missing_defaults = {
+            rule.get('rename', name): rule['default']
+            for name, rule in field_rules.items()
+            if 'default' in rule and not rule.get('drop') and rule.get('rename', name) not in self.output_names
+        }
+
+    def apply(self, rows):
+        # Rows are converted a column at a time so each converter runs in a
+        # tight loop over its own memo, then zipped into payload dicts once.
+        extras = {}
+        for position, row in enumerate(rows):
+            if len(row) != self.width:
+                rows[position], extras[position] = _fit_row(row, self.width)
+
+        columns = [list(column) for column in zip(*rows)] or [[] for _ in range(self.width)]
+        for index, converter in self.converters:
+            columns[index] = [converter(value) for value in columns[index]]
+
+        kept = [columns[index] for index in self.kept_columns]
+        payloads = [dict(zip(self.output_names, values)) for values in zip(*kept)]
+        for position, extra in extras.items():
+            payloads[position].update(extra)
+        if self.missing_defaults:
+            for payload in payloads:
+                payload.update(self.missing_defaults)
+
+        return payloads
+
+
+def compile_spec(spec, fieldnames):
+    return CompiledTransform(spec, fieldnames)
+
+
+def rename_headers(spec, fieldnames):
+    return [_rename_header(spec, header) for header in fieldnames]
+
+
+def _rename_header(spec, header):
+    if header in spec.get('preserve_headers', []):
+        return header
+
+    for old, new in spec.get('header_replacements', []):
+        header = header.replace(old, new)
+
+    return header
+
+
+def _fit_row(row, width):
+    # Mirrors csv.DictReader: short rows are padded with None and surplus
+    # values are kept in a list under the None key.
+    if len(row) < width:
+        return row + [None] * (width - len(row)), {}
+
+    return row[:width], {None: row[width:]}
+
+
+def _compile_converter(rule):
+    field_type = rule.get('type', 'str')
+    if field_type == 'str':
+        convert = None
+    elif field_type == 'int':
+        convert = int
+    elif field_type == 'float':
+        convert = float
+    elif field_type == 'decimal':
+        places = rule.get('places', 2)
+        convert = lambda value: round(float(value), places)  # noqa: E731
+    elif field_type == 'date':
+        convert = DateNormalizer(output_format=rule.get('format', TIMESTAMP_FORMAT))
+    else:
+        raise ValueError('Unknown field type {}'.format(field_type))
+
+    if convert is None and 'default' not in rule:
+        return None
+
+    return _memoized(convert, rule.get('default'), 'default' in rule)
+
+
+def _memoized(convert, default, has_default):
+    cache = {}
+
+    def converter(value):
+        if not value:
+            return default if has_default else value
+        if convert is None:
+            return value
+
+        converted = cache.get(value)
+        if converted is None:
+            if len(cache) >= VALUE_CACHE_SIZE:
+                cache.clear()
+            converted = cache[value] = convert(value)
+
+        return converted
+
+    return converter
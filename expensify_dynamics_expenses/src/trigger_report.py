@@ -1,44 +1,156 @@
 import os
-from datetime import datetime
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import json
 
 from lib.expensify_client import api_post
 from lib.s3_helpers import fetch_from_s3
-from lib.logging_helpers import log_error
 from lib.validate import validate_schema
 from lib.errors import MissingRequirementsError
+from src import export_watermark
+from src import metrics
+from src import s3_cache
+from src.lazy_import import lazy_callable
 from src.schema import sftp_schema, requirements_schema
 
+log_error = lazy_callable('lib.logging_helpers', 'log_error')
+
 START_DATE = '2018-05-01'
+WINDOW_OVERLAP_DAYS = 7
+
+_validated_request_config = {}
 
 
+@metrics.instrumented
 def execute(event, context):
-    template = fetch_from_s3(
-        os.environ['TEMPLATE_BUCKET_NAME'],
-        os.environ['TEMPLATE_BUCKET_KEY']
-    )
+    template, _ = _fetch_config_object(os.environ['TEMPLATE_BUCKET_KEY'])
 
-    response = api_post(
-        {
-            'request_config': _get_request_config(),
-            'template': template
-        },
-        {}
+    request_config = _get_request_config(full_resync=bool(event.get('fullResync')))
+    shards = _shard_request_config(
+        request_config,
+        int(os.environ.get('EXPORT_POLICY_SHARDS', 1)),
+        int(os.environ.get('EXPORT_DATE_SHARDS', 1))
     )
+    if len(shards) == 1:
+        response = _request_export(shards[0], template)
+        succeeded = response.status_code == 200
+        result = response.text
+    else:
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            result = list(executor.map(lambda shard: _export_shard(shard, template), shards))
+        succeeded = all(shard_result.get('status_code') == 200 for shard_result in result)
+
+    if succeeded and _incremental_window():
+        export_watermark.save(request_config['inputSettings']['filters']['endDate'])
+
+    return result
+
+
+def _request_export(request_config, template):
+    with metrics.timer('ExpensifyApiTime'):
+        response = api_post(
+            {
+                'request_config': request_config,
+                'template': template
+            },
+            {}
+        )
 
     if response.status_code != 200:
         log_error(response.text)
+        metrics.count('ExpensifyApiErrors')
 
-    return response.text
+    return response
 
 
-def _get_request_config():
+def _export_shard(request_config, template):
+    filters = request_config['inputSettings']['filters']
+    result = {
+        'fileBasename': request_config['outputSettings']['fileBasename'],
+        'policyIDList': filters['policyIDList'],
+        'startDate': filters['startDate'],
+        'endDate': filters['endDate'],
+    }
+    try:
+        response = _request_export(request_config, template)
+        result['status_code'] = response.status_code
+        result['response'] = response.text
+    except Exception as error:
+        log_error('Expensify shard export failed', extra_data=dict(result, error=str(error)))
+        metrics.count('ExpensifyApiErrors')
+        result['error'] = str(error)
+
+    return result
+
+
+def _shard_request_config(request_config, policy_shards, date_shards):
+    # Splits one validated export into policy x date-range shards, each with
+    # its own fileBasename so the SFTP drop produces one file per shard.
+    filters = request_config['inputSettings']['filters']
+    policy_groups = _split_evenly(filters['policyIDList'].split(','), policy_shards)
+    date_ranges = _split_date_range(filters['startDate'], filters['endDate'], date_shards)
+    if len(policy_groups) * len(date_ranges) == 1:
+        return [request_config]
+
+    shards = []
+    base_name = request_config['outputSettings']['fileBasename']
+    for policy_index, policy_ids in enumerate(policy_groups, 1):
+        for date_index, (start_date, end_date) in enumerate(date_ranges, 1):
+            shard = deepcopy(request_config)
+            shard['inputSettings']['filters'].update(
+                policyIDList=','.join(policy_ids),
+                startDate=start_date,
+                endDate=end_date
+            )
+            shard['outputSettings']['fileBasename'] = '{}-p{}d{}'.format(base_name, policy_index, date_index)
+            shards.append(shard)
+
+    return shards
+
+
+def _split_evenly(items, shard_count):
+    shard_count = max(1, min(shard_count, len(items)))
+    size, remainder = divmod(len(items), shard_count)
+    groups = []
+    start = 0
+    for index in range(shard_count):
+        end = start + size + (1 if index < remainder else 0)
+        groups.append(items[start:end])
+        start = end
+
+    return groups
+
+
+def _split_date_range(start_date, end_date, shard_count):
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    days = (datetime.strptime(end_date, '%Y-%m-%d') - start).days + 1
+    if days < 2:
+        return [(start_date, end_date)]
+
+    ranges = []
+    for day_offsets in _split_evenly(list(range(days)), shard_count):
+        ranges.append((
+            (start + timedelta(days=day_offsets[0])).strftime('%Y-%m-%d'),
+            (start + timedelta(days=day_offsets[-1])).strftime('%Y-%m-%d'),
+        ))
+
+    return ranges
+
+
+def _get_request_config(full_resync=False):
     today = datetime.now().strftime('%Y-%m-%d')
-    req_config = _fetch_req_config()
+    raw_req_config, etag = _fetch_config_object(os.environ['REQUIREMENTS_BUCKET_KEY'])
+    req_config = _parse_req_config(raw_req_config)
+    start_date = _export_start_date(req_config.get('startDate'), full_resync)
+    cache_key = (etag, today, start_date)
+    if etag and _validated_request_config.get('key') == cache_key:
+        return deepcopy(_validated_request_config['config'])
+
     request_config = {
         'inputSettings': {
             'filters': {
-                'startDate': req_config.get('startDate'),
+                'startDate': start_date,
                 'endDate': today,
                 'markedAsExported': req_config.get('reportLabel'),
                 'policyIDList': req_config.get('policyIDList')
@@ -68,9 +180,35 @@ def _get_request_config():
         'Requirements Error'
     )
 
+    if etag:
+        _validated_request_config.update(key=cache_key, config=deepcopy(request_config))
+
     return request_config
 
 
+def _export_start_date(start_date, full_resync):
+    # Incremental windows start a few days before the last successful export
+    # (never before the configured startDate) instead of rescanning history.
+    if full_resync or not _incremental_window():
+        return start_date
+
+    watermark = export_watermark.load()
+    if not watermark:
+        return start_date
+
+    overlap_days = int(os.environ.get('EXPORT_WINDOW_OVERLAP_DAYS', WINDOW_OVERLAP_DAYS))
+    window_start = datetime.strptime(watermark, '%Y-%m-%d') - timedelta(days=overlap_days)
+    window_start = window_start.strftime('%Y-%m-%d')
+    if start_date and start_date > window_start:
+        return start_date
+
+    return window_start
+
+
+def _incremental_window():
+    return os.environ.get('EXPORT_WINDOW') == 'incremental'
+
+
 def _get_sftp_config():
     sftp_config = {
         'actionName': 'sftpUpload',
@@ -90,12 +228,16 @@ def _get_sftp_config():
     return sftp_config
 
 
-def _fetch_req_config():
-    raw_req_config = fetch_from_s3(
-        os.environ['TEMPLATE_BUCKET_NAME'],
-        os.environ['REQUIREMENTS_BUCKET_KEY']
-    )
+def _fetch_config_object(key):
+    bucket_name = os.environ['TEMPLATE_BUCKET_NAME']
+    if os.environ.get('CONFIG_CACHE') != 'etag':
+        return fetch_from_s3(bucket_name, key), None
+
+    ttl_seconds = os.environ.get('CONFIG_CACHE_TTL_SECONDS')
+    return s3_cache.fetch(bucket_name, key, float(ttl_seconds) if ttl_seconds else None)
+
 
+def _parse_req_config(raw_req_config):
     try:
         return json.loads(raw_req_config)
     except json.JSONDecodeError:
@@ -0,0 +1,306 @@
+from unittest2 import TestCase
+import io
+import json
+import mock
+import time
+
+from src import adaptive_starter
+
+
+class TestAdaptiveStarter(TestCase):
+    def setUp(self):
+        self.os_patch = mock.patch('src.adaptive_starter.os')
+        self.mock_os = self.os_patch.start()
+        self.mock_os.environ = {
+            'DISPATCH_MODE': 'adaptive',
+            'SOURCE_QUEUE_NAME': 'Expenses.fifo',
+            'NEXT_LAMBDA': 'dynamics-client',
+            'STATE_TABLE_NAME': 'state-table',
+        }
+
+        self.sqs_client_patcher = mock.patch('src.adaptive_starter.sqs_client')
+        self.mock_sqs_client = self.sqs_client_patcher.start()
+        self.mock_sqs_client.get_queue_url.return_value = 'queue_url'
+
+        self.sqs_patcher = mock.patch('src.adaptive_starter._get_sqs')
+        self.mock_sqs = self.sqs_patcher.start().return_value
+
+        self.lambda_patcher = mock.patch('src.adaptive_starter._get_lambda')
+        self.mock_lambda = self.lambda_patcher.start().return_value
+        self.mock_lambda.invoke.return_value = {'StatusCode': 200}
+
+        self.dynamodb_patcher = mock.patch('src.adaptive_starter._get_dynamodb')
+        self.mock_dynamodb = self.dynamodb_patcher.start().return_value
+        self.mock_dynamodb.get_item.return_value = {}
+
+        self.logger_patcher = mock.patch('src.adaptive_starter.logger')
+        self.mock_logger = self.logger_patcher.start()
+
+        self.put_property_patcher = mock.patch('src.adaptive_starter.metrics.put_property')
+        self.mock_put_property = self.put_property_patcher.start()
+
+        self.limits = dict(adaptive_starter.DEFAULT_LIMITS)
+
+    def tearDown(self):
+        self.os_patch.stop()
+        self.sqs_client_patcher.stop()
+        self.sqs_patcher.stop()
+        self.lambda_patcher.stop()
+        self.dynamodb_patcher.stop()
+        self.logger_patcher.stop()
+        self.put_property_patcher.stop()
+
+    def _queue(self, depth, messages):
+        self.mock_sqs.get_queue_attributes.return_value = {
+            'Attributes': {'ApproximateNumberOfMessages': str(depth)}
+        }
+        queued = list(messages)
+
+        def receive_message(MaxNumberOfMessages, **kwargs):
+            received = queued[:MaxNumberOfMessages]
+            del queued[:MaxNumberOfMessages]
+            return {'Messages': received} if received else {}
+
+        self.mock_sqs.receive_message.side_effect = receive_message
+
+    def _message(self, index, group_id='555'):
+        return {
+            'Body': json.dumps({'endpoint': '/data/IDEO_Expenses', 'data': {'Id': index}}),
+            'ReceiptHandle': 'receipt-{}'.format(index),
+            'Attributes': {'MessageGroupId': group_id},
+        }
+
+    def _tick(self, **outcome):
+        return dict(adaptive_starter._new_outcome(), **outcome)
+
+    def _state(self, **state):
+        return dict({'message_limit': 200, 'concurrency': 2, 'latency_ms': 500, 'throttled_until': 0}, **state)
+
+    def test_delegates_to_fixed_dispatch_by_default(self):
+        self.mock_os.environ['DISPATCH_MODE'] = 'fixed'
+        with mock.patch('src.adaptive_starter.fixed_dispatch') as mock_fixed_dispatch:
+            adaptive_starter.execute({}, {})
+
+        mock_fixed_dispatch.assert_called_with({}, {})
+        self.mock_sqs.receive_message.assert_not_called()
+
+    def test_dispatches_and_deletes_messages(self):
+        messages = [self._message(index) for index in range(3)]
+        self._queue(3, messages)
+
+        decision = adaptive_starter.execute({}, {})
+
+        self.assertEqual(
+            [call[1]['Payload'] for call in self.mock_lambda.invoke.call_args_list],
+            [message['Body'].encode('utf-8') for message in messages]
+        )
+        self.assertEqual(
+            [call[1]['ReceiptHandle'] for call in self.mock_sqs.delete_message.call_args_list],
+            ['receipt-0', 'receipt-1', 'receipt-2']
+        )
+        self.assertEqual(decision['reason'], 'steady')
+        self.mock_dynamodb.put_item.assert_called_once()
+        self.assertEqual(json.loads(self.mock_logger.info.call_args[0][0])['dispatched'], 3)
+        self.mock_put_property.assert_called_once_with('scheduler', mock.ANY)
+        self.assertEqual(self.mock_put_property.call_args[0][1]['dispatched'], 3)
+
+    def test_receives_no_more_than_the_message_limit(self):
+        self.mock_os.environ['MESSAGE_LIMIT'] = '25'
+        self._queue(500, [self._message(index, str(index)) for index in range(40)])
+
+        decision = adaptive_starter.execute({}, {})
+
+        self.assertEqual(self.mock_lambda.invoke.call_count, 25)
+        self.assertEqual(decision['reason'], 'backlog')
+        self.assertEqual(decision['message_limit'], 45)
+
+    def test_throttled_message_releases_rest_of_group_for_retry_after(self):
+        self._queue(3, [self._message(index) for index in range(3)])
+        self.mock_lambda.invoke.side_effect = [
+            {'StatusCode': 200},
+            {
+                'StatusCode': 200,
+                'FunctionError': 'Unhandled',
+                'Payload': io.BytesIO(json.dumps({
+                    'errorType': 'DynamicsThrottledError',
+                    'errorMessage': 'Dynamics returned 429 for /data/IDEO_Expenses (Retry-After 45)',
+                }).encode('utf-8')),
+            },
+        ]
+
+        decision = adaptive_starter.execute({}, {})
+
+        self.assertEqual(self.mock_lambda.invoke.call_count, 2)
+        entries = self.mock_sqs.change_message_visibility_batch.call_args[1]['Entries']
+        self.assertEqual([entry['ReceiptHandle'] for entry in entries], ['receipt-1', 'receipt-2'])
+        self.assertEqual({entry['VisibilityTimeout'] for entry in entries}, {45})
+        self.assertEqual(decision['reason'], 'throttled')
+        self.assertEqual(decision['message_limit'], 100)
+
+    def test_backs_off_when_a_message_succeeds_after_retried_429s(self):
+        self._queue(2, [self._message(0), self._message(1)])
+        self.mock_lambda.invoke.side_effect = [
+            {'StatusCode': 200, 'Payload': io.BytesIO(b'{"success": true, "throttled": 2}')},
+            {'StatusCode': 200, 'Payload': io.BytesIO(b'{"success": true, "throttled": 0}')},
+        ]
+
+        decision = adaptive_starter.execute({}, {})
+
+        self.assertEqual(self.mock_sqs.delete_message.call_count, 2)
+        self.mock_sqs.change_message_visibility_batch.assert_not_called()
+        self.assertEqual(decision['reason'], 'throttled')
+        self.assertEqual(decision['message_limit'], 100)
+        self.assertLessEqual(decision['throttled_until'], time.time() + 1)
+
+    def test_stops_dispatching_while_a_full_invoke_still_fits_the_tick(self):
+        self._queue(2, [self._message(0), self._message(1)])
+        clock = [1000.0]
+
+        def invoke(**kwargs):
+            clock[0] += 35.1
+            return {'StatusCode': 200}
+        self.mock_lambda.invoke.side_effect = invoke
+
+        with mock.patch('src.adaptive_starter.time.time', side_effect=lambda: clock[0]):
+            adaptive_starter.execute({}, {})
+
+        self.assertEqual(self.mock_lambda.invoke.call_count, 1)
+        entries = self.mock_sqs.change_message_visibility_batch.call_args[1]['Entries']
+        self.assertEqual([entry['ReceiptHandle'] for entry in entries], ['receipt-1'])
+
+    def test_dispatches_consecutive_group_messages_as_one_batch(self):
+        self.mock_os.environ['DISPATCH_BATCH_SIZE'] = '2'
+        self._queue(3, [self._message(index) for index in range(3)])
+        self.mock_lambda.invoke.side_effect = lambda **kwargs: {
+            'StatusCode': 200,
+            'Payload': io.BytesIO(json.dumps({
+                'results': [{'success': True} for _ in json.loads(kwargs['Payload'].decode('utf-8'))['messages']],
+                'throttled': 0,
+            }).encode('utf-8')),
+        }
+
+        adaptive_starter.execute({}, {})
+
+        payloads = [json.loads(call[1]['Payload'].decode('utf-8')) for call in self.mock_lambda.invoke.call_args_list]
+        self.assertEqual(
+            [[message['data']['Id'] for message in payload['messages']] for payload in payloads],
+            [[0, 1], [2]]
+        )
+        self.assertEqual(self.mock_sqs.delete_message.call_count, 3)
+
+    def test_failed_batch_items_stay_queued_and_stop_their_group(self):
+        self.mock_os.environ['DISPATCH_BATCH_SIZE'] = '2'
+        self._queue(4, [self._message(index) for index in range(4)])
+        self.mock_lambda.invoke.return_value = {
+            'StatusCode': 200,
+            'Payload': io.BytesIO(b'{"results": [{"success": true}, {"success": false}], "throttled": 0}'),
+        }
+
+        decision = adaptive_starter.execute({}, {})
+
+        self.assertEqual(self.mock_lambda.invoke.call_count, 1)
+        deleted = [call[1]['ReceiptHandle'] for call in self.mock_sqs.delete_message.call_args_list]
+        self.assertEqual(deleted, ['receipt-0'])
+        entries = self.mock_sqs.change_message_visibility_batch.call_args[1]['Entries']
+        self.assertEqual([entry['ReceiptHandle'] for entry in entries], ['receipt-2', 'receipt-3'])
+        self.assertEqual(decision['reason'], 'steady')
+
+    def test_batch_items_after_a_failure_are_released_not_deleted(self):
+        self.mock_os.environ['DISPATCH_BATCH_SIZE'] = '3'
+        self._queue(4, [self._message(index) for index in range(4)])
+        self.mock_lambda.invoke.return_value = {
+            'StatusCode': 200,
+            'Payload': io.BytesIO(
+                b'{"results": [{"success": true}, {"success": false}, {"success": true}], "throttled": 0}'
+            ),
+        }
+
+        decision = adaptive_starter.execute({}, {})
+
+        self.assertEqual(self.mock_lambda.invoke.call_count, 1)
+        deleted = [call[1]['ReceiptHandle'] for call in self.mock_sqs.delete_message.call_args_list]
+        self.assertEqual(deleted, ['receipt-0'])
+        entries = self.mock_sqs.change_message_visibility_batch.call_args[1]['Entries']
+        self.assertEqual([entry['ReceiptHandle'] for entry in entries], ['receipt-2', 'receipt-3'])
+        self.assertEqual(decision['reason'], 'steady')
+
+    def test_waits_out_retry_after_without_dispatching(self):
+        self.mock_dynamodb.get_item.return_value = {'Item': {
+            'message_limit': {'N': '100'},
+            'concurrency': {'N': '1'},
+            'latency_ms': {'N': '800'},
+            'throttled_until': {'N': '9999999999'},
+        }}
+        self._queue(50, [self._message(0)])
+
+        decision = adaptive_starter.execute({}, {})
+
+        self.assertEqual(decision['reason'], 'waiting')
+        self.mock_sqs.receive_message.assert_not_called()
+        self.mock_dynamodb.put_item.assert_not_called()
+
+    def test_failed_message_stops_its_group_only(self):
+        self._queue(4, [self._message(0, 'a'), self._message(1, 'a'), self._message(2, 'b')])
+        failure = {
+            'StatusCode': 200,
+            'FunctionError': 'Unhandled',
+            'Payload': io.BytesIO(b'{"errorType": "DynamicsRequestError", "errorMessage": "Dynamics returned 400"}'),
+        }
+        self.mock_lambda.invoke.side_effect = lambda **kwargs: (
+            failure if json.loads(kwargs['Payload'].decode('utf-8'))['data']['Id'] == 0 else {'StatusCode': 200}
+        )
+
+        decision = adaptive_starter.execute({}, {})
+
+        self.assertEqual(self.mock_lambda.invoke.call_count, 2)
+        entries = self.mock_sqs.change_message_visibility_batch.call_args[1]['Entries']
+        self.assertEqual([entry['ReceiptHandle'] for entry in entries], ['receipt-1'])
+        self.assertEqual(entries[0]['VisibilityTimeout'], 0)
+        self.assertEqual(decision['reason'], 'steady')
+
+    def test_releases_undispatched_messages_at_deadline(self):
+        self._queue(2, [self._message(0), self._message(1)])
+        context = mock.Mock()
+        context.get_remaining_time_in_millis.return_value = 5000
+
+        adaptive_starter.execute({}, context)
+
+        self.mock_lambda.invoke.assert_not_called()
+        entries = self.mock_sqs.change_message_visibility_batch.call_args[1]['Entries']
+        self.assertEqual(len(entries), 2)
+
+    def test_decreases_multiplicatively_when_latency_exceeds_target(self):
+        state = adaptive_starter.next_state(
+            self._state(latency_ms=2500),
+            self._tick(dispatched=10, latencies=[3000]),
+            500,
+            self.limits,
+            0
+        )
+
+        self.assertEqual(state['reason'], 'slow')
+        self.assertEqual(state['message_limit'], 100)
+        self.assertEqual(state['concurrency'], 1)
+        self.assertEqual(state['latency_ms'], 2750)
+
+    def test_limits_stay_within_floor_and_ceiling(self):
+        self.limits['message_limit_ceiling'] = 210
+        self.limits['concurrency_ceiling'] = 2
+        increased = adaptive_starter.next_state(
+            self._state(),
+            self._tick(dispatched=200, latencies=[100]),
+            1000,
+            self.limits,
+            0
+        )
+        decreased = adaptive_starter.next_state(
+            self._state(message_limit=30, concurrency=1),
+            self._tick(throttled=1, retry_after=10),
+            1000,
+            self.limits,
+            100
+        )
+
+        self.assertEqual((increased['message_limit'], increased['concurrency']), (210, 2))
+        self.assertEqual((decreased['message_limit'], decreased['concurrency']), (20, 1))
+        self.assertEqual(decreased['throttled_until'], 110)
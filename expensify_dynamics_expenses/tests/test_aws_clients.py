@@ -0,0 +1,33 @@
+from unittest2 import TestCase
+import mock
+
+from src import aws_clients
+
+
+class TestAwsClients(TestCase):
+    def setUp(self):
+        self.boto3_patcher = mock.patch('src.aws_clients.boto3')
+        self.mock_boto3 = self.boto3_patcher.start()
+        self.mock_boto3.client.side_effect = lambda service_name: mock.Mock(name=service_name)
+        aws_clients._clients.clear()
+
+    def tearDown(self):
+        self.boto3_patcher.stop()
+        aws_clients._clients.clear()
+
+    def test_creates_one_client_per_service(self):
+        s3 = aws_clients.client('s3')
+
+        self.assertIs(aws_clients.client('s3'), s3)
+        self.assertIs(aws_clients.getter('s3')(), s3)
+        self.assertIsNot(aws_clients.client('sqs'), s3)
+        self.assertEqual(self.mock_boto3.client.call_count, 2)
+
+    def test_reads_codes_from_client_errors(self):
+        error = Exception()
+        error.response = {'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}
+
+        self.assertEqual(aws_clients.error_code(error), 'NoSuchKey')
+        self.assertEqual(aws_clients.status_code(error), 404)
+        self.assertIsNone(aws_clients.error_code(ValueError()))
+        self.assertIsNone(aws_clients.status_code(ValueError()))
@@ -0,0 +1,64 @@
+from unittest2 import TestCase
+from datetime import date, timedelta
+import mock
+from dateutil import parser
+
+from src.date_normalizer import DateNormalizer
+from lib.dynamics_constants import TIMESTAMP_FORMAT
+
+
+class TestDateNormalizer(TestCase):
+    def setUp(self):
+        first_day = date(2018, 6, 1)
+        self.us_dates = [
+            '{d.month}/{d.day}/{d.year}'.format(d=first_day + timedelta(days=i))
+            for i in range(40)
+        ]
+
+    def test_output_matches_dateutil(self):
+        normalize_date = DateNormalizer(sample_size=5)
+        raw_dates = self.us_dates + ['2018-06-01', '13/01/2018', 'June 3 2018', '06/01/2018 14:30']
+
+        for raw_date in raw_dates:
+            self.assertEqual(
+                normalize_date(raw_date),
+                parser.parse(raw_date).strftime(TIMESTAMP_FORMAT),
+                raw_date
+            )
+
+    def test_detects_format_from_sample(self):
+        normalize_date = DateNormalizer(sample_size=5)
+        for raw_date in self.us_dates[:5]:
+            normalize_date(raw_date)
+
+        self.assertEqual(normalize_date.date_format, '%m/%d/%Y')
+
+    def test_uses_strict_parser_after_detection(self):
+        normalize_date = DateNormalizer(sample_size=5)
+        with mock.patch('src.date_normalizer.parser.parse', wraps=parser.parse) as mock_parse:
+            for raw_date in self.us_dates:
+                normalize_date(raw_date)
+
+        self.assertEqual(mock_parse.call_count, 5)
+
+    def test_falls_back_to_dateutil_for_outliers(self):
+        normalize_date = DateNormalizer(sample_size=5)
+        for raw_date in self.us_dates[:5]:
+            normalize_date(raw_date)
+
+        self.assertEqual(normalize_date('June 10 2018'), '2018-06-10T00:00:00Z')
+
+    def test_memoizes_repeated_dates(self):
+        normalize_date = DateNormalizer()
+        with mock.patch('src.date_normalizer.parser.parse', wraps=parser.parse) as mock_parse:
+            for _ in range(3):
+                normalize_date('06/01/2018')
+
+        self.assertEqual(mock_parse.call_count, 1)
+
+    def test_cache_is_bounded(self):
+        normalize_date = DateNormalizer(cache_size=10)
+        for raw_date in self.us_dates:
+            normalize_date(raw_date)
+
+        self.assertEqual(len(normalize_date._cache), 10)
@@ -0,0 +1,91 @@
+from unittest2 import TestCase
+import mock
+
+from src.dead_letter import DeadLetterCsv
+
+
+class NoSuchKey(Exception):
+    response = {'Error': {'Code': 'NoSuchKey'}}
+
+
+class AccessDenied(Exception):
+    response = {'Error': {'Code': 'AccessDenied'}, 'ResponseMetadata': {'HTTPStatusCode': 403}}
+
+
+class Throttled(Exception):
+    response = {'Error': {'Code': 'SlowDown'}, 'ResponseMetadata': {'HTTPStatusCode': 503}}
+
+
+class TestDeadLetterCsv(TestCase):
+    def setUp(self):
+        self.environ_patcher = mock.patch.dict('os.environ', {'DEAD_LETTER_BUCKET': 'dead-letters'})
+        self.environ_patcher.start()
+
+        self.s3_patcher = mock.patch('src.dead_letter._get_s3')
+        self.mock_s3 = self.s3_patcher.start().return_value
+
+        self.dead_letters = DeadLetterCsv('exports/file.csv', ['BatchID', 'Amount'])
+
+    def tearDown(self):
+        self.environ_patcher.stop()
+        self.s3_patcher.stop()
+
+    def test_writes_nothing_without_rejections(self):
+        self.assertIsNone(self.dead_letters.write())
+        self.mock_s3.put_object.assert_not_called()
+
+    def test_writes_rejected_rows_with_reasons(self):
+        self.dead_letters.add(2, ['555', 'twelve'], ['Amount is not a number'])
+        self.dead_letters.add(5, ['', '1'], ['BatchID is required', 'other'])
+
+        location = self.dead_letters.write()
+
+        self.assertEqual(location, {'bucket': 'dead-letters', 'key': 'dead-letter/exports/file.csv.rejected.csv'})
+        self.assertEqual(
+            self.mock_s3.put_object.call_args[1]['Body'].decode('utf-8'),
+            'row_number,BatchID,Amount,reasons\r\n'
+            '2,555,twelve,Amount is not a number\r\n'
+            '5,,1,BatchID is required; other\r\n'
+        )
+
+    def test_continuation_appends_to_existing_dead_letters(self):
+        self.mock_s3.get_object.return_value = {'Body': mock.Mock()}
+        self.mock_s3.get_object.return_value['Body'].read.return_value = (
+            b'row_number,BatchID,Amount,reasons\r\n2,555,twelve,bad\r\n'
+        )
+        self.dead_letters.add(900, ['555', 'x'], ['bad'])
+
+        self.dead_letters.write(append=True)
+
+        self.assertEqual(
+            self.mock_s3.put_object.call_args[1]['Body'],
+            b'row_number,BatchID,Amount,reasons\r\n2,555,twelve,bad\r\n900,555,x,bad\r\n'
+        )
+
+    def test_continuation_without_earlier_dead_letters_writes_header(self):
+        self.mock_s3.get_object.side_effect = NoSuchKey()
+        self.dead_letters.add(900, ['555', 'x'], ['bad'])
+
+        self.dead_letters.write(append=True)
+
+        self.assertTrue(self.mock_s3.put_object.call_args[1]['Body'].startswith(b'row_number,'))
+
+    def test_continuation_treats_access_denied_as_no_earlier_dead_letters(self):
+        self.mock_s3.get_object.side_effect = AccessDenied()
+        self.dead_letters.add(900, ['555', 'x'], ['bad'])
+
+        self.dead_letters.write(append=True)
+
+        self.assertEqual(
+            self.mock_s3.put_object.call_args[1]['Body'],
+            b'row_number,BatchID,Amount,reasons\r\n900,555,x,bad\r\n'
+        )
+
+    def test_other_read_errors_are_raised(self):
+        self.mock_s3.get_object.side_effect = Throttled()
+        self.dead_letters.add(900, ['555', 'x'], ['bad'])
+
+        with self.assertRaises(Throttled):
+            self.dead_letters.write(append=True)
+
+        self.mock_s3.put_object.assert_not_called()
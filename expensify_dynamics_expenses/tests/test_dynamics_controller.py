@@ -1,8 +1,18 @@
 from unittest2 import TestCase
 import mock
 
+import gzip
+import os
+import shutil
+import tempfile
+import time
+
 from src import dynamics_controller
+from src.date_normalizer import DateNormalizer
+from src.idempotency import SqliteStore
+from src.s3_stream import iter_lines
 from lib.dynamics_constants import MESSAGE_DATE_TIME_FIELD, TRANS_DATE_FIELD
+from lib.expensify_constants import EXPENSE_UNIQUE_ID
 
 
 class TestController(TestCase):
@@ -14,7 +24,8 @@ class TestController(TestCase):
         self.expenses_endpoint = '/data/IDEO_Expenses'
         self.mock_os.environ = {
             'DYNAMICS_EXPENSES_ENDPOINT': self.expenses_endpoint,
-            'QUEUE_NAME': self.queue_name
+            'QUEUE_NAME': self.queue_name,
+            'CONTROLLER_RESULT_MODE': 'payloads',
         }
 
         self.batch_id = '555'
@@ -79,7 +90,7 @@ class TestController(TestCase):
         self.assertEqual(expected_error, 'Expenses CSV not found')
         self.assertEqual(
             expected_extra_data,
-            self.event
+            self.event['Records'][0]
         )
 
     def test_calls_sqs_client_with_single_row(self):
@@ -190,4 +201,477 @@ class TestController(TestCase):
             }
         ]
 
-        self.assertEqual(return_values, expected_return_values)
+        self.assertEqual(return_values[0]['payloads'], expected_return_values)
+
+    def test_publishes_with_send_message_batch_in_batch_mode(self):
+        self.mock_os.environ['SQS_PUBLISH_MODE'] = 'batch'
+        self.mock_fetch_from_s3.return_value = self.multi_row_response
+        with mock.patch('src.dynamics_controller.send_fifo_messages') as mock_send_batch:
+            mock_send_batch.side_effect = lambda queue_url, messages: len(list(messages))
+            return_values = dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(mock_send_batch.call_args[0][0], self.queue_url)
+        self.assertEqual(len(return_values[0]['payloads']), 3)
+        self.mock_sqs_client.send_fifo_message.assert_not_called()
+
+    def test_publishes_through_the_pipelined_engine(self):
+        self.mock_os.environ.update({'PUBLISH_ENGINE': 'pipelined', 'PUBLISH_MAX_IN_FLIGHT': '2'})
+        self.mock_fetch_from_s3.return_value = self.multi_row_response
+
+        with mock.patch('src.dynamics_controller.pipelined_publisher.publish',
+                        wraps=dynamics_controller.pipelined_publisher.publish) as mock_publish:
+            return_values = dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(mock_publish.call_args[1]['max_in_flight'], 2)
+        self.assertEqual(self.mock_sqs_client.send_fifo_message.call_count, 3)
+        self.assertEqual(return_values[0]['published'], 3)
+        self.assertEqual([payload['MerchantId'] for payload in return_values[0]['payloads']], ['1', '2', '3'])
+
+    def test_pipelined_send_failures_fail_the_file(self):
+        self.mock_os.environ['PUBLISH_ENGINE'] = 'pipelined'
+        self.mock_fetch_from_s3.return_value = self.multi_row_response
+        self.mock_sqs_client.send_fifo_message.side_effect = Exception('sqs down')
+
+        with self.assertRaises(dynamics_controller.ExpenseFilesFailedError):
+            dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(self.mock_logger.call_args[1]['extra_data']['error'], 'sqs down')
+
+    def test_streams_csv_from_s3_in_stream_mode(self):
+        self.mock_os.environ['CSV_INGESTION'] = 'stream'
+        with mock.patch('src.dynamics_controller.iter_s3_lines') as mock_iter_s3_lines:
+            mock_iter_s3_lines.return_value = iter(
+                self.multi_row_response.decode('utf-8').splitlines(True)
+            )
+            return_values = dynamics_controller.start(self.event, self.context)
+
+        mock_iter_s3_lines.assert_called_with(self.bucket_name, self.csv_file, fetch_timer=mock.ANY)
+        self.mock_fetch_from_s3.assert_not_called()
+        payloads = return_values[0]['payloads']
+        self.assertEqual(len(payloads), 3)
+        self.assertEqual(payloads[1]['Amount'], 300.52)
+
+    def test_times_streamed_s3_reads_apart_from_parsing(self):
+        self.mock_os.environ['CSV_INGESTION'] = 'stream'
+
+        def slow_chunks():
+            for line in self.multi_row_response.splitlines(True):
+                time.sleep(0.01)
+                yield line
+
+        def iter_s3_lines(bucket_name, key, fetch_timer):
+            return iter_lines(fetch_timer.wrap(slow_chunks()))
+
+        with mock.patch('src.dynamics_controller.iter_s3_lines', side_effect=iter_s3_lines), \
+                mock.patch('src.dynamics_controller.metrics.record') as mock_record:
+            dynamics_controller.start(self.event, self.context)
+
+        recorded = {call[0][0]: call[0][1] for call in mock_record.call_args_list}
+        self.assertGreaterEqual(recorded['S3FetchTime'], 40)
+        self.assertLess(recorded['CsvParseTime'], 20)
+
+    def test_streams_compressed_csv_regardless_of_ingestion_mode(self):
+        self.event['Records'][0]['s3']['object']['key'] = 'file.csv.gz'
+        with mock.patch('src.dynamics_controller.iter_s3_lines') as mock_iter_s3_lines:
+            mock_iter_s3_lines.return_value = iter(
+                self.multi_row_response.decode('utf-8').splitlines(True)
+            )
+            return_values = dynamics_controller.start(self.event, self.context)
+
+        mock_iter_s3_lines.assert_called_with(self.bucket_name, 'file.csv.gz', fetch_timer=mock.ANY)
+        self.mock_fetch_from_s3.assert_not_called()
+        self.assertEqual(len(return_values[0]['payloads']), 3)
+
+    def test_decompresses_content_encoded_objects_in_buffered_mode(self):
+        self.mock_fetch_from_s3.return_value = gzip.compress(self.multi_row_response)
+
+        return_values = dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(len(return_values[0]['payloads']), 3)
+
+    def test_processes_every_record_in_event(self):
+        second_record = {
+            's3': {'bucket': {'name': self.bucket_name}, 'object': {'key': 'second.csv'}}
+        }
+        self.event['Records'].append(second_record)
+        self.mock_fetch_from_s3.side_effect = lambda bucket_name, key: (
+            self.multi_row_response if key == 'second.csv' else self.single_row_response
+        )
+
+        summaries = dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual([summary['key'] for summary in summaries], [self.csv_file, 'second.csv'])
+        self.assertEqual([len(summary['payloads']) for summary in summaries], [1, 3])
+        self.assertEqual(self.mock_sqs_client.send_fifo_message.call_count, 4)
+
+    def test_isolates_failures_per_file(self):
+        self.event['Records'].append(
+            {'s3': {'bucket': {'name': self.bucket_name}, 'object': {'key': 'broken.csv'}}}
+        )
+
+        def fetch(bucket_name, key):
+            if key == 'broken.csv':
+                raise IOError('access denied')
+            return self.single_row_response
+        self.mock_fetch_from_s3.side_effect = fetch
+
+        with self.assertRaisesRegex(dynamics_controller.ExpenseFilesFailedError, '1 of 2 .*broken.csv'):
+            dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(self.mock_sqs_client.send_fifo_message.call_count, 1)
+        self.assertEqual(self.mock_logger.call_args[0][0], 'Expenses CSV failed')
+        self.assertEqual(self.mock_logger.call_args[1]['extra_data']['error'], 'access denied')
+
+    def test_checkpoints_and_continues_before_timeout(self):
+        self.mock_fetch_from_s3.return_value = self.multi_row_response
+        context = mock.Mock(function_name='controller')
+        context.get_remaining_time_in_millis.side_effect = [60000, 60000, 1000]
+
+        with mock.patch('src.dynamics_controller.invoke_async') as mock_invoke_async, \
+                mock.patch.object(dynamics_controller, 'PUBLISH_CHUNK_SIZE', 1):
+            summaries = dynamics_controller.start(self.event, context)
+
+        header_and_two_rows = b''.join(self.multi_row_response.splitlines(True)[:3])
+        checkpoint = {
+            'bucket': self.bucket_name,
+            'key': self.csv_file,
+            'offset': len(header_and_two_rows),
+            'row_index': 2,
+            'fieldnames': [
+                'BatchID', 'MerchantID', 'ProjectID', 'ProjectIDEntity',
+                MESSAGE_DATE_TIME_FIELD, 'Amount', TRANS_DATE_FIELD
+            ],
+        }
+        mock_invoke_async.assert_called_with('controller', {'continuation': checkpoint})
+        self.assertEqual(summaries[0]['status'], 'checkpointed')
+        self.assertEqual(summaries[0]['checkpoint'], checkpoint)
+        self.assertEqual(self.mock_sqs_client.send_fifo_message.call_count, 2)
+
+    def test_resumes_from_checkpoint_offset(self):
+        lines = self.multi_row_response.decode('utf-8').splitlines(True)
+        offset = len(''.join(lines[:3]).encode('utf-8'))
+        event = {
+            'continuation': {
+                'bucket': self.bucket_name,
+                'key': self.csv_file,
+                'offset': offset,
+                'row_index': 2,
+                'fieldnames': lines[0].strip().split(','),
+            }
+        }
+
+        with mock.patch('src.dynamics_controller.iter_s3_lines') as mock_iter_s3_lines:
+            mock_iter_s3_lines.return_value = iter(lines[3:])
+            summaries = dynamics_controller.start(event, self.context)
+
+        mock_iter_s3_lines.assert_called_with(self.bucket_name, self.csv_file, start=offset, end=None, fetch_timer=mock.ANY)
+        self.assertEqual(summaries[0]['status'], 'published')
+        self.assertEqual(
+            summaries[0]['payloads'],
+            [
+                {
+                    'BatchID': '555',
+                    'MerchantId': '3',
+                    'ProjectId': '33',
+                    'ProjectIdEntity': 'GBR',
+                    MESSAGE_DATE_TIME_FIELD: '2018-06-03T00:00:00Z',
+                    'Amount': 400.62,
+                    TRANS_DATE_FIELD: '2018-06-03T00:00:00Z',
+                }
+            ]
+        )
+
+    def test_splits_large_files_into_line_aligned_parts(self):
+        self.mock_os.environ.update({
+            'CONTROLLER_MODE': 'split',
+            'MESSAGE_GROUP_STRATEGY': 'sharded',
+            'SPLIT_MIN_BYTES': '10',
+            'SPLIT_PARTS': '2',
+        })
+        context = mock.Mock(function_name='controller')
+        fieldnames = ['BatchID', 'Amount']
+
+        with mock.patch('src.dynamics_controller.head', return_value=(120, None)), \
+                mock.patch('src.dynamics_controller.range_split.plan_ranges',
+                           return_value=(fieldnames, [(14, 60), (60, 120)])), \
+                mock.patch('src.dynamics_controller.invoke_async') as mock_invoke_async:
+            summaries = dynamics_controller.start(self.event, context)
+
+        self.assertEqual(summaries[0]['status'], 'split')
+        self.assertEqual(summaries[0]['parts'], 2)
+        self.assertFalse(self.mock_sqs_client.send_fifo_message.called)
+        continuations = [call[0][1]['continuation'] for call in mock_invoke_async.call_args_list]
+        self.assertEqual(
+            [(part['offset'], part['end'], part['split']['part']) for part in continuations],
+            [(14, 60, 0), (60, 120, 1)]
+        )
+        self.assertEqual(continuations[0]['fieldnames'], fieldnames)
+        self.assertEqual(continuations[0]['split']['id'], summaries[0]['split_id'])
+
+    def test_reads_small_files_in_one_invocation_in_split_mode(self):
+        self.mock_os.environ.update({'CONTROLLER_MODE': 'split', 'MESSAGE_GROUP_STRATEGY': 'sharded'})
+
+        with mock.patch('src.dynamics_controller.head', return_value=(120, None)) as mock_head, \
+                mock.patch('src.dynamics_controller.range_split.plan_ranges') as mock_plan_ranges:
+            summaries = dynamics_controller.start(self.event, self.context)
+
+        mock_head.assert_called_with(self.bucket_name, self.csv_file)
+        self.assertFalse(mock_plan_ranges.called)
+        self.assertEqual(summaries[0]['status'], 'published')
+
+    def test_never_splits_files_grouped_by_batch(self):
+        self.mock_os.environ.update({'CONTROLLER_MODE': 'split', 'SPLIT_MIN_BYTES': '10'})
+
+        with mock.patch('src.dynamics_controller.head', return_value=(10 ** 9, None)) as mock_head:
+            summaries = dynamics_controller.start(self.event, self.context)
+
+        self.assertFalse(mock_head.called)
+        self.assertEqual(summaries[0]['status'], 'published')
+
+    def test_isolates_split_failures_per_file(self):
+        self.mock_os.environ.update({'CONTROLLER_MODE': 'split', 'MESSAGE_GROUP_STRATEGY': 'sharded'})
+        self.event['Records'].append(
+            {'s3': {'bucket': {'name': self.bucket_name}, 'object': {'key': 'missing.csv'}}}
+        )
+
+        def head(bucket_name, key):
+            if key == 'missing.csv':
+                raise KeyError('missing.csv')
+            return 120, None
+
+        with mock.patch('src.dynamics_controller.head', side_effect=head), \
+                self.assertRaisesRegex(dynamics_controller.ExpenseFilesFailedError, '1 of 2 .*missing.csv'):
+            dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(self.mock_sqs_client.send_fifo_message.call_count, 1)
+
+    def test_publishes_its_range_and_records_the_part(self):
+        lines = self.multi_row_response.decode('utf-8').splitlines(True)
+        start = len(lines[0].encode('utf-8'))
+        end = len(''.join(lines[:3]).encode('utf-8'))
+        split = {'id': 'abc', 'part': 0, 'parts': 2, 'started_at': 0, 'start': start}
+        event = {
+            'continuation': {
+                'bucket': self.bucket_name,
+                'key': self.csv_file,
+                'offset': start,
+                'end': end,
+                'row_index': 0,
+                'fieldnames': lines[0].strip().split(','),
+                'split': split,
+            }
+        }
+
+        with mock.patch('src.dynamics_controller.iter_s3_lines', return_value=iter(lines[1:3])) as mock_iter_s3_lines, \
+                mock.patch('src.dynamics_controller.range_split.record_part', return_value=None) as mock_record_part:
+            summaries = dynamics_controller.start(event, self.context)
+
+        mock_iter_s3_lines.assert_called_with(self.bucket_name, self.csv_file, start=start, end=end, fetch_timer=mock.ANY)
+        self.assertEqual(summaries[0]['published'], 2)
+        part_summary = mock_record_part.call_args[0][1]
+        self.assertEqual(part_summary['bytes_read'], end - start)
+        self.assertEqual(part_summary['batch_ids'], [self.batch_id])
+        self.assertNotIn('payloads', part_summary)
+        self.assertNotIn('aggregate', summaries[0])
+
+    def test_last_part_returns_the_aggregate(self):
+        lines = self.multi_row_response.decode('utf-8').splitlines(True)
+        start = len(''.join(lines[:3]).encode('utf-8'))
+        split = {
+            'id': 'abc', 'part': 1, 'parts': 2, 'started_at': 0, 'start': start,
+            'carried': {'published': 5, 'skipped': 0, 'rejected': 0, 'batch_ids': ['444']},
+        }
+        event = {
+            'continuation': {
+                'bucket': self.bucket_name,
+                'key': self.csv_file,
+                'offset': start,
+                'end': len(self.multi_row_response),
+                'row_index': 0,
+                'fieldnames': lines[0].strip().split(','),
+                'split': split,
+            }
+        }
+        aggregate = {'status': 'published', 'published': 8, 'elapsed_ms': 1200}
+
+        with mock.patch('src.dynamics_controller.iter_s3_lines', return_value=iter(lines[3:])), \
+                mock.patch('src.dynamics_controller.range_split.record_part', return_value=aggregate) as mock_record_part, \
+                mock.patch('src.dynamics_controller.metrics.put_property') as mock_put_property:
+            summaries = dynamics_controller.start(event, self.context)
+
+        part_summary = mock_record_part.call_args[0][1]
+        self.assertEqual(part_summary['published'], 6)
+        self.assertEqual(part_summary['batch_ids'], ['444', self.batch_id])
+        self.assertEqual(summaries[0]['aggregate'], aggregate)
+        mock_put_property.assert_called_with('split_aggregate', aggregate)
+
+    def test_skips_rows_already_published(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        store = SqliteStore(os.path.join(tmp_dir, 'published.db'))
+        self.mock_fetch_from_s3.return_value = (
+            'BatchID,{},Amount\r\n'
+            '555,expense-1,200\r\n'
+            '555,expense-2,300\r\n'.format(EXPENSE_UNIQUE_ID)
+        ).encode()
+
+        with mock.patch('src.dynamics_controller.idempotency.get_store', return_value=store):
+            first_run = dynamics_controller.start(self.event, self.context)
+            second_run = dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(len(first_run[0]['payloads']), 2)
+        self.assertEqual(second_run[0]['payloads'], [])
+        self.assertEqual(second_run[0]['skipped'], 2)
+        self.assertEqual(self.mock_sqs_client.send_fifo_message.call_count, 2)
+
+    def test_publishes_compact_envelopes(self):
+        self.mock_os.environ['MESSAGE_ENCODING'] = 'compact'
+        self.mock_fetch_from_s3.return_value = self.multi_row_response
+
+        summaries = dynamics_controller.start(self.event, self.context)
+
+        message = self.mock_sqs_client.send_fifo_message.call_args_list[0][0][1]
+        self.assertEqual(message['e'], 'exp')
+        self.assertEqual(message['d']['Amount'], 200)
+        self.assertEqual(summaries[0]['payloads'][0]['Amount'], 200)
+
+    def test_rejects_invalid_rows_to_dead_letter_csv(self):
+        self.mock_os.environ['ROW_VALIDATION'] = 'strict'
+        self.mock_fetch_from_s3.return_value = (
+            'BatchID,MerchantID,ProjectID,ProjectIDEntity,MessageDateTime,Amount,TransDate\r\n'
+            '555,1,11,USA,06/01/2018,200,06/01/2018\r\n'
+            '555,2,22,DEU,06/02/2018,twelve,6/2/2018\r\n'
+            ',3,33,GBR,not a date,400.62,06/03/2018\r\n'
+            '555,4,44,FRA,06/04/2018,,\r\n'
+        ).encode()
+
+        with mock.patch('src.dynamics_controller.DeadLetterCsv.write') as mock_write:
+            mock_write.return_value = {'bucket': 'dead-letters', 'key': 'dead-letter/file.csv.rejected.csv'}
+            summaries = dynamics_controller.start(self.event, self.context)
+
+        summary = summaries[0]
+        self.assertEqual(summary['status'], 'published')
+        self.assertEqual([payload['MerchantId'] for payload in summary['payloads']], ['1', '4'])
+        self.assertEqual(summary['rejected'], 2)
+        self.assertEqual(summary['dead_letter']['key'], 'dead-letter/file.csv.rejected.csv')
+        mock_write.assert_called_once_with(append=False)
+
+    def test_dead_letter_rows_carry_row_numbers_and_reasons(self):
+        self.mock_os.environ['ROW_VALIDATION'] = 'strict'
+        self.mock_fetch_from_s3.return_value = (
+            'BatchID,MessageDateTime,Amount\r\n'
+            '555,06/01/2018,200\r\n'
+            ',not a date,twelve\r\n'
+        ).encode()
+
+        with mock.patch('src.dynamics_controller.DeadLetterCsv.write'), \
+                mock.patch('src.dynamics_controller.DeadLetterCsv.add') as mock_add:
+            dynamics_controller.start(self.event, self.context)
+
+        row_number, row, reasons = mock_add.call_args[0]
+        self.assertEqual((row_number, row), (2, ['', 'not a date', 'twelve']))
+        self.assertEqual(sorted(reasons), [
+            'Amount is not a number',
+            'BatchID is required',
+            '{} is not a date'.format(MESSAGE_DATE_TIME_FIELD),
+        ])
+
+    def test_writes_dead_letters_when_publishing_fails(self):
+        self.mock_os.environ['ROW_VALIDATION'] = 'strict'
+        self.mock_fetch_from_s3.return_value = (
+            'BatchID,MessageDateTime,Amount\r\n'
+            ',06/01/2018,200\r\n'
+            '555,06/02/2018,300\r\n'
+        ).encode()
+        self.mock_sqs_client.send_fifo_message.side_effect = Exception('sqs down')
+
+        with mock.patch('src.dynamics_controller.DeadLetterCsv.write') as mock_write, \
+                self.assertRaises(dynamics_controller.ExpenseFilesFailedError):
+            dynamics_controller.start(self.event, self.context)
+
+        mock_write.assert_called_once_with(append=False)
+
+    def test_dead_letter_write_failures_do_not_fail_a_published_file(self):
+        self.mock_os.environ['ROW_VALIDATION'] = 'strict'
+        self.mock_fetch_from_s3.return_value = (
+            'BatchID,MessageDateTime,Amount\r\n'
+            ',06/01/2018,200\r\n'
+            '555,06/02/2018,300\r\n'
+        ).encode()
+
+        with mock.patch('src.dynamics_controller.DeadLetterCsv.write', side_effect=Exception('s3 down')):
+            summaries = dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(summaries[0]['status'], 'published')
+        self.assertEqual(summaries[0]['published'], 1)
+        self.assertEqual(summaries[0]['rejected'], 1)
+        self.assertIsNone(summaries[0]['dead_letter'])
+        self.assertEqual(self.mock_logger.call_args[0][0], 'Dead letter CSV failed')
+
+    def test_dates_are_parsed_once_for_validation_and_payload(self):
+        self.mock_os.environ['ROW_VALIDATION'] = 'strict'
+        self.mock_fetch_from_s3.return_value = self.multi_row_response
+
+        with mock.patch('src.date_normalizer.DateNormalizer._parse', autospec=True,
+                        side_effect=DateNormalizer._parse) as mock_parse:
+            summaries = dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(summaries[0]['published'], 3)
+        # Six distinct date values across the two columns, each parsed once.
+        self.assertEqual(mock_parse.call_count, 6)
+
+    def _published_group_ids(self):
+        return [call[0][2] for call in self.mock_sqs_client.send_fifo_message.call_args_list]
+
+    def test_groups_messages_by_batch_id_by_default(self):
+        self.mock_fetch_from_s3.return_value = self.multi_row_response
+
+        dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(self._published_group_ids(), [self.batch_id] * 3)
+
+    def test_shards_message_groups_within_a_batch(self):
+        self.mock_os.environ['MESSAGE_GROUP_STRATEGY'] = 'sharded'
+        self.mock_os.environ['MESSAGE_GROUP_SHARDS'] = '4'
+        rows = ''.join(
+            '{},{},expense-{}\r\n'.format(self.batch_id, index, index) for index in range(40)
+        )
+        self.mock_fetch_from_s3.return_value = (
+            'BatchID,Amount,{}\r\n'.format(EXPENSE_UNIQUE_ID) + rows
+        ).encode()
+
+        dynamics_controller.start(self.event, self.context)
+        first_run = self._published_group_ids()
+        self.mock_sqs_client.send_fifo_message.reset_mock()
+        dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(
+            set(first_run),
+            {'{}-{}'.format(self.batch_id, shard) for shard in range(4)}
+        )
+        self.assertEqual(self._published_group_ids(), first_run)
+
+    def test_groups_messages_by_configured_column(self):
+        self.mock_os.environ['MESSAGE_GROUP_STRATEGY'] = 'column'
+        self.mock_os.environ['MESSAGE_GROUP_COLUMN'] = 'ProjectIdEntity'
+        self.mock_fetch_from_s3.return_value = self.multi_row_response
+
+        summaries = dynamics_controller.start(self.event, self.context)
+
+        self.assertEqual(self._published_group_ids(), ['USA', 'DEU', 'GBR'])
+        self.assertEqual(summaries[0]['batch_ids'], [self.batch_id])
+
+    def test_returns_summary_without_payloads_by_default(self):
+        del self.mock_os.environ['CONTROLLER_RESULT_MODE']
+        self.mock_fetch_from_s3.return_value = self.multi_row_response
+
+        summaries = dynamics_controller.start(self.event, self.context)
+
+        summary = summaries[0]
+        self.assertNotIn('payloads', summary)
+        self.assertEqual(summary['status'], 'published')
+        self.assertEqual(summary['published'], 3)
+        self.assertEqual(summary['skipped'], 0)
+        self.assertEqual(summary['batch_ids'], [self.batch_id])
+        self.assertEqual(summary['bytes_read'], len(self.multi_row_response))
+        self.assertIn('elapsed_ms', summary)
@@ -0,0 +1,93 @@
+from unittest2 import TestCase
+import mock
+
+from src import dynamics_session
+
+
+class TestDynamicsSession(TestCase):
+    def setUp(self):
+        self.os_patch = mock.patch('src.dynamics_session.os')
+        self.mock_os = self.os_patch.start()
+        self.mock_os.environ = {
+            'DYNAMICS_BASE_URL': 'https://ideo.operations.dynamics.com',
+            'DYNAMICS_CLIENT_ID': 'client-id',
+            'DYNAMICS_USER_NAME': 'user',
+            'DYNAMICS_USER_PASSWORD': 'password',
+            'DYNAMICS_AUTHORITY': 'https://login.microsoftonline.com/tenant',
+        }
+
+        self.requests_patcher = mock.patch('src.dynamics_session.requests')
+        self.mock_requests = self.requests_patcher.start()
+        self.mock_http = self.mock_requests.Session.return_value
+        self.mock_http.post.return_value.json.return_value = {
+            'access_token': 'token',
+            'expires_in': '3600',
+        }
+        self.mock_http.request.return_value.status_code = 201
+
+        self.time_patcher = mock.patch('src.dynamics_session.time.time')
+        self.mock_time = self.time_patcher.start()
+        self.mock_time.return_value = 1000
+
+        dynamics_session._session = None
+        dynamics_session.invalidate_access_token()
+
+    def tearDown(self):
+        self.os_patch.stop()
+        self.requests_patcher.stop()
+        self.time_patcher.stop()
+        dynamics_session._session = None
+        dynamics_session.invalidate_access_token()
+
+    def test_reuses_session_and_token_across_requests(self):
+        for _ in range(3):
+            dynamics_session.request('post', '/data/IDEO_Expenses', json={})
+
+        self.assertEqual(self.mock_requests.Session.call_count, 1)
+        self.assertEqual(self.mock_http.post.call_count, 1)
+        self.assertEqual(self.mock_http.request.call_count, 3)
+        self.mock_http.request.assert_called_with(
+            'post',
+            'https://ideo.operations.dynamics.com/data/IDEO_Expenses',
+            headers={'Authorization': 'Bearer token'},
+            timeout=dynamics_session.REQUEST_TIMEOUT_SECONDS,
+            json={}
+        )
+
+    def test_refreshes_token_shortly_before_expiry(self):
+        dynamics_session.get_access_token()
+        self.mock_time.return_value = 1000 + 3600 - dynamics_session.TOKEN_REFRESH_MARGIN_SECONDS - 1
+        dynamics_session.get_access_token()
+        self.assertEqual(self.mock_http.post.call_count, 1)
+
+        self.mock_time.return_value = 1000 + 3600 - dynamics_session.TOKEN_REFRESH_MARGIN_SECONDS
+        dynamics_session.get_access_token()
+        self.assertEqual(self.mock_http.post.call_count, 2)
+
+    def test_refreshes_token_and_retries_once_on_401(self):
+        unauthorized = mock.Mock(status_code=401)
+        created = mock.Mock(status_code=201)
+        self.mock_http.request.side_effect = [unauthorized, created]
+
+        response = dynamics_session.request('post', '/data/IDEO_Expenses', json={})
+
+        self.assertEqual(response, created)
+        self.assertEqual(self.mock_http.post.call_count, 2)
+
+    def test_requests_tokens_from_the_configured_authority(self):
+        self.mock_os.environ['DYNAMICS_AUTHORITY'] = 'https://login.microsoftonline.com/ideo.com/'
+
+        dynamics_session.get_access_token()
+
+        self.assertEqual(
+            self.mock_http.post.call_args[0][0],
+            'https://login.microsoftonline.com/ideo.com/oauth2/token'
+        )
+
+    def test_fails_before_requesting_a_token_without_an_authority(self):
+        del self.mock_os.environ['DYNAMICS_AUTHORITY']
+
+        with self.assertRaises(dynamics_session.DynamicsConfigurationError):
+            dynamics_session.get_access_token()
+
+        self.mock_http.post.assert_not_called()
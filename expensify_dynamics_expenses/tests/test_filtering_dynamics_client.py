@@ -0,0 +1,224 @@
+from unittest2 import TestCase
+import mock
+
+from src import filtering_dynamics_client
+from src.filtering_dynamics_client import DynamicsRequestError, DynamicsThrottledError
+from lib.expensify_constants import EXPENSE_UNIQUE_ID
+
+
+class TestFilteringDynamicsClient(TestCase):
+    def setUp(self):
+        self.endpoint = '/data/IDEO_Expenses'
+        self.base_url = 'https://ideo.operations.dynamics.com'
+
+        self.session_patcher = mock.patch('src.filtering_dynamics_client.dynamics_session')
+        self.mock_session = self.session_patcher.start()
+        self.mock_session.base_url.return_value = self.base_url
+        self.mock_response = self.mock_session.request.return_value
+        self.mock_response.ok = True
+        self.mock_response.status_code = 201
+        self.mock_response.json.return_value = {'BatchID': '555'}
+
+        self.mock_logger_patcher = mock.patch('src.filtering_dynamics_client.log_error')
+        self.mock_logger = self.mock_logger_patcher.start()
+
+        self.sleep_patcher = mock.patch('src.filtering_dynamics_client.time.sleep')
+        self.mock_sleep = self.sleep_patcher.start()
+
+        self.get_limiter_patcher = mock.patch('src.filtering_dynamics_client.rate_limiter.get_limiter')
+        self.mock_get_limiter = self.get_limiter_patcher.start()
+        self.mock_get_limiter.return_value = None
+
+    def tearDown(self):
+        self.session_patcher.stop()
+        self.mock_logger_patcher.stop()
+        self.sleep_patcher.stop()
+        self.get_limiter_patcher.stop()
+
+    def _throttled_response(self, retry_after=None):
+        response = mock.Mock(ok=False, status_code=429)
+        response.headers = {'Retry-After': retry_after} if retry_after else {}
+        return response
+
+    def _message(self, batch_id):
+        return {
+            'endpoint': self.endpoint,
+            'data': {'BatchID': batch_id, EXPENSE_UNIQUE_ID: 'unique-' + batch_id}
+        }
+
+    def test_api_post_strips_unique_id(self):
+        filtering_dynamics_client.api_post(self._message('555'), {})
+
+        self.assertEqual(self.mock_session.request.call_args[0], ('post', self.endpoint))
+        self.assertEqual(self.mock_session.request.call_args[1]['json'], {'BatchID': '555'})
+
+    def test_api_post_decodes_compact_envelope(self):
+        filtering_dynamics_client.api_post({'v': 1, 'e': 'exp', 'd': {'BatchID': '555'}}, {})
+
+        self.assertEqual(self.mock_session.request.call_args[0], ('post', self.endpoint))
+        self.assertEqual(self.mock_session.request.call_args[1]['json'], {'BatchID': '555'})
+
+    def test_api_post_returns_result(self):
+        result = filtering_dynamics_client.api_post(self._message('555'), {})
+
+        self.assertEqual(result, {'status_code': 201, 'success': True, 'body': {'BatchID': '555'}, 'throttled': 0})
+
+    def test_api_post_logs_and_raises_on_failure(self):
+        self.mock_response.ok = False
+        self.mock_response.status_code = 400
+        self.mock_response.text = 'Invalid project'
+
+        self.assertRaises(
+            DynamicsRequestError,
+            filtering_dynamics_client.api_post,
+            self._message('555'),
+            {}
+        )
+        self.assertEqual(self.mock_logger.call_args[0][0], 'Invalid project')
+
+    def test_api_post_raises_throttled_error_with_retry_after(self):
+        self.mock_response.ok = False
+        self.mock_response.status_code = 429
+        self.mock_response.headers = {'Retry-After': '2'}
+
+        with self.assertRaises(DynamicsThrottledError) as raised:
+            filtering_dynamics_client.api_post(self._message('555'), {})
+
+        self.assertIn('Retry-After 2', str(raised.exception))
+        self.mock_logger.assert_not_called()
+        self.assertEqual(self.mock_session.request.call_count, filtering_dynamics_client.MAX_ATTEMPTS)
+
+    def test_api_post_retries_after_retry_after(self):
+        self.mock_session.request.side_effect = [self._throttled_response('7'), self.mock_response]
+
+        result = filtering_dynamics_client.api_post(self._message('555'), {})
+
+        self.assertEqual(result['status_code'], 201)
+        self.assertEqual(result['throttled'], 1)
+        self.mock_sleep.assert_called_once_with(7)
+
+    def test_api_post_leaves_long_retry_after_to_the_dispatcher(self):
+        self.mock_session.request.return_value = self._throttled_response('30')
+
+        with self.assertRaises(DynamicsThrottledError) as raised:
+            filtering_dynamics_client.api_post(self._message('555'), {})
+
+        self.assertIn('Retry-After 30', str(raised.exception))
+        self.assertEqual(self.mock_session.request.call_count, 1)
+        self.mock_sleep.assert_not_called()
+
+    def test_api_post_backs_off_with_jitter_without_retry_after(self):
+        self.mock_session.request.side_effect = [
+            self._throttled_response(),
+            self._throttled_response(),
+            self.mock_response,
+        ]
+
+        with mock.patch('src.filtering_dynamics_client.random.uniform', return_value=0.5) as mock_uniform:
+            filtering_dynamics_client.api_post(self._message('555'), {})
+
+        self.assertEqual([call[0] for call in mock_uniform.call_args_list], [(0, 1), (0, 2)])
+        self.assertEqual(self.mock_sleep.call_count, 2)
+
+    def test_api_post_stops_retrying_at_remaining_lambda_time(self):
+        self.mock_session.request.return_value = self._throttled_response('30')
+        context = mock.Mock()
+        context.get_remaining_time_in_millis.return_value = 20000
+
+        self.assertRaises(
+            DynamicsThrottledError,
+            filtering_dynamics_client.api_post,
+            self._message('555'),
+            context
+        )
+        self.assertEqual(self.mock_session.request.call_count, 1)
+        self.mock_sleep.assert_not_called()
+
+    def test_api_post_waits_for_rate_limiter_and_shares_retry_after(self):
+        limiter = self.mock_get_limiter.return_value = mock.Mock()
+        limiter.acquire.return_value = True
+        self.mock_session.request.side_effect = [self._throttled_response('3'), self.mock_response]
+
+        filtering_dynamics_client.api_post(self._message('555'), {})
+
+        self.assertEqual(limiter.acquire.call_count, 2)
+        limiter.block.assert_called_once_with(3)
+
+    def test_api_post_raises_throttled_when_rate_limit_wait_exceeds_deadline(self):
+        limiter = self.mock_get_limiter.return_value = mock.Mock()
+        limiter.acquire.return_value = False
+        limiter.last_wait = 42.3
+
+        with self.assertRaises(DynamicsThrottledError) as raised:
+            filtering_dynamics_client.api_post(self._message('555'), {})
+
+        self.assertIn('Retry-After 43', str(raised.exception))
+        self.mock_session.request.assert_not_called()
+
+    def test_retry_after_defaults_when_header_is_missing_or_a_date(self):
+        for headers in [{}, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}]:
+            self.mock_response.headers = headers
+            self.assertEqual(filtering_dynamics_client.retry_after_seconds(self.mock_response, 30), 30)
+
+    def test_api_post_batch_sends_single_batch_request(self):
+        self.mock_response.status_code = 200
+        self.mock_response.headers = {'Content-Type': 'multipart/mixed; boundary=b'}
+        self.mock_response.text = (
+            '--b\r\nContent-Type: application/http\r\n\r\nHTTP/1.1 201 Created\r\n\r\n{}\r\n'
+            '--b\r\nContent-Type: application/http\r\n\r\nHTTP/1.1 500 Error\r\n\r\n{}\r\n'
+            '--b--\r\n'
+        )
+
+        results = filtering_dynamics_client.api_post_batch(
+            {'messages': [self._message('1'), self._message('2')]},
+            {}
+        )['results']
+
+        self.assertEqual(self.mock_session.request.call_count, 1)
+        method, path = self.mock_session.request.call_args[0]
+        request_body = self.mock_session.request.call_args[1]['data'].decode('utf-8')
+        headers = self.mock_session.request.call_args[1]['headers']
+        self.assertEqual((method, path), ('post', '/data/$batch'))
+        self.assertTrue(headers['Content-Type'].startswith('multipart/mixed; boundary=batch_'))
+        self.assertIn('POST {}{} HTTP/1.1'.format(self.base_url, self.endpoint), request_body)
+        self.assertNotIn(EXPENSE_UNIQUE_ID, request_body)
+        self.assertEqual([result['success'] for result in results], [True, False])
+        self.assertEqual(self.mock_logger.call_count, 1)
+
+    def test_api_post_batch_fails_every_item_when_batch_rejected(self):
+        self.mock_response.status_code = 401
+        self.mock_response.text = 'Unauthorized'
+
+        results = filtering_dynamics_client.api_post_batch(
+            {'messages': [self._message('1'), self._message('2')]},
+            {}
+        )['results']
+
+        self.assertEqual([result['status_code'] for result in results], [401, 401])
+        self.mock_logger.assert_called_with('Unauthorized')
+
+    def test_api_post_batch_raises_throttled_error_when_still_throttled(self):
+        self.mock_session.request.return_value = self._throttled_response('45')
+
+        with self.assertRaises(DynamicsThrottledError) as raised:
+            filtering_dynamics_client.api_post_batch({'messages': [self._message('1')]}, {})
+
+        self.assertIn('Retry-After 45', str(raised.exception))
+
+    def test_api_post_batch_counts_throttled_items(self):
+        self.mock_response.status_code = 200
+        self.mock_response.headers = {'Content-Type': 'multipart/mixed; boundary=b'}
+        self.mock_response.text = (
+            '--b\r\nContent-Type: application/http\r\n\r\nHTTP/1.1 201 Created\r\n\r\n{}\r\n'
+            '--b\r\nContent-Type: application/http\r\n\r\nHTTP/1.1 429 Too Many Requests\r\n\r\n{}\r\n'
+            '--b--\r\n'
+        )
+        self.mock_session.request.side_effect = [self._throttled_response('1'), self.mock_response]
+
+        response = filtering_dynamics_client.api_post_batch(
+            {'messages': [self._message('1'), self._message('2')]},
+            {}
+        )
+
+        self.assertEqual([result['success'] for result in response['results']], [True, False])
+        self.assertEqual(response['throttled'], 2)
@@ -0,0 +1,85 @@
+from unittest2 import TestCase
+import os
+import shutil
+import tempfile
+import mock
+
+from src import idempotency
+from lib.expensify_constants import EXPENSE_UNIQUE_ID
+
+
+class TestIdempotency(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = idempotency.SqliteStore(os.path.join(self.tmp_dir, 'published.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_expense_key_combines_unique_id_and_content_hash(self):
+        expenses = {EXPENSE_UNIQUE_ID: 'abc', 'Amount': 200.0}
+        changed = {EXPENSE_UNIQUE_ID: 'abc', 'Amount': 300.0}
+
+        key = idempotency.expense_key(expenses)
+
+        self.assertTrue(key.startswith('abc#'))
+        self.assertEqual(key, idempotency.expense_key(dict(expenses)))
+        self.assertNotEqual(key, idempotency.expense_key(changed))
+
+    def test_expense_key_is_none_without_unique_id(self):
+        self.assertIsNone(idempotency.expense_key({'Amount': 200.0}))
+
+    def test_sqlite_store_records_published_keys(self):
+        self.assertEqual(self.store.get_published(['a', 'b']), set())
+
+        self.store.mark_published(['a', 'b'])
+        self.store.mark_published(['b'])
+
+        self.assertEqual(self.store.get_published(['a', 'b', 'c']), {'a', 'b'})
+
+    def test_sqlite_store_handles_large_key_sets(self):
+        keys = ['key-{}'.format(i) for i in range(1200)]
+        self.store.mark_published(keys)
+
+        self.assertEqual(len(self.store.get_published(keys)), 1200)
+
+    def test_dynamodb_store_batches_and_retries_unprocessed_keys(self):
+        client = mock.Mock()
+        client.batch_get_item.side_effect = [
+            {
+                'Responses': {'state': [{'pk': {'S': 'expense#a'}}]},
+                'UnprocessedKeys': {'state': {'Keys': [{'pk': {'S': 'expense#b'}}]}},
+            },
+            {'Responses': {'state': [{'pk': {'S': 'expense#b'}}]}},
+        ]
+        store = idempotency.DynamoDbStore('state', client=client)
+
+        with mock.patch('src.idempotency.time.sleep'):
+            published = store.get_published(['a', 'b', 'c'])
+
+        self.assertEqual(published, {'a', 'b'})
+        self.assertEqual(client.batch_get_item.call_count, 2)
+
+    def test_dynamodb_store_writes_in_batches_of_25(self):
+        client = mock.Mock()
+        client.batch_write_item.return_value = {}
+        store = idempotency.DynamoDbStore('state', client=client)
+
+        store.mark_published(['key-{}'.format(i) for i in range(30)])
+
+        batch_sizes = [
+            len(call[1]['RequestItems']['state'])
+            for call in client.batch_write_item.call_args_list
+        ]
+        self.assertEqual(sorted(batch_sizes), [5, 25])
+
+    def test_get_store_from_environment(self):
+        environ = {
+            'IDEMPOTENCY_STORE': 'sqlite',
+            'IDEMPOTENCY_DB_PATH': os.path.join(self.tmp_dir, 'env.db'),
+        }
+        with mock.patch.dict('os.environ', environ):
+            self.assertIsInstance(idempotency.get_store(), idempotency.SqliteStore)
+
+        with mock.patch.dict('os.environ', {}, clear=True):
+            self.assertIsNone(idempotency.get_store())
@@ -0,0 +1,36 @@
+from unittest2 import TestCase
+import sys
+import mock
+
+from src.lazy_import import lazy_callable, lazy_module
+
+
+class TestLazyImport(TestCase):
+    def setUp(self):
+        self.module_name = 'json.tool'
+        self.original_module = sys.modules.pop(self.module_name, None)
+
+    def tearDown(self):
+        if self.original_module is not None:
+            sys.modules[self.module_name] = self.original_module
+
+    def test_lazy_module_imports_on_first_attribute_access(self):
+        module = lazy_module(self.module_name)
+        self.assertNotIn(self.module_name, sys.modules)
+
+        self.assertTrue(callable(module.main))
+        self.assertIn(self.module_name, sys.modules)
+
+    def test_lazy_callable_imports_on_first_call(self):
+        dumps = lazy_callable('json', 'dumps')
+
+        self.assertEqual(dumps.__name__, 'dumps')
+        self.assertEqual(dumps({'a': 1}), '{"a": 1}')
+
+    def test_lazy_module_attributes_can_be_patched(self):
+        module = lazy_module('json')
+
+        with mock.patch.object(module, 'dumps', return_value='patched'):
+            self.assertEqual(module.dumps({}), 'patched')
+
+        self.assertEqual(module.dumps({}), '{}')
@@ -0,0 +1,84 @@
+from unittest2 import TestCase
+import json
+import mock
+
+from src import message_envelope
+
+
+class TestMessageEnvelope(TestCase):
+    def setUp(self):
+        self.environ_patcher = mock.patch.dict('os.environ', {'CLAIM_CHECK_BUCKET': 'claim-bucket'})
+        self.environ_patcher.start()
+
+        self.s3_patcher = mock.patch('src.message_envelope._get_s3')
+        self.mock_s3 = self.s3_patcher.start().return_value
+
+        self.message = {
+            'endpoint': '/data/IDEO_Expenses',
+            'data': {'BatchID': '555', 'Amount': 12.5, 'Description': '', 'ProjectId': None},
+        }
+
+    def tearDown(self):
+        self.environ_patcher.stop()
+        self.s3_patcher.stop()
+
+    def test_drops_empty_fields_and_shortens_endpoint(self):
+        envelope = message_envelope.encode(self.message)
+
+        self.assertEqual(envelope, {'v': 1, 'e': 'exp', 'd': {'BatchID': '555', 'Amount': 12.5}})
+        self.assertEqual(
+            message_envelope.decode(envelope),
+            {'endpoint': '/data/IDEO_Expenses', 'data': {'BatchID': '555', 'Amount': 12.5}}
+        )
+
+    def test_unknown_endpoint_travels_in_full(self):
+        self.message['endpoint'] = '/data/Other'
+
+        envelope = message_envelope.encode(self.message)
+
+        self.assertEqual(envelope['e'], '/data/Other')
+        self.assertEqual(message_envelope.decode(envelope)['endpoint'], '/data/Other')
+
+    def test_compresses_when_smaller(self):
+        self.message['data']['Description'] = 'Taxi to airport ' * 50
+
+        with mock.patch.dict('os.environ', {'MESSAGE_COMPRESSION': 'zlib'}):
+            envelope = message_envelope.encode(self.message)
+
+        self.assertNotIn('d', envelope)
+        self.assertLess(len(json.dumps(envelope)), len(json.dumps(self.message)))
+        self.assertEqual(message_envelope.decode(envelope)['data']['Description'], 'Taxi to airport ' * 50)
+
+    def test_keeps_plain_body_when_compression_does_not_help(self):
+        with mock.patch.dict('os.environ', {'MESSAGE_COMPRESSION': 'zlib'}):
+            envelope = message_envelope.encode(self.message)
+
+        self.assertIn('d', envelope)
+        self.assertNotIn('z', envelope)
+
+    def test_offloads_oversized_payloads_to_s3(self):
+        self.message['data']['Description'] = 'x' * 300
+
+        with mock.patch.dict('os.environ', {'CLAIM_CHECK_THRESHOLD_BYTES': '256'}):
+            envelope = message_envelope.encode(self.message)
+
+        put = self.mock_s3.put_object.call_args[1]
+        self.assertEqual(envelope, {'v': 1, 'e': 'exp', 's3': {'b': 'claim-bucket', 'k': put['Key']}})
+        self.assertTrue(put['Key'].startswith('claim-check/'))
+
+        with mock.patch('src.message_envelope.fetch_from_s3', return_value=put['Body']) as mock_fetch:
+            decoded = message_envelope.decode(envelope)
+
+        mock_fetch.assert_called_with('claim-bucket', put['Key'])
+        self.assertEqual(decoded['data']['Description'], 'x' * 300)
+
+    def test_claim_check_key_is_stable_for_the_same_payload(self):
+        self.message['data']['Description'] = 'x' * 300
+        with mock.patch.dict('os.environ', {'CLAIM_CHECK_THRESHOLD_BYTES': '256'}):
+            first = message_envelope.encode(self.message)
+            second = message_envelope.encode(self.message)
+
+        self.assertEqual(first['s3'], second['s3'])
+
+    def test_decode_passes_legacy_messages_through(self):
+        self.assertIs(message_envelope.decode(self.message), self.message)
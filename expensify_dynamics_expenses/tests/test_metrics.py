@@ -0,0 +1,81 @@
+from unittest2 import TestCase
+import json
+import mock
+
+from src import metrics
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.stdout_patcher = mock.patch('src.metrics.sys.stdout')
+        self.mock_stdout = self.stdout_patcher.start()
+
+        self.context = mock.Mock(function_name='expensify-dynamics-dev-controller')
+
+    def tearDown(self):
+        self.stdout_patcher.stop()
+
+    def _emitted(self):
+        return [json.loads(call[0][0]) for call in self.mock_stdout.write.call_args_list]
+
+    def _handler(self, event, context):
+        metrics.count('RowsPublished', 3)
+        metrics.count('RowsPublished', 2)
+        metrics.record('SqsPublishTime', 12)
+        metrics.record('SqsPublishTime', 12.1)
+        with metrics.timer('S3FetchTime'):
+            pass
+        return 'done'
+
+    def test_flushes_one_emf_line_per_invocation(self):
+        with mock.patch.dict('os.environ', {'METRICS_ENABLED': 'true'}):
+            result = metrics.instrumented(self._handler)({}, self.context)
+
+        self.assertEqual(result, 'done')
+        documents = self._emitted()
+        self.assertEqual(len(documents), 1)
+        document = documents[0]
+        directive = document['_aws']['CloudWatchMetrics'][0]
+        self.assertEqual(directive['Namespace'], metrics.DEFAULT_NAMESPACE)
+        self.assertEqual(directive['Dimensions'], [['FunctionName']])
+        self.assertEqual(
+            directive['Metrics'],
+            [
+                {'Name': 'RowsPublished', 'Unit': 'Count'},
+                {'Name': 'S3FetchTime', 'Unit': 'Milliseconds'},
+                {'Name': 'SqsPublishTime', 'Unit': 'Milliseconds'},
+            ]
+        )
+        self.assertEqual(document['FunctionName'], 'expensify-dynamics-dev-controller')
+        self.assertEqual(document['RowsPublished'], 5)
+        self.assertEqual(document['SqsPublishTime'], {'Values': [13.0], 'Counts': [2]})
+
+    def test_flushes_when_handler_raises(self):
+        def failing_handler(event, context):
+            metrics.count('FilesFailed')
+            raise ValueError('boom')
+
+        with mock.patch.dict('os.environ', {'METRICS_ENABLED': 'true'}):
+            self.assertRaises(ValueError, metrics.instrumented(failing_handler), {}, self.context)
+
+        self.assertEqual(self._emitted()[0]['FilesFailed'], 1)
+
+    def test_carries_properties_on_the_emf_line(self):
+        def handler(event, context):
+            metrics.put_property('split_aggregate', {'split_id': 'abc', 'published': 3})
+
+        with mock.patch.dict('os.environ', {'METRICS_ENABLED': 'true'}):
+            metrics.instrumented(handler)({}, self.context)
+
+        document = self._emitted()[0]
+        self.assertEqual(document['split_aggregate'], {'split_id': 'abc', 'published': 3})
+        self.assertEqual(document['_aws']['CloudWatchMetrics'][0]['Metrics'], [])
+
+    def test_is_a_no_op_when_disabled(self):
+        with mock.patch.dict('os.environ', {}, clear=True):
+            result = metrics.instrumented(self._handler)({}, self.context)
+
+        self.assertEqual(result, 'done')
+        self.assertFalse(metrics.enabled())
+        self.mock_stdout.write.assert_not_called()
+        self.assertIs(metrics.timer('S3FetchTime'), metrics._NULL_TIMER)
@@ -0,0 +1,74 @@
+from unittest2 import TestCase
+import json
+
+from src import odata_batch
+
+
+class TestODataBatch(TestCase):
+    def setUp(self):
+        self.base_url = 'https://ideo.operations.dynamics.com'
+        self.items = [
+            ('/data/IDEO_Expenses', {'BatchID': '555', 'Amount': 200.0}),
+            ('/data/IDEO_Expenses', {'BatchID': '555', 'Amount': 300.52}),
+        ]
+
+        self.response_content_type = 'multipart/mixed; boundary=batchresponse_1'
+        self.response_body = (
+            '--batchresponse_1\r\n'
+            'Content-Type: multipart/mixed; boundary=changesetresponse_1\r\n'
+            '\r\n'
+            '--changesetresponse_1\r\n'
+            'Content-Type: application/http\r\n'
+            'Content-Transfer-Encoding: binary\r\n'
+            'Content-ID: 1\r\n'
+            '\r\n'
+            'HTTP/1.1 201 Created\r\n'
+            'Content-Type: application/json; odata.metadata=minimal\r\n'
+            '\r\n'
+            '{"BatchID": "555"}\r\n'
+            '--changesetresponse_1--\r\n'
+            '--batchresponse_1\r\n'
+            'Content-Type: application/http\r\n'
+            'Content-Transfer-Encoding: binary\r\n'
+            '\r\n'
+            'HTTP/1.1 400 Bad Request\r\n'
+            'Content-Type: application/json\r\n'
+            '\r\n'
+            '{"error": {"message": "Invalid project"}}\r\n'
+            '--batchresponse_1--\r\n'
+        )
+
+    def test_builds_one_changeset_per_item(self):
+        content_type, body = odata_batch.build_batch_request(self.base_url, self.items)
+        body = body.decode('utf-8')
+
+        self.assertTrue(content_type.startswith('multipart/mixed; boundary=batch_'))
+        self.assertEqual(body.count('Content-Type: multipart/mixed; boundary=changeset_'), 2)
+        self.assertEqual(body.count('POST {}/data/IDEO_Expenses HTTP/1.1'.format(self.base_url)), 2)
+        self.assertIn(json.dumps(self.items[1][1]), body)
+        self.assertTrue(body.endswith('--{}--\r\n'.format(content_type.split('=')[1])))
+
+    def test_parses_per_item_success_and_failure(self):
+        results = odata_batch.parse_batch_response(
+            self.response_content_type,
+            self.response_body,
+            2
+        )
+
+        self.assertEqual(
+            results,
+            [
+                {'status_code': 201, 'success': True, 'body': {'BatchID': '555'}},
+                {'status_code': 400, 'success': False, 'body': {'error': {'message': 'Invalid project'}}},
+            ]
+        )
+
+    def test_marks_items_missing_from_response_as_failed(self):
+        results = odata_batch.parse_batch_response(
+            self.response_content_type,
+            self.response_body,
+            3
+        )
+
+        self.assertFalse(results[2]['success'])
+        self.assertIsNone(results[2]['status_code'])
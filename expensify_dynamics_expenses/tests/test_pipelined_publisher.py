@@ -0,0 +1,98 @@
+from unittest2 import TestCase
+import threading
+import time
+
+from src import pipelined_publisher
+
+
+class TestPipelinedPublisher(TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.sent = []
+        self.counted = []
+
+    def _send(self, messages):
+        time.sleep(0.001)
+        with self.lock:
+            self.sent.extend(messages)
+
+    def _chunks(self, groups, rows_per_group, chunk_size=5):
+        messages = [
+            ({'group': group, 'row': row}, 'group-{}'.format(group))
+            for row in range(rows_per_group) for group in range(groups)
+        ]
+        return [messages[i:i + chunk_size] for i in range(0, len(messages), chunk_size)]
+
+    def test_sends_every_message_before_returning(self):
+        chunks = self._chunks(6, 10)
+
+        pipelined_publisher.publish(iter(chunks), self._send, self.counted.extend, max_in_flight=3)
+
+        self.assertEqual(len(self.sent), 60)
+        self.assertEqual(sorted(self.counted, key=repr), sorted(self.sent, key=repr))
+
+    def test_keeps_message_order_within_each_group(self):
+        pipelined_publisher.publish(iter(self._chunks(6, 10)), self._send, self.counted.extend, max_in_flight=4)
+
+        for group in range(6):
+            rows = [message['row'] for message, _ in self.sent if message['group'] == group]
+            self.assertEqual(rows, list(range(10)))
+
+    def test_overlaps_sends_across_groups_up_to_the_in_flight_limit(self):
+        in_flight = []
+        peak = []
+
+        def send(messages):
+            with self.lock:
+                in_flight.append(messages)
+                peak.append(len(in_flight))
+            time.sleep(0.01)
+            with self.lock:
+                in_flight.remove(messages)
+
+        pipelined_publisher.publish(iter(self._chunks(8, 4, chunk_size=8)), send, self.counted.extend, max_in_flight=3)
+
+        self.assertGreater(max(peak), 1)
+        self.assertLessEqual(max(peak), 3)
+
+    def test_applies_backpressure_to_the_producer(self):
+        read = []
+
+        def chunks():
+            for index in range(20):
+                read.append((index, len(self.sent)))
+                yield [({'row': index}, 'group')]
+
+        def send(messages):
+            time.sleep(0.005)
+            self._send(messages)
+
+        pipelined_publisher.publish(chunks(), send, self.counted.extend, max_in_flight=1, queue_size=2)
+
+        # With one lane holding at most two queued chunks, the producer can
+        # never be more than a few chunks ahead of what has been sent.
+        self.assertTrue(all(index - sent <= 4 for index, sent in read))
+
+    def test_raises_the_first_send_error_after_flushing(self):
+        def send(messages):
+            if messages[0][0]['row'] == 3:
+                raise ValueError('send failed')
+            self._send(messages)
+
+        with self.assertRaises(ValueError):
+            pipelined_publisher.publish(
+                iter([[({'row': row}, 'group')] for row in range(10)]), send, self.counted.extend, max_in_flight=2
+            )
+
+        self.assertEqual([message['row'] for message, _ in self.sent], [0, 1, 2])
+        self.assertEqual(self.counted, self.sent)
+
+    def test_producer_errors_propagate(self):
+        def chunks():
+            yield [({'row': 0}, 'group')]
+            raise RuntimeError('bad csv')
+
+        with self.assertRaises(RuntimeError):
+            pipelined_publisher.publish(chunks(), self._send, self.counted.extend)
+
+        self.assertEqual(len(self.sent), 1)
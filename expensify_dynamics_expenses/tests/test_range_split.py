@@ -0,0 +1,121 @@
+from unittest2 import TestCase
+import csv
+import io
+import json
+import mock
+import re
+
+from src import range_split
+
+
+class TestRangeSplit(TestCase):
+    def setUp(self):
+        self.get_s3_patcher = mock.patch('src.s3_stream._get_s3')
+        self.mock_s3 = self.get_s3_patcher.start().return_value
+        self.mock_s3.get_object.side_effect = self._get_object
+
+        self.environ_patcher = mock.patch.dict('os.environ', {'STATE_TABLE_NAME': 'state-table'})
+        self.environ_patcher.start()
+
+        self.get_dynamodb_patcher = mock.patch('src.range_split._get_dynamodb')
+        self.mock_dynamodb = self.get_dynamodb_patcher.start().return_value
+
+        rows = ['BatchID,Description,Amount\r\n']
+        for index in range(40):
+            description = '"Taxi\r\nto airport, {}"'.format(index) if index % 3 == 0 else 'Lunch {}'.format(index)
+            rows.append('555,{},{}.50\r\n'.format(description, index))
+        self.data = ''.join(rows).encode('utf-8')
+
+    def tearDown(self):
+        self.get_s3_patcher.stop()
+        self.environ_patcher.stop()
+        self.get_dynamodb_patcher.stop()
+
+    def _get_object(self, Bucket, Key, Range=None):
+        data = self.data
+        if Range:
+            start, end = re.match(r'bytes=(\d+)-(\d*)', Range).groups()
+            data = data[int(start):int(end) + 1 if end else None]
+
+        body = mock.Mock()
+        body.read.return_value = data
+        body.iter_chunks.return_value = [data[i:i + 16] for i in range(0, len(data), 16)]
+        return {'Body': body}
+
+    def _rows(self, start, end):
+        return list(csv.reader(io.StringIO(self.data[start:end].decode('utf-8'), newline='')))
+
+    def test_ranges_cover_every_row_exactly_once(self):
+        fieldnames, ranges = range_split.plan_ranges('bucket-name', 'file.csv', len(self.data), 4)
+
+        self.assertEqual(fieldnames, ['BatchID', 'Description', 'Amount'])
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[-1][1], len(self.data))
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+
+        rows = [row for start, end in ranges for row in self._rows(start, end)]
+        self.assertEqual(rows, self._rows(0, len(self.data))[1:])
+
+    def test_boundaries_never_split_a_quoted_field(self):
+        _, ranges = range_split.plan_ranges('bucket-name', 'file.csv', len(self.data), 16)
+
+        for start, end in ranges:
+            for row in self._rows(start, end):
+                self.assertEqual(len(row), 3)
+
+    def test_returns_no_ranges_for_an_empty_object(self):
+        self.data = b''
+
+        self.assertEqual(range_split.plan_ranges('bucket-name', 'file.csv', 0, 4), (None, []))
+
+    def test_part_totals_include_counts_carried_from_checkpoints(self):
+        split = {'carried': {'published': 3, 'skipped': 1, 'rejected': 0, 'batch_ids': ['444']}}
+        summary = {'published': 2, 'skipped': 0, 'rejected': 1, 'batch_ids': {'555'}}
+
+        self.assertEqual(
+            range_split.part_totals(split, summary),
+            {'published': 5, 'skipped': 1, 'rejected': 1, 'batch_ids': ['444', '555']}
+        )
+
+    def test_record_part_waits_for_every_part(self):
+        self.mock_dynamodb.update_item.return_value = {'Attributes': {'parts_done': {'SS': ['0']}}}
+
+        aggregate = range_split.record_part({'id': 'abc', 'part': 0, 'parts': 2}, {'status': 'published'})
+
+        self.assertIsNone(aggregate)
+        update = self.mock_dynamodb.update_item.call_args[1]
+        self.assertEqual(update['Key'], {'pk': {'S': 'split#abc'}})
+        self.assertEqual(update['ExpressionAttributeNames'], {'#summary': 'part_0'})
+        self.assertEqual(update['ExpressionAttributeValues'][':part'], {'SS': ['0']})
+
+    def test_last_part_aggregates_every_summary(self):
+        summaries = [
+            {'status': 'published', 'published': 2, 'skipped': 1, 'rejected': 0, 'bytes_read': 100,
+             'batch_ids': ['555'], 'dead_letter': None},
+            {'status': 'failed', 'published': 1, 'skipped': 0, 'rejected': 2, 'bytes_read': 80,
+             'batch_ids': ['555', '556'], 'dead_letter': {'bucket': 'b', 'key': 'k'}, 'error': 'boom'},
+        ]
+        attributes = {'parts_done': {'SS': ['0', '1']}}
+        for index, summary in enumerate(summaries):
+            attributes['part_{}'.format(index)] = {'S': json.dumps(summary)}
+        self.mock_dynamodb.update_item.return_value = {'Attributes': attributes}
+
+        with mock.patch('src.range_split.time.time', return_value=10):
+            aggregate = range_split.record_part(
+                {'id': 'abc', 'part': 1, 'parts': 2, 'started_at': 4}, summaries[1]
+            )
+
+        self.assertEqual(aggregate, {
+            'split_id': 'abc',
+            'parts': 2,
+            'status': 'failed',
+            'published': 3,
+            'skipped': 1,
+            'rejected': 2,
+            'bytes_read': 180,
+            'batch_ids': ['555', '556'],
+            'dead_letters': [{'bucket': 'b', 'key': 'k'}],
+            'errors': ['boom'],
+            'elapsed_ms': 6000,
+        })
@@ -0,0 +1,119 @@
+from unittest2 import TestCase
+import mock
+
+from src import rate_limiter
+from src.rate_limiter import TokenBucket, MemoryStore, DynamoDbStore
+
+
+class ConditionalCheckFailed(Exception):
+    response = {'Error': {'Code': 'ConditionalCheckFailedException'}}
+
+
+class TestTokenBucket(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.time_patcher = mock.patch('src.rate_limiter.time')
+        self.mock_time = self.time_patcher.start()
+        self.mock_time.time.side_effect = lambda: self.now
+        self.mock_time.sleep.side_effect = self._sleep
+
+        self.store = MemoryStore()
+        self.bucket = TokenBucket(self.store, 'dynamics', rate=2, capacity=3)
+
+    def tearDown(self):
+        self.time_patcher.stop()
+
+    def _sleep(self, seconds):
+        self.now += seconds
+
+    def test_allows_burst_up_to_capacity(self):
+        for _ in range(3):
+            self.assertTrue(self.bucket.acquire())
+
+        self.mock_time.sleep.assert_not_called()
+
+    def test_waits_for_refill_once_empty(self):
+        for _ in range(4):
+            self.bucket.acquire()
+
+        self.mock_time.sleep.assert_called_once_with(0.5)
+
+    def test_gives_up_when_wait_passes_deadline(self):
+        for _ in range(3):
+            self.bucket.acquire()
+
+        self.assertFalse(self.bucket.acquire(deadline=self.now + 0.1))
+        self.assertEqual(self.bucket.last_wait, 0.5)
+
+    def test_block_pauses_every_bucket_on_the_store(self):
+        other_bucket = TokenBucket(self.store, 'dynamics', rate=2, capacity=3)
+        self.bucket.block(10)
+
+        self.assertTrue(other_bucket.acquire())
+        self.mock_time.sleep.assert_called_once_with(10)
+
+    def test_retries_take_when_another_caller_wins_the_update(self):
+        store = mock.Mock(wraps=self.store)
+        store.compare_and_set.side_effect = [False, True]
+        bucket = TokenBucket(store, 'dynamics', rate=2, capacity=3)
+
+        self.assertTrue(bucket.acquire())
+        self.assertEqual(store.get.call_count, 2)
+
+
+class TestDynamoDbStore(TestCase):
+    def setUp(self):
+        self.client = mock.Mock()
+        self.store = DynamoDbStore('state-table', client=self.client)
+
+    def test_get_missing_bucket(self):
+        self.client.get_item.return_value = {}
+
+        self.assertEqual(self.store.get('dynamics'), (None, 0))
+        self.assertEqual(self.client.get_item.call_args[1]['Key'], {'pk': {'S': 'ratelimit#dynamics'}})
+
+    def test_get_existing_bucket(self):
+        self.client.get_item.return_value = {'Item': {
+            'tokens': {'N': '2.5'},
+            'updated_at': {'N': '1000.0'},
+            'blocked_until': {'N': '0'},
+            'version': {'N': '4'},
+        }}
+
+        state, version = self.store.get('dynamics')
+
+        self.assertEqual(state, {'tokens': 2.5, 'updated_at': 1000.0, 'blocked_until': 0.0})
+        self.assertEqual(version, 4)
+
+    def test_compare_and_set_is_conditional_on_version(self):
+        self.assertTrue(self.store.compare_and_set(
+            'dynamics',
+            {'tokens': 1.0, 'updated_at': 1000.0, 'blocked_until': 0},
+            4
+        ))
+
+        put = self.client.put_item.call_args[1]
+        self.assertEqual(put['Item']['version'], {'N': '5'})
+        self.assertEqual(put['ExpressionAttributeValues'], {':version': {'N': '4'}})
+
+    def test_compare_and_set_returns_false_on_conflict(self):
+        self.client.put_item.side_effect = ConditionalCheckFailed()
+
+        self.assertFalse(self.store.compare_and_set(
+            'dynamics',
+            {'tokens': 1.0, 'updated_at': 1000.0, 'blocked_until': 0},
+            4
+        ))
+
+
+class TestGetLimiter(TestCase):
+    def test_disabled_without_store(self):
+        with mock.patch.dict('os.environ', {}, clear=True):
+            self.assertIsNone(rate_limiter.get_limiter())
+
+    def test_memory_store_is_shared(self):
+        with mock.patch.dict('os.environ', {'RATE_LIMIT_STORE': 'memory', 'DYNAMICS_RATE_LIMIT': '5'}):
+            first, second = rate_limiter.get_limiter(), rate_limiter.get_limiter()
+
+        self.assertIs(first.store, second.store)
+        self.assertEqual(first.rate, 5)
@@ -0,0 +1,69 @@
+from unittest2 import TestCase
+import mock
+
+from src import s3_cache
+
+
+class NotModified(Exception):
+    response = {'Error': {'Code': '304'}, 'ResponseMetadata': {'HTTPStatusCode': 304}}
+
+
+class TestS3Cache(TestCase):
+    def setUp(self):
+        self.get_s3_patcher = mock.patch('src.s3_cache._get_s3')
+        self.mock_s3 = self.get_s3_patcher.start().return_value
+        self.mock_s3.get_object.side_effect = self._get_object
+
+        self.time_patcher = mock.patch('src.s3_cache.time.time')
+        self.mock_time = self.time_patcher.start()
+        self.mock_time.return_value = 1000
+
+        self.etag = '"abc"'
+        self.body = b'{"startDate": "2018-06-25"}'
+        s3_cache.clear()
+
+    def tearDown(self):
+        self.get_s3_patcher.stop()
+        self.time_patcher.stop()
+        s3_cache.clear()
+
+    def _get_object(self, **request):
+        if request.get('IfNoneMatch') == self.etag:
+            raise NotModified()
+
+        body = mock.Mock()
+        body.read.return_value = self.body
+        return {'Body': body, 'ETag': self.etag}
+
+    def test_fetches_and_caches_object(self):
+        self.assertEqual(s3_cache.fetch('bucket', 'key'), (self.body, self.etag))
+        self.mock_s3.get_object.assert_called_with(Bucket='bucket', Key='key')
+
+    def test_revalidates_with_if_none_match(self):
+        s3_cache.fetch('bucket', 'key')
+        self.body = b'changed but not returned'
+
+        self.assertEqual(s3_cache.fetch('bucket', 'key'), (b'{"startDate": "2018-06-25"}', self.etag))
+        self.mock_s3.get_object.assert_called_with(Bucket='bucket', Key='key', IfNoneMatch=self.etag)
+
+    def test_replaces_object_when_etag_changes(self):
+        s3_cache.fetch('bucket', 'key')
+        self.etag = '"def"'
+        self.body = b'{}'
+
+        self.assertEqual(s3_cache.fetch('bucket', 'key'), (b'{}', '"def"'))
+
+    def test_skips_revalidation_within_ttl(self):
+        s3_cache.fetch('bucket', 'key', ttl_seconds=60)
+        self.mock_time.return_value = 1059
+        s3_cache.fetch('bucket', 'key', ttl_seconds=60)
+        self.assertEqual(self.mock_s3.get_object.call_count, 1)
+
+        self.mock_time.return_value = 1060
+        s3_cache.fetch('bucket', 'key', ttl_seconds=60)
+        self.assertEqual(self.mock_s3.get_object.call_count, 2)
+
+    def test_raises_other_errors(self):
+        self.mock_s3.get_object.side_effect = ValueError('denied')
+
+        self.assertRaises(ValueError, s3_cache.fetch, 'bucket', 'key')
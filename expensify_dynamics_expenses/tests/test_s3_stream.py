@@ -0,0 +1,154 @@
+from unittest2 import TestCase
+import csv
+import gzip
+import mock
+
+from src import s3_stream
+
+
+class TestS3Stream(TestCase):
+    def setUp(self):
+        self.get_s3_patcher = mock.patch('src.s3_stream._get_s3')
+        self.mock_s3 = self.get_s3_patcher.start().return_value
+
+        self.csv_bytes = (
+            'BatchID,Description,Amount\r\n'
+            '555,Café lunch,12.50\r\n'
+            '555,"Taxi\r\nto airport",40\r\n'
+        ).encode('utf-8')
+
+    def tearDown(self):
+        self.get_s3_patcher.stop()
+
+    def _chunked(self, size, data=None):
+        data = data or self.csv_bytes
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def _object(self, chunks, **response):
+        response['Body'] = mock.Mock()
+        response['Body'].iter_chunks.return_value = chunks
+        return response
+
+    def test_reads_object_body_in_chunks(self):
+        self.mock_s3.get_object.return_value = {'Body': mock.Mock()}
+        self.mock_s3.get_object.return_value['Body'].iter_chunks.return_value = [self.csv_bytes]
+
+        lines = list(s3_stream.iter_s3_lines('bucket-name', 'file.csv', chunk_size=64))
+
+        self.mock_s3.get_object.assert_called_with(Bucket='bucket-name', Key='file.csv')
+        self.mock_s3.get_object.return_value['Body'].iter_chunks.assert_called_with(64)
+        self.assertEqual(''.join(lines), self.csv_bytes.decode('utf-8'))
+
+    def test_reads_from_byte_offset_with_range_request(self):
+        self.mock_s3.get_object.return_value = {'Body': mock.Mock()}
+        self.mock_s3.get_object.return_value['Body'].iter_chunks.return_value = [b'555,x,1\r\n']
+
+        list(s3_stream.iter_s3_lines('bucket-name', 'file.csv', start=28))
+
+        self.mock_s3.get_object.assert_called_with(
+            Bucket='bucket-name',
+            Key='file.csv',
+            Range='bytes=28-'
+        )
+
+    def test_lines_are_identical_for_any_chunk_size(self):
+        expected = self.csv_bytes.decode('utf-8').splitlines(True)
+
+        for size in range(1, len(self.csv_bytes) + 1):
+            self.assertEqual(list(s3_stream.iter_lines(self._chunked(size))), expected, size)
+
+    def test_rows_parse_like_a_full_read(self):
+        rows = list(csv.DictReader(s3_stream.iter_lines(self._chunked(7))))
+
+        self.assertEqual(
+            rows,
+            [
+                {'BatchID': '555', 'Description': 'Café lunch', 'Amount': '12.50'},
+                {'BatchID': '555', 'Description': 'Taxi\r\nto airport', 'Amount': '40'},
+            ]
+        )
+
+    def test_yields_final_line_without_newline(self):
+        lines = list(s3_stream.iter_lines([b'a,b\n1,', b'2']))
+
+        self.assertEqual(lines, ['a,b\n', '1,2'])
+
+    def test_decompresses_gzip_objects_by_extension(self):
+        self.mock_s3.get_object.return_value = self._object(self._chunked(5, gzip.compress(self.csv_bytes)))
+
+        lines = list(s3_stream.iter_s3_lines('bucket-name', 'file.csv.gz'))
+
+        self.assertEqual(''.join(lines), self.csv_bytes.decode('utf-8'))
+
+    def test_decompresses_concatenated_gzip_members(self):
+        compressed = gzip.compress(self.csv_bytes[:30]) + gzip.compress(self.csv_bytes[30:])
+        self.mock_s3.get_object.return_value = self._object(self._chunked(7, compressed))
+
+        lines = list(s3_stream.iter_s3_lines('bucket-name', 'file.csv.gz'))
+
+        self.assertEqual(''.join(lines), self.csv_bytes.decode('utf-8'))
+
+    def test_detects_compression_from_content_encoding(self):
+        self.mock_s3.get_object.return_value = self._object(
+            [gzip.compress(self.csv_bytes)],
+            ContentEncoding='gzip'
+        )
+
+        lines = list(s3_stream.iter_s3_lines('bucket-name', 'file.csv'))
+
+        self.assertEqual(''.join(lines), self.csv_bytes.decode('utf-8'))
+
+    def test_resumes_compressed_object_from_decompressed_offset(self):
+        self.mock_s3.get_object.return_value = self._object(self._chunked(9, gzip.compress(self.csv_bytes)))
+
+        lines = list(s3_stream.iter_s3_lines('bucket-name', 'file.csv.gz', start=28))
+
+        self.mock_s3.get_object.assert_called_once_with(Bucket='bucket-name', Key='file.csv.gz')
+        self.assertEqual(''.join(lines), self.csv_bytes[28:].decode('utf-8'))
+
+    def test_drops_range_when_content_encoding_is_compressed(self):
+        self.mock_s3.get_object.side_effect = [
+            self._object([], ContentEncoding='gzip'),
+            self._object([gzip.compress(self.csv_bytes)], ContentEncoding='gzip'),
+        ]
+
+        lines = list(s3_stream.iter_s3_lines('bucket-name', 'file.csv', start=28))
+
+        self.mock_s3.get_object.assert_called_with(Bucket='bucket-name', Key='file.csv')
+        self.assertEqual(''.join(lines), self.csv_bytes[28:].decode('utf-8'))
+
+    def test_decompresses_zstd_with_optional_dependency(self):
+        decompressor = mock.Mock(eof=False)
+        decompressor.decompress.side_effect = lambda chunk: chunk.upper()
+        decompressor.flush.return_value = b''
+        self.mock_s3.get_object.return_value = self._object([b'a,b\n', b'1,2\n'])
+
+        mock_zstandard = mock.Mock()
+        mock_zstandard.ZstdDecompressor.return_value.decompressobj.return_value = decompressor
+        with mock.patch('src.s3_stream.zstandard', mock_zstandard):
+            lines = list(s3_stream.iter_s3_lines('bucket-name', 'file.csv.zst'))
+
+        self.assertEqual(lines, ['A,B\n', '1,2\n'])
+
+    def test_bounds_ranged_reads_with_an_exclusive_end(self):
+        self.mock_s3.get_object.return_value = self._object([self.csv_bytes[28:51]])
+
+        lines = list(s3_stream.iter_s3_lines('bucket-name', 'file.csv', start=28, end=51))
+
+        self.mock_s3.get_object.assert_called_with(Bucket='bucket-name', Key='file.csv', Range='bytes=28-50')
+        self.assertEqual(lines, ['555,Café lunch,12.50\r\n'])
+
+    def test_hands_raw_chunks_to_the_fetch_timer(self):
+        self.mock_s3.get_object.return_value = self._object([gzip.compress(self.csv_bytes)], ContentEncoding='gzip')
+        fetch_timer = mock.Mock()
+        fetch_timer.wrap.side_effect = lambda chunks: iter(list(chunks))
+
+        lines = list(s3_stream.iter_s3_lines('bucket-name', 'file.csv', fetch_timer=fetch_timer))
+
+        self.assertEqual(''.join(lines), self.csv_bytes.decode('utf-8'))
+        self.assertEqual(fetch_timer.wrap.call_count, 1)
+
+    def test_recognises_compressed_bodies_by_magic_number(self):
+        self.assertEqual(s3_stream.compression_for_body(gzip.compress(self.csv_bytes)), 'gzip')
+        self.assertEqual(s3_stream.compression_for_body(b'\x28\xb5\x2f\xfd\x00'), 'zstd')
+        self.assertIsNone(s3_stream.compression_for_body(self.csv_bytes))
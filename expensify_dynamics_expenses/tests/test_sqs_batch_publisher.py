@@ -0,0 +1,107 @@
+from unittest2 import TestCase
+import json
+import mock
+
+from src import sqs_batch_publisher
+from src.sqs_batch_publisher import BatchSendError
+
+
+class TestSqsBatchPublisher(TestCase):
+    def setUp(self):
+        self.queue_url = 'queue_url'
+
+        self.get_sqs_patcher = mock.patch('src.sqs_batch_publisher._get_sqs')
+        self.mock_sqs = self.get_sqs_patcher.start().return_value
+        self.mock_sqs.send_message_batch.return_value = {'Successful': []}
+
+        self.sleep_patcher = mock.patch('src.sqs_batch_publisher.time.sleep')
+        self.mock_sleep = self.sleep_patcher.start()
+
+        self.mock_logger_patcher = mock.patch('src.sqs_batch_publisher.log_error')
+        self.mock_logger = self.mock_logger_patcher.start()
+
+    def tearDown(self):
+        self.get_sqs_patcher.stop()
+        self.sleep_patcher.stop()
+        self.mock_logger_patcher.stop()
+
+    def _sent_entries(self):
+        return [
+            call[1]['Entries']
+            for call in self.mock_sqs.send_message_batch.call_args_list
+        ]
+
+    def test_groups_messages_into_batches_of_ten(self):
+        messages = [({'data': {'row': i}}, '555') for i in range(23)]
+
+        sent = sqs_batch_publisher.send_fifo_messages(self.queue_url, messages)
+
+        self.assertEqual(sent, 23)
+        self.assertEqual([len(entries) for entries in self._sent_entries()], [10, 10, 3])
+        first_entry = self._sent_entries()[0][0]
+        self.assertEqual(first_entry['MessageGroupId'], '555')
+        self.assertEqual(json.loads(first_entry['MessageBody']), {'data': {'row': 0}})
+        self.mock_sqs.send_message_batch.assert_called_with(
+            QueueUrl=self.queue_url,
+            Entries=mock.ANY
+        )
+
+    def test_splits_batches_on_payload_size(self):
+        description = 'x' * (100 * 1024)
+        messages = [({'data': description}, '555') for _ in range(5)]
+
+        sqs_batch_publisher.send_fifo_messages(self.queue_url, messages)
+
+        self.assertEqual([len(entries) for entries in self._sent_entries()], [2, 2, 1])
+
+    def test_retries_only_failed_entries(self):
+        self.mock_sqs.send_message_batch.side_effect = [
+            {'Failed': [{'Id': '1', 'SenderFault': False, 'Code': 'InternalError'}]},
+            {'Successful': [{'Id': '1'}]},
+        ]
+        messages = [({'data': {'row': 0}}, '555'), ({'data': {'row': 1}}, '555'), ({'data': {'row': 2}}, '556')]
+
+        sqs_batch_publisher.send_fifo_messages(self.queue_url, messages)
+
+        retried = self._sent_entries()[1]
+        self.assertEqual(len(retried), 1)
+        self.assertEqual(json.loads(retried[0]['MessageBody']), {'data': {'row': 1}})
+
+    def test_raises_rather_than_resend_behind_its_own_group(self):
+        self.mock_sqs.send_message_batch.return_value = {
+            'Failed': [{'Id': '1', 'SenderFault': False, 'Code': 'InternalError'}]
+        }
+        messages = [({'data': {'row': i}}, '555') for i in range(3)]
+
+        self.assertRaises(BatchSendError, sqs_batch_publisher.send_fifo_messages, self.queue_url, messages)
+        self.assertEqual(self.mock_sqs.send_message_batch.call_count, 1)
+
+    def test_raises_on_sender_fault(self):
+        self.mock_sqs.send_message_batch.return_value = {
+            'Failed': [{'Id': '0', 'SenderFault': True, 'Code': 'InvalidParameterValue'}]
+        }
+
+        self.assertRaises(
+            BatchSendError,
+            sqs_batch_publisher.send_fifo_messages,
+            self.queue_url,
+            [({'data': {}}, '555')]
+        )
+        self.assertEqual(self.mock_sqs.send_message_batch.call_count, 1)
+        self.assertEqual(self.mock_logger.call_args[0][0], 'SQS batch entries failed')
+
+    def test_raises_after_exhausting_retries(self):
+        self.mock_sqs.send_message_batch.return_value = {
+            'Failed': [{'Id': '0', 'SenderFault': False, 'Code': 'InternalError'}]
+        }
+
+        self.assertRaises(
+            BatchSendError,
+            sqs_batch_publisher.send_fifo_messages,
+            self.queue_url,
+            [({'data': {}}, '555')]
+        )
+        self.assertEqual(
+            self.mock_sqs.send_message_batch.call_count,
+            sqs_batch_publisher.MAX_SEND_ATTEMPTS
+        )
@@ -0,0 +1,84 @@
+from unittest2 import TestCase
+import mock
+
+from src import transform
+from lib.dynamics_constants import MESSAGE_DATE_TIME_FIELD, TRANS_DATE_FIELD
+
+
+class TestTransform(TestCase):
+    def setUp(self):
+        self.fieldnames = ['BatchID', 'ProjectID', MESSAGE_DATE_TIME_FIELD, 'Amount', TRANS_DATE_FIELD]
+
+    def test_default_spec_formats_expenses(self):
+        compiled = transform.compile_spec(transform.EXPENSE_FIELD_SPEC, self.fieldnames)
+
+        payloads = compiled.apply([
+            ['batch-1', 'project-1', '6/1/2018', '12.345', '2018-06-02'],
+            ['batch-1', 'project-2', '', '', ''],
+        ])
+
+        self.assertEqual(payloads, [
+            {
+                'BatchID': 'batch-1',
+                'ProjectId': 'project-1',
+                MESSAGE_DATE_TIME_FIELD: '2018-06-01T00:00:00Z',
+                'Amount': 12.35,
+                TRANS_DATE_FIELD: '2018-06-02T00:00:00Z',
+            },
+            {
+                'BatchID': 'batch-1',
+                'ProjectId': 'project-2',
+                MESSAGE_DATE_TIME_FIELD: '',
+                'Amount': '',
+                TRANS_DATE_FIELD: '',
+            },
+        ])
+
+    def test_rename_drop_and_defaults(self):
+        spec = {
+            'fields': {
+                'ProjectID': {'rename': 'Project'},
+                'Amount': {'drop': True},
+                'BatchID': {'default': 'unbatched'},
+                'Currency': {'default': 'USD'},
+                'Quantity': {'type': 'int', 'default': 1},
+            },
+        }
+        compiled = transform.compile_spec(spec, ['BatchID', 'ProjectID', 'Amount', 'Quantity'])
+
+        payloads = compiled.apply([['', 'project-1', '10', ''], ['batch-1', 'project-2', '20', '3']])
+
+        self.assertEqual(payloads, [
+            {'BatchID': 'unbatched', 'Project': 'project-1', 'Quantity': 1, 'Currency': 'USD'},
+            {'BatchID': 'batch-1', 'Project': 'project-2', 'Quantity': 3, 'Currency': 'USD'},
+        ])
+
+    def test_custom_date_format(self):
+        spec = {'fields': {'Posted': {'type': 'date', 'format': '%Y-%m-%d'}}}
+        compiled = transform.compile_spec(spec, ['Posted'])
+
+        self.assertEqual(compiled.apply([['6/1/2018 10:30']]), [{'Posted': '2018-06-01'}])
+
+    def test_ragged_rows_match_dict_reader(self):
+        compiled = transform.compile_spec({}, ['A', 'B'])
+
+        payloads = compiled.apply([['1'], ['1', '2', '3', '4']])
+
+        self.assertEqual(payloads, [{'A': '1', 'B': None}, {'A': '1', 'B': '2', None: ['3', '4']}])
+
+    def test_converts_repeated_values_once(self):
+        with mock.patch('src.transform.float', create=True, side_effect=float) as mock_float:
+            compiled = transform.compile_spec({'fields': {'Amount': {'type': 'float'}}}, ['Amount'])
+            payloads = compiled.apply([['1.5'], ['1.5'], ['2.5'], ['1.5']])
+
+        self.assertEqual([payload['Amount'] for payload in payloads], [1.5, 1.5, 2.5, 1.5])
+        self.assertEqual(mock_float.call_count, 2)
+
+    def test_empty_chunk(self):
+        compiled = transform.compile_spec(transform.EXPENSE_FIELD_SPEC, self.fieldnames)
+
+        self.assertEqual(compiled.apply([]), [])
+
+    def test_unknown_type_raises(self):
+        with self.assertRaises(ValueError):
+            transform.compile_spec({'fields': {'Amount': {'type': 'money'}}}, ['Amount'])
@@ -230,3 +230,108 @@ class TestTriggerReport(TestCase):
             {},
             'context',
         )
+
+    @freeze_time('2019-06-21')
+    def test_skips_validation_when_cached_config_unchanged(self):
+        self.mock_os.environ['CONFIG_CACHE'] = 'etag'
+        objects = {
+            self.template_bucket_key: self.template,
+            self.requirements_bucket_key: self.requirements_config,
+        }
+        trigger_report._validated_request_config.clear()
+
+        with mock.patch('src.trigger_report.s3_cache.fetch') as mock_cache_fetch, \
+                mock.patch('src.trigger_report.validate_schema') as mock_validate_schema:
+            mock_cache_fetch.side_effect = lambda bucket, key, ttl: (objects[key], '"etag"')
+            trigger_report.execute({}, {})
+            trigger_report.execute({}, {})
+
+        trigger_report._validated_request_config.clear()
+        self.assertEqual(mock_validate_schema.call_count, 2)
+        self.assertEqual(self.mock_expensify_api.call_args[0][0], self.payload)
+        self.mock_fetch_from_s3.assert_not_called()
+
+    @freeze_time('2019-06-21')
+    def test_sharded_export_posts_one_request_per_shard(self):
+        self.mock_os.environ['EXPORT_POLICY_SHARDS'] = '2'
+        self.mock_os.environ['EXPORT_DATE_SHARDS'] = '2'
+
+        results = trigger_report.execute({}, {})
+
+        self.assertEqual(self.mock_expensify_api.call_count, 4)
+        shards = sorted(
+            (
+                call[0][0]['request_config']['outputSettings']['fileBasename'],
+                call[0][0]['request_config']['inputSettings']['filters']['policyIDList'],
+                call[0][0]['request_config']['inputSettings']['filters']['startDate'],
+                call[0][0]['request_config']['inputSettings']['filters']['endDate'],
+            )
+            for call in self.mock_expensify_api.call_args_list
+        )
+        self.assertEqual(
+            shards,
+            [
+                ('ideoExpenses-p1d1', '1234', '2018-06-25', '2018-12-22'),
+                ('ideoExpenses-p1d2', '1234', '2018-12-23', '2019-06-21'),
+                ('ideoExpenses-p2d1', '5678', '2018-06-25', '2018-12-22'),
+                ('ideoExpenses-p2d2', '5678', '2018-12-23', '2019-06-21'),
+            ]
+        )
+        self.assertEqual([result['response'] for result in results], [self.report_name] * 4)
+
+    def test_sharded_export_collects_shard_errors(self):
+        self.mock_os.environ['EXPORT_POLICY_SHARDS'] = '2'
+        self.mock_expensify_api.side_effect = [self.mock_response, IOError('timeout')]
+
+        results = trigger_report.execute({}, {})
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(sorted('error' in result for result in results), [False, True])
+        self.assertEqual(self.mock_logger.call_args[0][0], 'Expensify shard export failed')
+
+    @freeze_time('2019-06-21')
+    def test_incremental_window_starts_before_watermark(self):
+        self.mock_os.environ['EXPORT_WINDOW'] = 'incremental'
+        self.mock_os.environ['EXPORT_WINDOW_OVERLAP_DAYS'] = '3'
+
+        with mock.patch('src.trigger_report.export_watermark') as mock_watermark:
+            mock_watermark.load.return_value = '2019-06-17'
+            trigger_report.execute({}, {})
+
+        filters = self.mock_expensify_api.call_args[0][0]['request_config']['inputSettings']['filters']
+        self.assertEqual((filters['startDate'], filters['endDate']), ('2019-06-14', '2019-06-21'))
+        mock_watermark.save.assert_called_with('2019-06-21')
+
+    @freeze_time('2019-06-21')
+    def test_incremental_window_never_starts_before_configured_start_date(self):
+        self.mock_os.environ['EXPORT_WINDOW'] = 'incremental'
+
+        with mock.patch('src.trigger_report.export_watermark') as mock_watermark:
+            mock_watermark.load.return_value = '2018-06-26'
+            trigger_report.execute({}, {})
+
+        filters = self.mock_expensify_api.call_args[0][0]['request_config']['inputSettings']['filters']
+        self.assertEqual(filters['startDate'], '2018-06-25')
+
+    @freeze_time('2019-06-21')
+    def test_full_resync_ignores_watermark(self):
+        self.mock_os.environ['EXPORT_WINDOW'] = 'incremental'
+
+        with mock.patch('src.trigger_report.export_watermark') as mock_watermark:
+            mock_watermark.load.return_value = '2019-06-17'
+            trigger_report.execute({'fullResync': True}, {})
+
+        filters = self.mock_expensify_api.call_args[0][0]['request_config']['inputSettings']['filters']
+        self.assertEqual(filters['startDate'], '2018-06-25')
+        mock_watermark.load.assert_not_called()
+        mock_watermark.save.assert_called_with('2019-06-21')
+
+    def test_watermark_not_advanced_when_export_fails(self):
+        self.mock_os.environ['EXPORT_WINDOW'] = 'incremental'
+        self.mock_response.status_code = 500
+
+        with mock.patch('src.trigger_report.export_watermark') as mock_watermark:
+            mock_watermark.load.return_value = None
+            trigger_report.execute({}, {})
+
+        mock_watermark.save.assert_not_called()